@@ -0,0 +1,89 @@
+import sys
+import os
+import time
+import argparse
+
+# Ensure project root is in sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import pandas as pd
+from data_pipeline.transformation.aqi_engine import AQI_BREAKPOINTS, AQI_CATEGORIES, POLLUTANTS, calculate_aqi_frame
+
+# Upper end of the value range drawn for each pollutant (a bit past the last breakpoint)
+VALUE_RANGES = {'pm25': 550, 'pm10': 650, 'o3': 0.25, 'no2': 1300, 'so2': 650, 'co': 35}
+
+
+# Scalar reference: the per-value functions merge_city_data applied row by row before the vectorized engine
+def calculate_aqi(pollutant, value):
+    try:
+        if value is None or pd.isna(value):
+            return None
+        value = float(value)
+        for bp_low, bp_high, aqi_low, aqi_high in AQI_BREAKPOINTS[pollutant]:
+            if bp_low <= value <= bp_high:
+                return round((aqi_high - aqi_low) / (bp_high - bp_low) * (value - bp_low) + aqi_low)
+    except:
+        return None
+    return None
+
+
+def get_aqi_category(aqi_value):
+    if aqi_value is None:
+        return None
+    for low, high, label in AQI_CATEGORIES:
+        if low <= aqi_value <= high:
+            return label
+    return "Out of Range"
+
+
+def make_sample(n_rows, missing_ratio=0.15, seed=42):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        pol: np.round(rng.uniform(0, high, n_rows), 3) for pol, high in VALUE_RANGES.items()
+    })
+    return df.mask(rng.random(df.shape) < missing_ratio)
+
+
+def legacy_aqi(df):
+    # The row-by-row path merge_city_data used before the vectorized engine
+    def row_max_aqi(row):
+        values = [calculate_aqi(pol, row[pol]) for pol in POLLUTANTS]
+        values = [v for v in values if v is not None]
+        return max(values) if values else None
+
+    aqi = df.apply(row_max_aqi, axis=1)
+    # Exactly as merge_city_data applied it: rows without any AQI are NaN here, which get_aqi_category calls "Out of Range"
+    return aqi, aqi.apply(get_aqi_category)
+
+
+def run_benchmark(n_rows):
+    df = make_sample(n_rows)
+
+    start = time.perf_counter()
+    legacy_values, legacy_categories = legacy_aqi(df)
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = calculate_aqi_frame(df)
+    vectorized_seconds = time.perf_counter() - start
+
+    # Both paths must agree before the timings mean anything
+    legacy_values = legacy_values.astype('Float64').astype('Int64')
+    same_aqi = (legacy_values.fillna(-1) == result['aqi'].fillna(-1)).all()
+    same_category = (legacy_categories.fillna('') == result['aqi_category'].fillna('')).all()
+    if not (same_aqi and same_category):
+        raise AssertionError("❌ Vectorized AQI does not match calculate_aqi/get_aqi_category")
+
+    print(f"📊 AQI benchmark on {n_rows:,} rows")
+    print(f"   row-by-row apply : {legacy_seconds:8.3f}s  ({n_rows / legacy_seconds:,.0f} rows/sec)")
+    print(f"   vectorized engine: {vectorized_seconds:8.3f}s  ({n_rows / vectorized_seconds:,.0f} rows/sec)")
+    print(f"   speedup          : {legacy_seconds / vectorized_seconds:,.1f}x")
+    return legacy_seconds, vectorized_seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare row-by-row and vectorized AQI calculation")
+    parser.add_argument("--rows", type=int, default=100_000)
+    args = parser.parse_args()
+    run_benchmark(args.rows)
@@ -0,0 +1,342 @@
+import sys
+import os
+import json
+import time
+import uuid
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Ensure project root is in sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import psycopg2
+from psycopg2 import sql
+
+from benchmarks.synthetic_data import CITIES, iter_payload_batches, write_input_files
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pipeline_baseline.json")
+DEFAULT_THRESHOLD = 0.25   # allowed relative slowdown (and growth in round trips / memory) versus the baseline
+# Scale keys that decide the generated data; runs only compare against a baseline with the same ones.
+# The others (batch size, streaming, merge workers) are how the stages run, which is what the comparison measures.
+DATA_SHAPE_KEYS = ["stations", "years", "start_year", "seed"]
+
+# Every DUPLICATE_EVERY-th observation is stored once more before remove_observation_duplicates runs
+DUPLICATE_EVERY = 10
+
+# Row count a stage is measured against when it does not report the rows it touched, read after it finished
+HISTORICAL_TABLES = [f"historical_data.{city['city']}_air_quality" for city in CITIES]
+BURDEN_TABLES = [f"burden_data.{city['country'].lower()}_dataset" for city in CITIES]
+ROW_COUNT_QUERIES = {
+    "insert_data": "SELECT COUNT(*) FROM real_time_data.observations",
+    "merge_public_sources": "SELECT COUNT(*) FROM transformations.merged_observations_pollutants",
+    "fill_gaps": "SELECT COUNT(*) FROM transformations.merged_observations_pollutants",
+    "import_historical_data": "SELECT " + " + ".join(f"(SELECT COUNT(*) FROM {t})" for t in HISTORICAL_TABLES),
+    "merge_city_data": "SELECT COUNT(*) FROM transformations.final_city_merged",
+    "import_burden_data": "SELECT " + " + ".join(f"(SELECT COUNT(*) FROM {t})" for t in BURDEN_TABLES),
+    "merge_burden_data": "SELECT COUNT(*) FROM transformations.final_city_burden_merged",
+}
+
+
+# Each stage returns what it measured itself ({"seconds", "rows"}, either optional), or None
+
+def _insert_data(scale):
+    # Only the time spent in insert_data_batch counts, not building the payloads
+    from data_pipeline.db import connection
+    from data_pipeline.insert_to_db import insert_data_batch
+
+    seconds = 0.0
+    with connection() as conn:
+        batches = iter_payload_batches(batch_size=scale["batch_size"], n_stations=scale["stations"], years=scale["years"],
+                                       start_year=scale["start_year"], seed=scale["seed"])
+        for batch in batches:
+            start = time.perf_counter()
+            insert_data_batch(conn, batch)
+            seconds += time.perf_counter() - start
+    return {"seconds": seconds}
+
+
+def _remove_observation_duplicates(scale):
+    # The unique (station_id, datetime) index from migration 2 keeps duplicates out, so it is dropped while a share
+    # of the observations is stored again, and rebuilt afterwards. Only the deduplication itself is timed.
+    from data_pipeline.db import connection
+    from data_pipeline.bulk_load import get_column_types
+    from data_pipeline.cleaning.remove_duplicates import remove_observation_duplicates
+
+    with connection() as conn:
+        cur = conn.cursor()
+        columns = ", ".join(col for col in get_column_types(cur, "real_time_data.observations") if col != "observation_id")
+        cur.execute("DROP INDEX real_time_data.observations_station_datetime_key")
+        cur.execute(f"""
+            INSERT INTO real_time_data.observations ({columns})
+            SELECT {columns} FROM real_time_data.observations
+            WHERE observation_id %% %s = 0
+            ORDER BY observation_id
+        """, (DUPLICATE_EVERY,))
+        conn.commit()
+
+        start = time.perf_counter()
+        removed = remove_observation_duplicates(conn)
+        seconds = time.perf_counter() - start
+
+        cur.execute("CREATE UNIQUE INDEX observations_station_datetime_key ON real_time_data.observations (station_id, datetime)")
+        conn.commit()
+        cur.close()
+    return {"seconds": seconds, "rows": removed}
+
+
+def _merge_public_sources(scale):
+    from data_pipeline.transformation.merge_public_sources import create_schema_and_table, merge_public_sources
+    create_schema_and_table()
+    merge_public_sources()
+
+
+def _fill_gaps(scale):
+    from data_pipeline.cleaning.fill_gaps import fill_gaps
+    fill_gaps()
+
+
+def _import_historical_data(scale):
+    from data_pipeline.ingestion.import_historical_air_quality import import_historical_data
+    import_historical_data()
+
+
+def _merge_city_data(scale):
+    from data_pipeline.transformation.merge_and_calculate_city_aqi import merge_city_data
+    merge_city_data(stream=scale["stream"], workers=scale.get("merge_workers"))
+
+
+def _update_rollups(scale):
+    # Rows: the daily buckets recomputed
+    from data_pipeline.transformation.aqi_rollups import update_rollups
+    return {"rows": update_rollups()}
+
+
+def _import_burden_data(scale):
+    from data_pipeline.ingestion.import_burden_data import import_burden_data
+    import_burden_data()
+
+
+def _merge_burden_data(scale):
+    from data_pipeline.transformation.merge_burden_with_aqi import merge_burden_data
+    merge_burden_data(stream=scale["stream"])
+
+
+# Run in this order, each on the output of the ones before (same order as main.STAGES resolves)
+BENCHMARK_STAGES = {
+    "insert_data": _insert_data,
+    "remove_observation_duplicates": _remove_observation_duplicates,
+    "merge_public_sources": _merge_public_sources,
+    "fill_gaps": _fill_gaps,
+    "import_historical_data": _import_historical_data,
+    "merge_city_data": _merge_city_data,
+    "update_rollups": _update_rollups,
+    "import_burden_data": _import_burden_data,
+    "merge_burden_data": _merge_burden_data,
+}
+
+
+def _run_stage(name, db_settings, workdir, scale):
+    # Runs in a fresh process so peak RSS and round trips belong to this stage alone.
+    # The working directory holds the generated input files and the import manifest.
+    from data_pipeline.db import configure_pool, close_pool
+    from data_pipeline.metrics import stage_scope, round_trips
+    from data_pipeline.streaming import peak_rss_mb
+
+    os.chdir(workdir)
+    configure_pool(db_settings)
+
+    start = time.perf_counter()
+    with stage_scope(name):
+        measured = BENCHMARK_STAGES[name](scale) or {}
+    elapsed = time.perf_counter() - start
+    close_pool()
+    return {"seconds": elapsed, "round_trips": round_trips(name), "peak_rss_mb": peak_rss_mb(), **measured}
+
+
+def _create_database(admin_dsn):
+    name = f"aq_benchmark_{uuid.uuid4().hex[:8]}"
+    conn = psycopg2.connect(admin_dsn)
+    conn.autocommit = True
+    conn.cursor().execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(name)))
+    conn.close()
+    return name
+
+
+def _drop_database(admin_dsn, name):
+    conn = psycopg2.connect(admin_dsn)
+    conn.autocommit = True
+    conn.cursor().execute(sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(name)))
+    conn.close()
+
+
+def _prepare_database(db_settings, scale):
+    # Schema plus the monthly partitions the synthetic range falls into, as a live database would have them
+    from datetime import date
+    from data_pipeline.db import configure_pool, connection, close_pool
+    from data_pipeline.run_daily import create_tables
+    from data_pipeline.migrations import ensure_month_partition
+
+    configure_pool(db_settings)
+    with connection() as conn:
+        create_tables(conn)
+        cur = conn.cursor()
+        for year in range(scale["start_year"], scale["start_year"] + scale["years"]):
+            for month in range(1, 13):
+                ensure_month_partition(cur, date(year, month, 1))
+        conn.commit()
+        cur.close()
+    close_pool()
+
+
+def _count_rows(db_settings, query):
+    conn = psycopg2.connect(**db_settings)
+    cur = conn.cursor()
+    cur.execute(query)
+    rows = cur.fetchone()[0] or 0
+    conn.close()
+    return rows
+
+
+def run_benchmark(scale, admin_dsn, stages=None, keep_database=False):
+    # Generate the inputs, run every stage against a throwaway database, return {stage: metrics}
+    database = _create_database(admin_dsn)
+    db_settings = {"dsn": admin_dsn, "dbname": database}
+    workdir = tempfile.mkdtemp(prefix="aq_benchmark_")
+    print(f"🧪 Benchmark database {database}, inputs in {workdir}")
+
+    results = {}
+    try:
+        csv_rows, burden_rows = write_input_files(workdir, scale["years"], scale["start_year"], scale["seed"])
+        print(f"📝 Generated {scale['stations']} stations x {scale['years']} years hourly, "
+              f"{csv_rows} CSV rows, {burden_rows} burden rows")
+        _prepare_database(db_settings, scale)
+
+        # Spawned (not forked) workers start clean: no inherited memory, connections or caches
+        context = multiprocessing.get_context("spawn")
+        for name in BENCHMARK_STAGES:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                metrics = executor.submit(_run_stage, name, db_settings, workdir, scale).result()
+            if stages and name not in stages:
+                continue
+            if "rows" not in metrics:
+                metrics["rows"] = _count_rows(db_settings, ROW_COUNT_QUERIES[name])
+            metrics["rows_per_sec"] = metrics["rows"] / metrics["seconds"] if metrics["seconds"] else 0.0
+            results[name] = metrics
+            print(f"⏱️ {name}: {metrics['rows']} rows in {metrics['seconds']:.2f}s")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        if keep_database:
+            print(f"💾 Kept database {database}")
+        else:
+            _drop_database(admin_dsn, database)
+    return results
+
+
+def compare_to_baseline(results, baseline, threshold=DEFAULT_THRESHOLD):
+    # Returns a list of regression messages, empty when every stage is within the threshold
+    regressions = []
+    for name, metrics in results.items():
+        base = baseline.get("stages", {}).get(name)
+        if base is None:
+            continue
+        if base["rows_per_sec"] and metrics["rows_per_sec"] < base["rows_per_sec"] * (1 - threshold):
+            regressions.append(f"{name}: {metrics['rows_per_sec']:,.0f} rows/sec vs {base['rows_per_sec']:,.0f} in the baseline")
+        if metrics["round_trips"] > base["round_trips"] * (1 + threshold):
+            regressions.append(f"{name}: {metrics['round_trips']} round trips vs {base['round_trips']} in the baseline")
+        if base.get("peak_rss_mb") and metrics["peak_rss_mb"] and metrics["peak_rss_mb"] > base["peak_rss_mb"] * (1 + threshold):
+            regressions.append(f"{name}: peak RSS {metrics['peak_rss_mb']:.0f} MB vs {base['peak_rss_mb']:.0f} MB in the baseline")
+    return regressions
+
+
+def print_report(results, baseline=None):
+    base_stages = (baseline or {}).get("stages", {})
+    print(f"\n📊 {'stage':<32}{'rows':>10}{'seconds':>10}{'rows/sec':>12}{'round trips':>13}{'peak RSS MB':>13}{'vs baseline':>13}")
+    for name, m in results.items():
+        base = base_stages.get(name)
+        change = f"{m['rows_per_sec'] / base['rows_per_sec'] - 1:+.0%}" if base and base["rows_per_sec"] else "-"
+        rss = f"{m['peak_rss_mb']:.0f}" if m["peak_rss_mb"] is not None else "-"
+        print(f"   {name:<32}{m['rows']:>10}{m['seconds']:>10.2f}{m['rows_per_sec']:>12,.0f}{m['round_trips']:>13}{rss:>13}{change:>13}")
+
+
+def load_baseline(path=BASELINE_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(results, scale, path=BASELINE_PATH):
+    with open(path, "w") as f:
+        json.dump({"scale": scale, "stages": results}, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"💾 Baseline saved to {path}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run every pipeline stage on synthetic data against a throwaway database")
+    parser.add_argument("--stations", type=int, default=10)
+    parser.add_argument("--years", type=int, default=1)
+    parser.add_argument("--start-year", type=int, default=2020)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=500, help="WAQI payloads per insert_data_batch call")
+    parser.add_argument("--stream", action="store_true", help="run merge_city_data/merge_burden_data in streaming mode")
+    parser.add_argument("--merge-workers", type=int, default=None,
+                        help="stations merge_city_data processes at the same time (default MERGE_CITY_WORKERS)")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARK_STAGES),
+                        help="report only these stages (earlier stages still run to produce their input)")
+    parser.add_argument("--dsn", default=os.environ.get("BENCHMARK_DSN", "dbname=postgres"),
+                        help="libpq connection string of a database used to create/drop the throwaway one "
+                             "(PGHOST, PGUSER, ... apply as usual)")
+    parser.add_argument("--baseline", default=None,
+                        help=f"baseline file (default {BASELINE_PATH}); naming one makes a missing or "
+                             "incomparable baseline an error")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--repeat", type=int, default=1, help="run everything this many times and keep each stage's best run")
+    parser.add_argument("--keep-database", action="store_true")
+    args = parser.parse_args(argv)
+
+    scale = {"stations": args.stations, "years": args.years, "start_year": args.start_year,
+             "seed": args.seed, "batch_size": args.batch_size, "stream": args.stream,
+             "merge_workers": args.merge_workers}
+    results = {}
+    for _ in range(args.repeat):
+        for name, metrics in run_benchmark(scale, args.dsn, stages=args.only, keep_database=args.keep_database).items():
+            if name not in results or metrics["rows_per_sec"] > results[name]["rows_per_sec"]:
+                results[name] = metrics
+
+    baseline_path = args.baseline or BASELINE_PATH
+    baseline = load_baseline(baseline_path)
+    mismatch = None
+    if baseline is not None:
+        base_scale = baseline.get("scale", {})
+        mismatch = {key: (base_scale.get(key), scale[key]) for key in DATA_SHAPE_KEYS if base_scale.get(key) != scale[key]}
+        if mismatch:
+            print(f"⚠️ Baseline in {baseline_path} was taken on other data "
+                  f"({', '.join(f'{key}: {old} vs {new}' for key, (old, new) in mismatch.items())}), not comparing")
+            baseline = None
+    print_report(results, baseline)
+
+    if args.save_baseline:
+        save_baseline(results, scale, baseline_path)
+        return 0
+    if mismatch:
+        print("❌ Rerun at the baseline's scale, or store a new baseline with --save-baseline")
+        return 1
+    if baseline is None:
+        print("ℹ️ No baseline to compare against, run with --save-baseline to store one")
+        return 1 if args.baseline else 0
+
+    regressions = compare_to_baseline(results, baseline, args.threshold)
+    for message in regressions:
+        print(f"❌ Regression: {message}")
+    if not regressions:
+        print(f"✅ All stages within {args.threshold:.0%} of the baseline")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
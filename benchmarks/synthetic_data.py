@@ -0,0 +1,183 @@
+import sys
+import os
+import argparse
+from datetime import datetime, timedelta
+
+# Ensure project root is in sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import pandas as pd
+
+# The three cities the transformations know by station_id (1, 2, 3 on a fresh database), in that order
+CITIES = [
+    {"station": "Beijing", "city": "beijing", "country": "China", "geo": [39.95, 116.47], "date_format": "{d:%d/%m/%Y}", "separator": ","},
+    {"station": "Delhi", "city": "delhi", "country": "India", "geo": [28.63, 77.22], "date_format": "{d.year}/{d.month}/{d.day}", "separator": ", "},
+    {"station": "Paris", "city": "paris", "country": "France", "geo": [48.86, 2.35], "date_format": "{d:%d/%m/%Y}", "separator": ","},
+]
+
+# Typical level (WAQI sub-index) and share of missing readings per pollutant
+POLLUTANT_PROFILE = {
+    "pm25": (90, 0.02), "pm10": (50, 0.05), "o3": (25, 0.10),
+    "no2": (15, 0.08), "so2": (4, 0.25), "co": (5, 0.30),
+}
+CSV_POLLUTANTS = ["pm25", "pm10", "o3", "no2", "so2", "co"]
+BURDEN_CAUSES = [
+    "Total", "Stroke", "Ischaemic Heart Disease", "Chronic Obstructive Pulmonary Disease",
+    "Lower Respiratory Infections", "Trachea, Bronchus, Lung Cancers",
+]
+BURDEN_SEXES = ["Both", "Male", "Female"]
+BURDEN_AGE_GROUPS = ["All ages", "0-4", "5-14", "15-29", "30-49", "50-59", "60-69", "70+"]
+
+HOURS_PER_CHUNK = 24 * 7
+
+
+def station_list(n_stations):
+    # The three known cities first, then made-up stations around them
+    stations = []
+    for i in range(n_stations):
+        if i < len(CITIES):
+            city = CITIES[i]
+            stations.append({"name": city["station"], "country": city["country"], "geo": city["geo"]})
+        else:
+            home = CITIES[i % len(CITIES)]
+            stations.append({
+                "name": f"Synthetic Station {i + 1:04d}",
+                "country": home["country"],
+                "geo": [round(home["geo"][0] + (i % 17) * 0.01, 4), round(home["geo"][1] + (i % 13) * 0.01, 4)],
+            })
+    return stations
+
+
+def _levels(rng, hours, n_stations, station_scale):
+    # (stations, hours) values: station level x winter peak x rush-hour peak x log-normal noise
+    day_of_year = np.array([h.timetuple().tm_yday for h in hours])
+    hour_of_day = np.array([h.hour for h in hours])
+    seasonal = 1 + 0.35 * np.cos(2 * np.pi * (day_of_year - 15) / 365)
+    diurnal = 1 + 0.25 * np.sin(2 * np.pi * (hour_of_day - 3) / 24) ** 2
+    noise = rng.lognormal(0, 0.35, size=(n_stations, len(hours)))
+    return station_scale[:, None] * seasonal[None, :] * diurnal[None, :] * noise
+
+
+def iter_waqi_payloads(n_stations=10, years=1, start_year=2020, seed=42, chunk_hours=HOURS_PER_CHUNK):
+    # Hourly WAQI feed payloads ("data" part of the response), all stations for one hour before the next hour
+    rng = np.random.default_rng(seed)
+    stations = station_list(n_stations)
+    station_scale = rng.lognormal(0, 0.4, size=n_stations)
+    start = datetime(start_year, 1, 1)
+    end = datetime(start_year + years, 1, 1)
+    total_hours = int((end - start).total_seconds() // 3600)
+
+    for offset in range(0, total_hours, chunk_hours):
+        hours = [start + timedelta(hours=h) for h in range(offset, min(offset + chunk_hours, total_hours))]
+        base = _levels(rng, hours, n_stations, station_scale)
+        values = {pol: np.round(base * level * rng.uniform(0.7, 1.3, base.shape), 1) for pol, (level, _) in POLLUTANT_PROFILE.items()}
+        missing = {pol: rng.random(base.shape) < share for pol, (_, share) in POLLUTANT_PROFILE.items()}
+        temperature = np.round(rng.normal(15, 8, base.shape), 1)
+        humidity = np.round(rng.uniform(20, 95, base.shape), 1)
+        pressure = np.round(rng.normal(1013, 8, base.shape), 1)
+        wind = np.round(rng.gamma(2, 1.5, base.shape), 1)
+        no_aqi = rng.random(base.shape) < 0.005
+
+        for h, hour in enumerate(hours):
+            time_s = hour.strftime("%Y-%m-%d %H:%M:%S")
+            for s, station in enumerate(stations):
+                iaqi = {pol: {"v": float(values[pol][s, h])} for pol in POLLUTANT_PROFILE if not missing[pol][s, h]}
+                dominant = max(iaqi, key=lambda pol: iaqi[pol]["v"]) if iaqi else None
+                iaqi.update({
+                    "t": {"v": float(temperature[s, h])}, "h": {"v": float(humidity[s, h])},
+                    "p": {"v": float(pressure[s, h])}, "w": {"v": float(wind[s, h])},
+                })
+                yield {
+                    "aqi": "-" if no_aqi[s, h] or dominant is None else int(round(iaqi[dominant]["v"])),
+                    "idx": s + 1,
+                    "dominentpol": dominant,
+                    "iaqi": iaqi,
+                    "city": {"name": station["name"], "geo": station["geo"], "country": station["country"]},
+                    "time": {"s": time_s, "tz": "+00:00"},
+                }
+
+
+def iter_payload_batches(batch_size=500, **kwargs):
+    batch = []
+    for payload in iter_waqi_payloads(**kwargs):
+        batch.append(payload)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def write_historical_csvs(folder, years=1, start_year=2020, seed=42):
+    # Daily city CSVs shaped like the aqicn.org exports in data/Air Quality Datasets, each city keeps its own date format
+    rng = np.random.default_rng(seed + 1)
+    os.makedirs(folder, exist_ok=True)
+    days = pd.date_range(datetime(start_year, 1, 1), datetime(start_year + years, 1, 1), freq="D", inclusive="left")
+    rows = 0
+    for city in CITIES:
+        base = _levels(rng, list(days.to_pydatetime()), 1, np.ones(1))[0]
+        path = os.path.join(folder, f"{city['city']}-air-quality.csv")
+        with open(path, "w", newline="") as f:
+            f.write("date, pm25, pm10, o3, no2, so2, co\n")
+            for d, day in enumerate(days):
+                cells = [city["date_format"].format(d=day)]
+                for pol in CSV_POLLUTANTS:
+                    level, share = POLLUTANT_PROFILE[pol]
+                    cells.append(" " if rng.random() < share else str(int(round(base[d] * level))))
+                f.write(city["separator"].join(cells) + "\n")
+        rows += len(days)
+    return rows
+
+
+def write_burden_workbooks(folder, years=1, start_year=2020, seed=42):
+    # WHO global health estimate workbooks shaped like data/Burden Datasets, one per country
+    rng = np.random.default_rng(seed + 2)
+    os.makedirs(folder, exist_ok=True)
+    rows = 0
+    for city in CITIES:
+        records = []
+        for year in range(start_year, start_year + years):
+            for sex in BURDEN_SEXES:
+                for age in BURDEN_AGE_GROUPS:
+                    for cause in BURDEN_CAUSES:
+                        mean = rng.uniform(1e3, 4e7)
+                        lower, upper = mean * rng.uniform(0.6, 0.9), mean * rng.uniform(1.1, 1.5)
+                        rate = rng.uniform(10, 3500)
+                        rate_lower, rate_upper = rate * rng.uniform(0.6, 0.9), rate * rng.uniform(1.1, 1.5)
+                        records.append({
+                            "Country/ territory/ area": city["country"],
+                            "Year": str(year),
+                            "Sex": sex,
+                            "Age group": age,
+                            "GHE Cause": cause,
+                            "Mean value": f"{mean:.3f}",
+                            "Mean lower value": f"{lower:.3f}",
+                            "Mean upper value": f"{upper:.3f}",
+                            "Mean value [95% CI]": f"{mean:,.0f} [{lower:,.0f} - {upper:,.0f}]".replace(",", " "),
+                            "Age-standardized rate": f"{rate:.3f}",
+                            "Age-standardized rate lower value": f"{rate_lower:.3f}",
+                            "Age-standardized rate upper value": f"{rate_upper:.3f}",
+                            "Age-standardized rate [95% CI]": f"{rate:,.2f} [{rate_lower:,.2f} - {rate_upper:,.2f}]".replace(",", " "),
+                        })
+        pd.DataFrame(records).to_excel(os.path.join(folder, f"{city['country']}_dataset.xlsx"), index=False)
+        rows += len(records)
+    return rows
+
+
+def write_input_files(root, years=1, start_year=2020, seed=42):
+    # The folders the importers read by default, relative to root
+    csv_rows = write_historical_csvs(os.path.join(root, "data", "Air Quality Datasets"), years, start_year, seed)
+    burden_rows = write_burden_workbooks(os.path.join(root, "data", "Burden Datasets"), years, start_year, seed)
+    return csv_rows, burden_rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic historical CSVs and burden workbooks")
+    parser.add_argument("root", help="folder that gets data/Air Quality Datasets and data/Burden Datasets")
+    parser.add_argument("--years", type=int, default=1)
+    parser.add_argument("--start-year", type=int, default=2020)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    csv_rows, burden_rows = write_input_files(args.root, args.years, args.start_year, args.seed)
+    print(f"✅ Wrote {csv_rows} CSV rows and {burden_rows} burden rows under {args.root}")
@@ -0,0 +1,133 @@
+import io
+from datetime import date, datetime
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+
+# Rows buffered in memory per COPY call
+COPY_CHUNK_SIZE = 50_000
+
+INTEGER_TYPES = {'smallint', 'integer', 'bigint'}
+
+
+def _quote_column(col):
+    return '"' + col.replace('"', '""') + '"'
+
+
+def _split_table_name(table):
+    schema, _, name = table.rpartition('.')
+    return schema or 'public', name
+
+
+def get_column_types(cur, table):
+    schema, name = _split_table_name(table)
+    cur.execute("""
+        SELECT column_name, data_type
+        FROM information_schema.columns
+        WHERE table_schema = %s AND table_name = %s
+    """, (schema, name))
+    return dict(cur.fetchall())
+
+
+def to_copy_text(value, integer=False):
+    # Python/NumPy/pandas value -> COPY text, None means NULL
+    if value is None or value is pd.NaT or value is pd.NA:
+        return None
+    if isinstance(value, (bool, np.bool_)):
+        return 't' if value else 'f'
+    if isinstance(value, (float, np.floating)):
+        value = float(value)
+        if value != value:
+            return None
+        if integer and value.is_integer():
+            return str(int(value))
+        return repr(value)
+    if isinstance(value, (int, np.integer)):
+        return str(int(value))
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, np.datetime64):
+        return None if np.isnat(value) else pd.Timestamp(value).isoformat(sep=' ')
+    return str(value)
+
+
+def _csv_line(values, integer_flags):
+    # Unquoted empty field is NULL in CSV COPY, quoted empty field is an empty string
+    fields = []
+    for value, integer in zip(values, integer_flags):
+        text = to_copy_text(value, integer)
+        fields.append('' if text is None else '"' + text.replace('"', '""') + '"')
+    return ','.join(fields) + '\n'
+
+
+def copy_rows(cur, table, columns, rows, column_types=None):
+    # Stream an iterable of row sequences into table with COPY FROM STDIN, chunk by chunk
+    if column_types is None:
+        column_types = get_column_types(cur, table)
+    integer_flags = [column_types.get(col) in INTEGER_TYPES for col in columns]
+    col_names = ", ".join(_quote_column(col) for col in columns)
+    copy_sql = f"COPY {table} ({col_names}) FROM STDIN WITH (FORMAT csv)"
+
+    rows = iter(rows)
+    copied = 0
+    while True:
+        chunk = list(islice(rows, COPY_CHUNK_SIZE))
+        if not chunk:
+            break
+        buffer = io.StringIO()
+        buffer.writelines(_csv_line(row, integer_flags) for row in chunk)
+        buffer.seek(0)
+        cur.copy_expert(copy_sql, buffer)
+        copied += len(chunk)
+    return copied
+
+
+def copy_dataframe(cur, table, df, columns=None, column_types=None):
+    # DataFrame columns must already carry the target column names
+    columns = list(columns or df.columns)
+    rows = df[columns].itertuples(index=False, name=None)
+    return copy_rows(cur, table, columns, rows, column_types)
+
+
+def upsert_rows(cur, table, columns, rows, conflict_columns, update_columns=None):
+    # COPY into a temp table shaped like the target, then merge with INSERT ... ON CONFLICT.
+    # update_columns=None updates every non-key column, [] keeps existing rows untouched.
+    column_types = get_column_types(cur, table)
+    _, name = _split_table_name(table)
+    temp_table = f"_bulk_{name}"
+
+    cur.execute(f"DROP TABLE IF EXISTS {temp_table}")
+    cur.execute(f"CREATE TEMP TABLE {temp_table} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+    copy_rows(cur, temp_table, columns, rows, column_types)
+
+    if update_columns is None:
+        update_columns = [col for col in columns if col not in conflict_columns]
+
+    col_names = ", ".join(_quote_column(col) for col in columns)
+    key_names = ", ".join(_quote_column(col) for col in conflict_columns)
+    if update_columns:
+        assignments = ", ".join(f"{_quote_column(col)} = EXCLUDED.{_quote_column(col)}" for col in update_columns)
+        conflict_action = f"DO UPDATE SET {assignments}"
+    else:
+        conflict_action = "DO NOTHING"
+
+    # DISTINCT ON keeps the last copied row per key so one statement never touches a row twice
+    cur.execute(f"""
+        INSERT INTO {table} ({col_names})
+        SELECT DISTINCT ON ({key_names}) {col_names}
+        FROM {temp_table}
+        ORDER BY {key_names}, ctid DESC
+        ON CONFLICT ({key_names}) {conflict_action}
+    """)
+    merged = cur.rowcount
+    cur.execute(f"DROP TABLE {temp_table}")
+    return merged
+
+
+def upsert_dataframe(cur, table, df, conflict_columns, update_columns=None, columns=None):
+    columns = list(columns or df.columns)
+    rows = df[columns].itertuples(index=False, name=None)
+    return upsert_rows(cur, table, columns, rows, conflict_columns, update_columns)
@@ -0,0 +1,172 @@
+import sys
+import os
+from datetime import timedelta
+
+# Ensure project root is in sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+import numpy as np
+import pandas as pd
+
+from config import db_config
+from data_pipeline.db import connection
+from data_pipeline.bulk_load import upsert_dataframe
+from data_pipeline.watermarks import (ALL_STATIONS, ensure_watermark_table, get_watermark, set_watermark,
+                                     reset_watermarks, rewind_watermarks)
+from data_pipeline.metrics import add_rows
+from data_pipeline.output.parquet_cache import CACHE_STAGE
+from data_pipeline.transformation.merge_and_calculate_city_aqi import WATERMARK_STAGE as CITY_AQI_STAGE
+
+MERGED_TABLE = "transformations.merged_observations_pollutants"
+FILL_COLUMNS = ['temperature', 'humidity', 'pressure', 'wind', 'pm25', 'pm10', 'o3', 'no2', 'so2', 'co']
+WATERMARK_STAGE = "fill_gaps"
+
+# Gaps whose known neighbours are further apart than this stay empty, optionally overridden in config/db_config.py
+GAP_FILL_MAX_HOURS = getattr(db_config, 'GAP_FILL_MAX_HOURS', 6)
+# Stations read and filled per query, bounds memory on a full refresh
+GAP_FILL_STATION_BATCH = getattr(db_config, 'GAP_FILL_STATION_BATCH', 500)
+
+
+def _nearest_valid(valid, stations, backwards=False):
+    # Row index of the nearest valid cell above (or below) each cell of the same station, -1 when none
+    n = len(valid)
+    positions = np.arange(n)[:, None]
+    if backwards:
+        nearest = np.where(valid, positions, n)[::-1]
+        nearest = np.minimum.accumulate(nearest, axis=0)[::-1]
+        found = nearest < n
+    else:
+        nearest = np.maximum.accumulate(np.where(valid, positions, -1), axis=0)
+        found = nearest >= 0
+    nearest = np.where(found, nearest, 0)
+    return np.where(found & (stations[nearest] == stations[:, None]), nearest, -1)
+
+
+def interpolate_gaps(df, columns=FILL_COLUMNS, max_gap=timedelta(hours=GAP_FILL_MAX_HOURS), method="time"):
+    # Linear interpolation of every column for every station at once, no per-station Python loop.
+    # df must be sorted by station_id, datetime. A missing value is filled from the nearest known values
+    # before and after it in the same station, only when those are at most max_gap apart (None: no limit).
+    # method="time" weights by timestamps, "index" by row position. Leading/trailing gaps stay missing.
+    # Returns (filled DataFrame, boolean array marking the filled cells).
+    values = df[columns].to_numpy(dtype=float, na_value=np.nan)
+    valid = ~np.isnan(values)
+    stations = df['station_id'].to_numpy()
+    times = df['datetime'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+
+    before = _nearest_valid(valid, stations)
+    after = _nearest_valid(valid, stations, backwards=True)
+    fillable = ~valid & (before >= 0) & (after >= 0)
+    if max_gap is not None:
+        fillable &= (times[np.maximum(after, 0)] - times[np.maximum(before, 0)]) <= max_gap // timedelta(microseconds=1) * 1000
+
+    position = times if method == "time" else np.arange(len(df), dtype=np.int64)
+    before, after = np.maximum(before, 0), np.maximum(after, 0)
+    span = position[after] - position[before]
+    weight = np.divide(position[:, None] - position[before], span, out=np.zeros(span.shape), where=span != 0)
+    column_index = np.arange(len(columns))[None, :]
+    interpolated = values[before, column_index] + weight * (values[after, column_index] - values[before, column_index])
+
+    filled = df.copy()
+    filled[columns] = np.where(fillable, interpolated, values)
+    return filled, fillable
+
+
+def _merged_table_kind(cur):
+    # 'r' table, 'm' materialized view (read-only, nothing to fill in place), None when missing
+    cur.execute("""
+        SELECT c.relkind FROM pg_class c
+        WHERE c.oid = to_regclass(%s)
+    """, (MERGED_TABLE,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def reset_gap_fill(cur):
+    # Next run looks at every station again (call after the merged table is rebuilt)
+    reset_watermarks(cur, WATERMARK_STAGE)
+
+
+def _windows(cur, since_id, until_id):
+    # Per station with new rows: (station_id, first, last datetime of those rows); all rows on a first run
+    cur.execute(f"""
+        SELECT station_id, MIN(datetime), MAX(datetime)
+        FROM {MERGED_TABLE}
+        WHERE observation_id > %s AND observation_id <= %s
+        GROUP BY station_id
+        ORDER BY station_id
+    """, (since_id or 0, until_id))
+    return cur.fetchall()
+
+
+def _read_windows(conn, windows, until_id, max_gap):
+    # New rows plus max_gap of context on each side: a new value can only fill, or be filled from, rows that close.
+    # Without a gap limit the context is the whole station history.
+    padding = max_gap if max_gap is not None else timedelta(days=365 * 1000)
+    stations, starts, ends = (list(col) for col in zip(*windows))
+    return pd.read_sql(f"""
+        SELECT m.observation_id, m.station_id, m.datetime, {', '.join(f'm.{col}' for col in FILL_COLUMNS)}
+        FROM unnest(%(stations)s::int[], %(starts)s::timestamp[], %(ends)s::timestamp[]) AS w (station_id, first_new, last_new)
+        JOIN {MERGED_TABLE} m
+          ON m.station_id = w.station_id
+         AND m.datetime >= w.first_new - %(padding)s AND m.datetime <= w.last_new + %(padding)s
+        WHERE m.observation_id <= %(until_id)s
+        ORDER BY m.station_id, m.datetime, m.observation_id
+    """, conn, params={"stations": stations, "starts": starts, "ends": ends, "padding": padding, "until_id": until_id})
+
+
+def fill_gaps(full_refresh=False, max_gap=timedelta(hours=GAP_FILL_MAX_HOURS), method="time"):
+    # Fill short gaps in transformations.merged_observations_pollutants in place. Only stations with rows
+    # merged since the last run are read, around their new rows; returns the number of rows updated.
+    with connection() as conn:
+        cur = conn.cursor()
+        ensure_watermark_table(cur)
+        kind = _merged_table_kind(cur)
+        if kind != 'r':
+            reason = "is a materialized view" if kind == 'm' else "does not exist yet"
+            print(f"⚠️ Skipped gap filling: {MERGED_TABLE} {reason}.")
+            conn.commit()
+            cur.close()
+            return 0
+        if full_refresh:
+            reset_gap_fill(cur)
+
+        _, since_id = get_watermark(cur, WATERMARK_STAGE)
+        cur.execute(f"SELECT COALESCE(MAX(observation_id), 0) FROM {MERGED_TABLE}")
+        until_id = cur.fetchone()[0]
+        windows = _windows(cur, since_id, until_id)
+
+        rows_read = rows_updated = cells_filled = 0
+        rewind_to = {}   # station_id -> lowest observation_id that changed
+        for offset in range(0, len(windows), GAP_FILL_STATION_BATCH):
+            df = _read_windows(conn, windows[offset:offset + GAP_FILL_STATION_BATCH], until_id, max_gap)
+            rows_read += len(df)
+            if df.empty:
+                continue
+            filled, fillable = interpolate_gaps(df, FILL_COLUMNS, max_gap, method)
+            changed = filled[fillable.any(axis=1)]
+            if changed.empty:
+                continue
+            upsert_dataframe(cur, MERGED_TABLE, changed, conflict_columns=['observation_id'],
+                             update_columns=FILL_COLUMNS, columns=['observation_id', 'station_id', 'datetime'] + FILL_COLUMNS)
+            rows_updated += len(changed)
+            cells_filled += int(fillable.sum())
+            for station_id, first_id in changed.groupby('station_id')['observation_id'].min().items():
+                rewind_to[int(station_id)] = int(first_id) - 1
+
+        # Rows that changed in place must be read again downstream
+        rewind_watermarks(cur, CITY_AQI_STAGE, rewind_to, source='waqi')
+        if rewind_to:
+            rewind_watermarks(cur, CACHE_STAGE, {ALL_STATIONS: min(rewind_to.values())}, source="merged_observations_pollutants")
+
+        set_watermark(cur, WATERMARK_STAGE, last_observation_id=until_id)
+        conn.commit()
+        cur.close()
+
+    add_rows(read=rows_read, written=rows_updated)
+    print(f"✅ Gap filling: {cells_filled} values filled in {rows_updated} rows "
+          f"({len(windows)} stations checked, {rows_read} rows read)")
+    return rows_updated
+
+
+if __name__ == "__main__":
+    fill_gaps(full_refresh="--full-refresh" in sys.argv)
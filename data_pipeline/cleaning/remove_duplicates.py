@@ -1,66 +1,87 @@
-import psycopg2
-from config.db_config import DB_CONFIG
+from data_pipeline.db import get_connection, release_connection
+from data_pipeline.watermarks import ensure_watermark_table, get_watermark, set_watermark
 
-def remove_observation_duplicates():
+WATERMARK_STAGE = "remove_observation_duplicates"
+
+# Keep the newest observation per (station_id, datetime), drop the rest (pollutant values live on the row)
+DEDUPLICATE_QUERY = """
+    WITH ranked AS (
+        SELECT
+            o.observation_id,
+            ROW_NUMBER() OVER (PARTITION BY o.station_id, o.datetime ORDER BY o.observation_id DESC) AS rn
+        FROM real_time_data.observations o
+        {window_filter}
+    ),
+    duplicates AS (
+        SELECT observation_id FROM ranked WHERE rn > 1
+    )
+    DELETE FROM real_time_data.observations o
+    USING duplicates d
+    WHERE o.observation_id = d.observation_id
+"""
+
+# Only groups that received an observation since the last run can hold new duplicates
+WINDOW_FILTER = """
+        WHERE (o.station_id, o.datetime) IN (
+            SELECT station_id, datetime
+            FROM real_time_data.observations
+            WHERE observation_id > %(since_id)s AND observation_id <= %(until_id)s
+        )
+"""
+
+
+def remove_observation_duplicates(conn=None, incremental=False):
+    # Returns the number of observations removed. Pass a connection to reuse it, otherwise one is borrowed from the pool;
+    # incremental=True only looks at rows ingested since the previous incremental run. Errors are rolled back and raised.
+    own_conn = conn is None
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
+        if own_conn:
+            conn = get_connection()
         cur = conn.cursor()
 
         print("🔍 Finding duplicate observations...")
 
         # Check if table exists
-        cur.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_schema = 'real_time_data' 
-                AND table_name = 'observations'
-            )
-        """)
-        table_exists = cur.fetchone()[0]
-
-        if not table_exists:
+        cur.execute("SELECT to_regclass('real_time_data.observations')")
+        if cur.fetchone()[0] is None:
             print("⚠️ Skipped: real_time_data.observations table does not exist yet.")
             cur.close()
-            conn.close()
-            return
+            return 0
 
-        # Step 1: Find duplicate observation_ids (same station_id and datetime)
-        cur.execute("""
-            SELECT a.observation_id
-            FROM real_time_data.observations a
-            JOIN real_time_data.observations b
-              ON a.station_id = b.station_id AND a.datetime = b.datetime
-            WHERE a.observation_id < b.observation_id
-        """)
-        duplicates = cur.fetchall()
-        duplicate_ids = [row[0] for row in duplicates]
+        cur.execute("SELECT COALESCE(MAX(observation_id), 0) FROM real_time_data.observations")
+        until_id = cur.fetchone()[0]
 
-        if not duplicate_ids:
-            print("✅ No duplicate observations found.")
+        if incremental:
+            ensure_watermark_table(cur)
+            _, since_id = get_watermark(cur, WATERMARK_STAGE)
+            query = DEDUPLICATE_QUERY.format(window_filter=WINDOW_FILTER)
+            cur.execute(query, {"since_id": since_id or 0, "until_id": until_id})
         else:
-            print(f"🧹 Removing {len(duplicate_ids)} duplicate observations...")
-
-            # Step 2: Delete related pollutants first
-            cur.execute("""
-                DELETE FROM real_time_data.pollutants
-                WHERE observation_id = ANY(%s)
-            """, (duplicate_ids,))
-
-            # Step 3: Delete duplicate observations
-            cur.execute("""
-                DELETE FROM real_time_data.observations
-                WHERE observation_id = ANY(%s)
-            """, (duplicate_ids,))
-
-            conn.commit()
-            print("✅ Duplicates removed successfully.")
+            cur.execute(DEDUPLICATE_QUERY.format(window_filter=""))
+        removed = cur.rowcount
 
+        if incremental:
+            set_watermark(cur, WATERMARK_STAGE, last_observation_id=until_id)
+        conn.commit()
         cur.close()
-        conn.close()
+
+        if removed:
+            print(f"🧹 Removed {removed} duplicate observations.")
+        else:
+            print("✅ No duplicate observations found.")
 
     except Exception as e:
+        if conn is not None and not conn.closed:
+            conn.rollback()
         print(f"❌ Error during deduplication: {e}")
+        raise
+
+    finally:
+        if own_conn and conn is not None:
+            release_connection(conn)
+
+    return removed
 
 # Only run if this file is executed directly
 if __name__ == "__main__":
-    remove_observation_duplicates()
\ No newline at end of file
+    remove_observation_duplicates()
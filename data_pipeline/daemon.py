@@ -0,0 +1,433 @@
+import os
+import sys
+import json
+import time
+import random
+import signal
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import db_config
+from config.db_config import API_TOKEN, CITIES
+from data_pipeline.db import connection, close_pool
+from data_pipeline.ingestion.fetch_waqi import (DEFAULT_MAX_WORKERS, DEFAULT_RATE, DEFAULT_BURST, TokenBucket,
+                                                WAQIFetchError, create_session, fetch_waqi_data)
+from data_pipeline.spool import append_to_spool, flush_spool, spool_backlog, dead_letter_count, payload_problem
+from data_pipeline.cleaning.remove_duplicates import remove_observation_duplicates
+from data_pipeline.last_seen import last_seen_stats
+from data_pipeline.metrics import (stage_scope, count_error, reset_metrics, run_record, write_run_record,
+                                   write_prometheus_textfile)
+from data_pipeline.run_daily import WAQI_BOUNDS, BOUNDS_LABEL, create_tables, fetch_regions
+
+# Long-running alternative to run_daily: one process keeps its HTTP session and pooled DB connection open and polls
+# every station in CITIES on its own schedule, learned from how often that station's time.s actually changes.
+# Payloads go through the spool like run_daily's; a flusher thread drains it every DAEMON_FLUSH_INTERVAL seconds.
+
+# Bounds of a station's polling interval, in seconds. New stations start at DAEMON_DEFAULT_INTERVAL (WAQI is hourly).
+DAEMON_MIN_INTERVAL = getattr(db_config, 'DAEMON_MIN_INTERVAL', 300)
+DAEMON_MAX_INTERVAL = getattr(db_config, 'DAEMON_MAX_INTERVAL', 6 * 3600)
+DAEMON_DEFAULT_INTERVAL = getattr(db_config, 'DAEMON_DEFAULT_INTERVAL', 3600)
+# How long after a station's expected next reading to poll for it (WAQI publishes a few minutes late)
+DAEMON_PUBLISH_DELAY = getattr(db_config, 'DAEMON_PUBLISH_DELAY', 300)
+# Seconds between spool flushes, between WAQI_BOUNDS polls, and between metrics snapshots
+DAEMON_FLUSH_INTERVAL = getattr(db_config, 'DAEMON_FLUSH_INTERVAL', 60)
+DAEMON_BOUNDS_INTERVAL = getattr(db_config, 'DAEMON_BOUNDS_INTERVAL', 1800)
+DAEMON_METRICS_INTERVAL = getattr(db_config, 'DAEMON_METRICS_INTERVAL', 900)
+# Health/lag endpoint; port 0 turns it off
+DAEMON_HEALTH_HOST = getattr(db_config, 'DAEMON_HEALTH_HOST', '127.0.0.1')
+DAEMON_HEALTH_PORT = getattr(db_config, 'DAEMON_HEALTH_PORT', 8787)
+# Requests per second across all stations; well under fetch_all_cities' burst rate since polls are spread out
+DAEMON_RATE = getattr(db_config, 'DAEMON_RATE', DEFAULT_RATE / 5)
+
+INTERVAL_SMOOTHING = 0.3   # weight of the newest gap between readings in the interval estimate
+UNDERSAMPLED_SHRINK = 0.8  # interval factor when every poll finds a new reading (readings may be skipped)
+JITTER = 0.05              # +/- share of the interval added to every due time
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _clamp(seconds):
+    return max(DAEMON_MIN_INTERVAL, min(DAEMON_MAX_INTERVAL, seconds))
+
+
+def _jitter(seconds):
+    return seconds * random.uniform(-JITTER, JITTER)
+
+
+def reading_time(data):
+    # time.s (station local time) of a payload as a UTC datetime, using its "tz" offset ("+08:00"); None without one
+    reading = data.get('time') or {}
+    try:
+        local = datetime.strptime(reading['s'], TIME_FORMAT)
+        sign = -1 if reading['tz'].startswith('-') else 1
+        hours, minutes = reading['tz'].lstrip('+-').split(':')
+    except (KeyError, ValueError, AttributeError):
+        return None
+    return (local - sign * timedelta(hours=int(hours), minutes=int(minutes))).replace(tzinfo=timezone.utc)
+
+
+class StationSchedule:
+    # When to poll one station next. interval estimates the time between the station's readings: it follows the gaps
+    # between successive time.s values, and shrinks while every poll finds a new reading (we may be skipping some).
+    # After a new reading the next poll is aimed just after the expected following one; after an unchanged poll the
+    # station is checked again a quarter interval later.
+    def __init__(self, city, last_time=None, interval=DAEMON_DEFAULT_INTERVAL):
+        self.city = city
+        self.interval = _clamp(interval)
+        self.last_time = last_time       # time.s of the newest reading seen
+        self.reading_at = None           # the same reading in UTC, when the payload had a tz
+        self.next_due = time.time()
+        self.last_poll = None
+        self.unchanged_polls = 0         # since the last new reading
+        self.polls = self.changes = self.failures = 0
+        self.last_error = None
+
+    def is_new(self, data):
+        return self.last_time is None or data['time']['s'] > self.last_time
+
+    def polled(self, data, now=None):
+        # Record a successful poll (payload already checked with payload_problem); returns True for a new reading
+        now = now or time.time()
+        self.polls += 1
+        self.last_poll = now
+        self.last_error = None
+        self.failures = 0
+        seen = data['time']['s']
+        if not self.is_new(data):
+            self.unchanged_polls += 1
+            self.next_due = now + _clamp(self.interval / 4) + _jitter(self.interval / 4)
+            return False
+
+        if self.last_time is not None:
+            gap = (datetime.strptime(seen, TIME_FORMAT) - datetime.strptime(self.last_time, TIME_FORMAT)).total_seconds()
+            if self.unchanged_polls == 0 and self.changes > 0:
+                self.interval = _clamp(self.interval * UNDERSAMPLED_SHRINK)
+            elif gap > 0:
+                self.interval = _clamp((1 - INTERVAL_SMOOTHING) * self.interval + INTERVAL_SMOOTHING * gap)
+        self.changes += 1
+        self.unchanged_polls = 0
+        self.last_time = seen
+        self.reading_at = reading_time(data)
+
+        expected = self.reading_at.timestamp() + self.interval if self.reading_at else now + self.interval
+        self.next_due = max(now + DAEMON_MIN_INTERVAL, expected + DAEMON_PUBLISH_DELAY) + _jitter(self.interval)
+        return True
+
+    def failed(self, error, now=None):
+        # Back off exponentially from the minimum interval, never past the current one
+        now = now or time.time()
+        self.failures += 1
+        self.last_poll = now
+        self.last_error = str(error)
+        backoff = min(self.interval, DAEMON_MIN_INTERVAL * 2 ** (self.failures - 1))
+        self.next_due = now + backoff + _jitter(backoff)
+
+    def lag(self, now=None):
+        # Seconds between the newest reading we hold and now, None when the payloads carry no tz
+        if self.reading_at is None:
+            return None
+        return max(0.0, (now or time.time()) - self.reading_at.timestamp())
+
+    def status(self, now=None):
+        now = now or time.time()
+        return {
+            "last_reading": self.last_time,
+            "lag_seconds": None if self.lag(now) is None else round(self.lag(now)),
+            "interval_seconds": round(self.interval),
+            "next_poll_in_seconds": round(self.next_due - now),
+            "last_poll": datetime.fromtimestamp(self.last_poll).isoformat(timespec="seconds") if self.last_poll else None,
+            "polls": self.polls,
+            "new_readings": self.changes,
+            "last_error": self.last_error,
+        }
+
+
+def stagger(schedules, window=DAEMON_MIN_INTERVAL, now=None):
+    # Spread the first polls evenly over window seconds instead of firing every station at once
+    now = now or time.time()
+    step = window / max(len(schedules), 1)
+    for i, schedule in enumerate(schedules):
+        schedule.next_due = now + i * step + random.uniform(0, step)
+
+
+class IngestionDaemon:
+    def __init__(self, cities=None, bounds=None, health_port=DAEMON_HEALTH_PORT, rate=DAEMON_RATE,
+                 max_workers=DEFAULT_MAX_WORKERS, base_url=None):
+        self.cities = list(CITIES if cities is None else cities)
+        self.bounds = WAQI_BOUNDS if bounds is None else bounds
+        self.health_port = health_port
+        self.max_workers = max_workers
+        self.fetch_options = {"base_url": base_url} if base_url else {}
+        self.session = create_session(max_workers)
+        self.rate_limiter = TokenBucket(rate, DEFAULT_BURST)
+        self.stop = threading.Event()
+        self.flush_now = threading.Event()
+        self.lock = threading.Lock()
+        self.schedules = {}
+        self.started_at = time.time()
+        self.next_bounds_poll = self.started_at
+        self.flush_state = {"last_success": None, "last_error": None, "flushed": 0, "inserted": 0}
+        self.schema_ready = False
+        self.server = None
+
+    def _build_schedules(self):
+        # Every station's first poll counts as a new reading; the last-seen cache drops it at flush time if it is stored
+        self.schedules = {city: StationSchedule(city) for city in self.cities}
+        stagger(list(self.schedules.values()))
+
+    def _poll(self, schedule):
+        # One station: fetch, spool a new reading, reschedule. A failure anywhere only reschedules this station;
+        # a reading that could not be spooled is not recorded, so the next poll picks it up again.
+        with stage_scope("daemon_poll"):
+            try:
+                data = fetch_waqi_data(schedule.city, API_TOKEN, session=self.session, rate_limiter=self.rate_limiter,
+                                       **self.fetch_options)
+                problem = payload_problem(data)
+                if problem is not None:
+                    raise WAQIFetchError(f"unusable payload for {schedule.city}: {problem}")
+            except Exception as e:
+                self._poll_failed(schedule, "fetch", e)
+                return
+            try:
+                with self.lock:
+                    new = schedule.is_new(data)
+                if new:
+                    append_to_spool([data], labels=[schedule.city])
+            except Exception as e:
+                self._poll_failed(schedule, "spool", e)
+                return
+            with self.lock:
+                schedule.polled(data)
+            if new:
+                self._log(f"SUCCESS: WAQI - {schedule.city} - reading {data['time']['s']}")
+
+    def _poll_failed(self, schedule, kind, error):
+        count_error(kind, schedule.city)
+        with self.lock:
+            schedule.failed(error)
+        self._log(f"ERROR: {'WAQI' if kind == 'fetch' else 'Spool'} - {schedule.city} - {error}")
+
+    def _poll_bounds(self):
+        # Every WAQI_BOUNDS box; a failure is logged and the boxes are polled again at the next bounds interval
+        with stage_scope("daemon_poll"):
+            try:
+                os.makedirs("logs", exist_ok=True)
+                log_path = f"logs/waqi_log_{datetime.now().strftime('%Y%m%d')}.txt"
+                with open(log_path, "a") as log_file:
+                    payloads = fetch_regions(self.bounds, log_file)
+                usable = [data for data in payloads if payload_problem(data) is None]
+                if len(usable) < len(payloads):
+                    count_error("fetch", BOUNDS_LABEL)
+                    self._log(f"ERROR: WAQI bounds - {len(payloads) - len(usable)} unusable payloads dropped")
+                append_to_spool(usable, labels=[BOUNDS_LABEL] * len(usable))
+            except Exception as e:
+                count_error("fetch", BOUNDS_LABEL)
+                self._log(f"ERROR: WAQI bounds - {e}")
+
+    def _due(self, now):
+        with self.lock:
+            return [s for s in self.schedules.values() if s.next_due <= now]
+
+    def _next_wakeup(self):
+        with self.lock:
+            due = [s.next_due for s in self.schedules.values()]
+        if self.bounds:
+            due.append(self.next_bounds_poll)
+        return min(due, default=time.time() + DAEMON_FLUSH_INTERVAL)
+
+    def _poll_loop(self):
+        # Sleep until the next due station, poll everything due, repeat; returns once stop is set
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while not self.stop.is_set():
+                now = time.time()
+                due = self._due(now)
+                if due:
+                    list(pool.map(self._poll, due))
+                if self.bounds and self.next_bounds_poll <= now:
+                    self._poll_bounds()
+                    self.next_bounds_poll = now + DAEMON_BOUNDS_INTERVAL + _jitter(DAEMON_BOUNDS_INTERVAL)
+                self.stop.wait(max(0.0, self._next_wakeup() - time.time()))
+
+    def _flush(self):
+        # Drain the spool on a pooled connection (kept open between flushes) and dedupe what was inserted.
+        # While the database is down, payloads pile up in the spool and the schema check is retried here.
+        with stage_scope("daemon_flush"):
+            try:
+                with connection() as conn:
+                    if not self.schema_ready:
+                        create_tables(conn)
+                        self.schema_ready = True
+                    flushed, inserted = flush_spool(conn)
+                    if inserted:
+                        self._deduplicate(conn)
+                self.flush_state.update(last_success=time.time(), last_error=None)
+                self.flush_state["flushed"] += flushed
+                self.flush_state["inserted"] += inserted
+            except Exception as e:
+                count_error("insert")
+                self.flush_state["last_error"] = str(e)
+                segments, size = spool_backlog()
+                self._log(f"ERROR: Spool flush - {e} - {size} bytes in {segments} spool segment(s) kept")
+
+    def _deduplicate(self, conn):
+        # The flushed rows are already committed, so a failed deduplication does not fail the flush;
+        # its watermark stays put so the next deduplication covers these rows too
+        try:
+            remove_observation_duplicates(conn, incremental=True)
+        except Exception as e:
+            count_error("deduplicate")
+            self._log(f"ERROR: Deduplication - {e}")
+
+    def _snapshot_metrics(self):
+        # Write what was collected since the last snapshot and start over, so memory stays flat however long we run
+        record = run_record(extra={"mode": "daemon", "stations": len(self.schedules)})
+        write_run_record(record)
+        write_prometheus_textfile(record)
+        reset_metrics()
+
+    def _flush_loop(self):
+        next_metrics = time.time() + DAEMON_METRICS_INTERVAL
+        next_maintenance = time.time() + 24 * 3600
+        while not self.stop.is_set():
+            self.flush_now.wait(DAEMON_FLUSH_INTERVAL)
+            self.flush_now.clear()
+            if time.time() >= next_maintenance:
+                # New month partitions ahead of time, as every run_daily does
+                self.schema_ready = False
+                next_maintenance = time.time() + 24 * 3600
+            self._flush()
+            if time.time() >= next_metrics:
+                self._snapshot_metrics()
+                next_metrics = time.time() + DAEMON_METRICS_INTERVAL
+
+    def health(self, now=None):
+        # (healthy, reasons): the last flush succeeded recently and at least one station was polled successfully
+        now = now or time.time()
+        reasons = []
+        if self.stop.is_set():
+            reasons.append("stopping")
+        last_flush = self.flush_state["last_success"]
+        if last_flush is None or now - last_flush > 3 * DAEMON_FLUSH_INTERVAL:
+            reasons.append("spool not flushed recently")
+        with self.lock:
+            polled = [s for s in self.schedules.values() if s.last_poll]
+            if polled and all(s.last_error for s in polled):
+                reasons.append("every station failed its last poll")
+        return not reasons, reasons
+
+    def status(self, now=None):
+        now = now or time.time()
+        healthy, reasons = self.health(now)
+        segments, size = spool_backlog()
+        with self.lock:
+            stations = {city: s.status(now) for city, s in self.schedules.items()}
+        lags = [s["lag_seconds"] for s in stations.values() if s["lag_seconds"] is not None]
+        last_flush = self.flush_state["last_success"]
+        return {
+            "status": "ok" if healthy else "unhealthy",
+            "problems": reasons,
+            "uptime_seconds": round(now - self.started_at),
+            "max_lag_seconds": max(lags, default=None),
+            "spool": {"segments": segments, "bytes": size, "dead_letters": dead_letter_count()},
+            "flush": dict(self.flush_state, last_success=datetime.fromtimestamp(last_flush).isoformat(timespec="seconds")
+                          if last_flush else None),
+            "last_seen_cache": last_seen_stats(),
+            "stations": stations,
+        }
+
+    def _start_health_server(self):
+        if not self.health_port:
+            return
+        daemon = self
+
+        class HealthHandler(BaseHTTPRequestHandler):
+            # GET /health: 200 or 503 with a one-line reason; GET /status: lag and schedule of every station
+            def do_GET(self):
+                if self.path == "/health":
+                    healthy, reasons = daemon.health()
+                    code, body = (200 if healthy else 503), {"status": "ok" if healthy else "unhealthy", "problems": reasons}
+                elif self.path == "/status":
+                    code, body = 200, daemon.status()
+                else:
+                    code, body = 404, {"error": "use /health or /status"}
+                payload = json.dumps(body, indent=2).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((DAEMON_HEALTH_HOST, self.health_port), HealthHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="health", daemon=True).start()
+        print(f"🩺 Health endpoint on http://{DAEMON_HEALTH_HOST}:{self.server.server_port}/health and /status")
+
+    def _log(self, line):
+        # A log file that cannot be written (disk full) must not stop polling
+        try:
+            os.makedirs("logs", exist_ok=True)
+            with open(f"logs/waqi_log_{datetime.now().strftime('%Y%m%d')}.txt", "a") as log_file:
+                log_file.write(f"{datetime.now()} - {line}\n")
+        except OSError as e:
+            print(f"⚠️ Could not write the WAQI log ({e}): {line}")
+
+    def request_stop(self, signum=None, frame=None):
+        if not self.stop.is_set():
+            print(f"🛑 Stopping after the polls in flight ({signal.Signals(signum).name if signum else 'requested'})")
+        self.stop.set()
+        self.flush_now.set()
+
+    def run(self):
+        # Blocks until SIGTERM/SIGINT (or request_stop); must be called from the main thread to install the handlers
+        reset_metrics()
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+
+        # Schema, partitions and whatever an earlier run left in the spool
+        self._flush()
+        self._build_schedules()
+        self._start_health_server()
+        print(f"🛰️ Polling {len(self.schedules)} stations, first polls spread over {DAEMON_MIN_INTERVAL}s")
+
+        flusher = threading.Thread(target=self._flush_loop, name="flusher")
+        flusher.start()
+        try:
+            self._poll_loop()
+        finally:
+            self.stop.set()
+            self.flush_now.set()
+            flusher.join()
+            # Everything polled before the signal reaches the database before we exit
+            self._flush()
+            self._snapshot_metrics()
+            if self.server:
+                self.server.shutdown()
+                self.server.server_close()
+            self.session.close()
+            close_pool()
+            print(f"✅ Daemon stopped: {self.flush_state['inserted']} new observations since start")
+
+
+def run_daemon(cities=None, bounds=None, health_port=DAEMON_HEALTH_PORT):
+    IngestionDaemon(cities=cities, bounds=bounds, health_port=health_port).run()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep polling WAQI into real_time_data until SIGTERM")
+    parser.add_argument("--port", type=int, default=DAEMON_HEALTH_PORT,
+                        help=f"health/status endpoint port, 0 to disable (default {DAEMON_HEALTH_PORT})")
+    parser.add_argument("--bounds", action="append", metavar="LAT1,LNG1,LAT2,LNG2",
+                        type=lambda text: tuple(float(v) for v in text.split(",")),
+                        help=f"also poll every station in this box every {DAEMON_BOUNDS_INTERVAL}s "
+                             "(repeatable, default WAQI_BOUNDS)")
+    args = parser.parse_args()
+    run_daemon(bounds=args.bounds, health_port=args.port)
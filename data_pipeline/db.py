@@ -0,0 +1,142 @@
+import os
+import sys
+import time
+import threading
+from contextlib import contextmanager
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import psycopg2
+import psycopg2.extensions
+
+from config import db_config
+from data_pipeline.metrics import MeteredConnection
+
+# Max connections open at once, optionally overridden in config/db_config.py
+POOL_MAX_CONNECTIONS = getattr(db_config, 'POOL_MAX_CONNECTIONS', 8)
+
+_settings = {
+    'db_config': None,   # None -> config.db_config.DB_CONFIG at connect time
+    'maxconn': POOL_MAX_CONNECTIONS,
+}
+_lock = threading.Lock()
+_state = {
+    'pid': None,          # process that owns the pool, a forked child starts its own
+    'generation': 0,      # bumped on close/configure so old connections are not handed out again
+    'slots': None,        # semaphore bounding open connections
+    'idle': [],           # connections ready to be reused, most recent last
+}
+_borrowed = {}   # id(conn) -> generation it was handed out in
+
+# Seconds each borrower waited for a connection (free slot + TCP/TLS handshake when a new one is opened)
+_acquire_seconds = []
+
+
+def configure_pool(db_config_override=None, maxconn=None):
+    # Point the pool at other settings (e.g. a local benchmark database); takes effect on next use
+    close_pool()
+    with _lock:
+        if db_config_override is not None:
+            _settings['db_config'] = dict(db_config_override)
+        if maxconn is not None:
+            _settings['maxconn'] = maxconn
+
+
+def pool_settings():
+    # (connection settings, maxconn) in effect, for configure_pool() in a spawned worker process
+    with _lock:
+        return dict(_settings['db_config'] or db_config.DB_CONFIG), _settings['maxconn']
+
+
+def _ensure_pool():
+    with _lock:
+        if _state['pid'] != os.getpid():
+            # Sockets inherited through fork() belong to the parent, never reuse them
+            _state['pid'] = os.getpid()
+            _state['generation'] += 1
+            _state['slots'] = threading.BoundedSemaphore(_settings['maxconn'])
+            _state['idle'] = []
+        return _state['slots'], _state['generation']
+
+
+def get_connection():
+    # Blocks until a slot is free, reuses an idle connection or opens a new one
+    start = time.perf_counter()
+    slots, generation = _ensure_pool()
+    slots.acquire()
+    try:
+        conn = None
+        with _lock:
+            while _state['idle'] and conn is None:
+                candidate = _state['idle'].pop()
+                if candidate.closed:
+                    continue
+                conn = candidate
+        if conn is None:
+            # MeteredConnection counts round trips per stage unless the settings bring their own factory
+            settings = dict(_settings['db_config'] or db_config.DB_CONFIG)
+            settings.setdefault('connection_factory', MeteredConnection)
+            conn = psycopg2.connect(**settings)
+    except Exception:
+        slots.release()
+        raise
+    _borrowed[id(conn)] = (generation, slots)
+    _acquire_seconds.append(time.perf_counter() - start)
+    return conn
+
+
+def release_connection(conn):
+    # Hand a connection back in a clean state; broken or stale ones are closed instead of reused
+    generation, slots = _borrowed.pop(id(conn), (None, None))
+    reusable = not conn.closed
+    if reusable:
+        try:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            if conn.autocommit:
+                conn.autocommit = False
+        except psycopg2.Error:
+            reusable = False
+
+    with _lock:
+        reusable = reusable and generation == _state['generation'] and _state['pid'] == os.getpid()
+        if reusable:
+            _state['idle'].append(conn)
+    if not reusable:
+        conn.close()
+    if slots is not None:
+        slots.release()
+
+
+@contextmanager
+def connection():
+    # with connection() as conn: ... borrows a pooled connection for the block
+    conn = get_connection()
+    try:
+        yield conn
+    finally:
+        release_connection(conn)
+
+
+def close_pool():
+    # Close idle connections; borrowed ones are closed when they come back
+    with _lock:
+        idle = _state['idle'] if _state['pid'] == os.getpid() else []
+        _state['idle'] = []
+        _state['generation'] += 1
+        _state['pid'] = None
+    for conn in idle:
+        conn.close()
+
+
+def acquire_stats():
+    samples = sorted(_acquire_seconds)
+    if not samples:
+        return {'count': 0, 'mean_ms': 0.0, 'p95_ms': 0.0, 'max_ms': 0.0}
+    return {
+        'count': len(samples),
+        'mean_ms': 1000 * sum(samples) / len(samples),
+        'p95_ms': 1000 * samples[min(len(samples) - 1, int(0.95 * len(samples)))],
+        'max_ms': 1000 * samples[-1],
+    }
@@ -1,8 +1,228 @@
+import math
+import time
+import random
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from data_pipeline.metrics import observe_http
+
+WAQI_BASE_URL = "https://api.waqi.info"
+
+# Fetcher defaults, all overridable per call
+DEFAULT_TIMEOUT = 10          # seconds, applied to connect and read separately
+DEFAULT_MAX_WORKERS = 8       # concurrent requests in flight
+DEFAULT_RATE = 5.0            # requests per second allowed by the token bucket
+DEFAULT_BURST = 10            # bucket capacity
+DEFAULT_RETRIES = 3           # extra attempts after the first one
+DEFAULT_BACKOFF = 0.5         # seconds, doubled on every retry
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Regions wider or taller than this (degrees) are split into tiles, one /map/bounds/ request each
+DEFAULT_TILE_DEGREES = 5.0
+
+
+class WAQIFetchError(Exception):
+    pass
+
+
+class TokenBucket:
+    # Thread-safe token bucket: acquire() blocks until a request may go out
+    def __init__(self, rate=DEFAULT_RATE, capacity=DEFAULT_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def create_session(pool_size=DEFAULT_MAX_WORKERS):
+    # One keep-alive connection pool shared by all worker threads
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _retry_delay(attempt, backoff, response=None):
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return backoff * (2 ** attempt) + random.uniform(0, backoff)
+
+
+def _get_json(url, params, label, session=None, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+              backoff=DEFAULT_BACKOFF, rate_limiter=None):
+    # GET with retries on connection errors and RETRY_STATUS_CODES; returns the "data" of an "ok" response.
+    # label names the request in errors and in the latency metrics.
+    http = session or requests
+
+    for attempt in range(retries + 1):
+        if rate_limiter:
+            rate_limiter.acquire()
+        # Every attempt is timed on its own, so retries show up in the latency percentiles
+        start = time.perf_counter()
+        try:
+            response = http.get(url, params=params, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            observe_http("waqi", label, time.perf_counter() - start, "error")
+            if attempt == retries:
+                raise WAQIFetchError(f"WAQI fetch failed for {label}: {e}") from e
+            time.sleep(_retry_delay(attempt, backoff))
+            continue
+        observe_http("waqi", label, time.perf_counter() - start, response.status_code)
+
+        if response.status_code in RETRY_STATUS_CODES and attempt < retries:
+            time.sleep(_retry_delay(attempt, backoff, response))
+            continue
+        response.raise_for_status()
+
+        res = response.json()
+        if res['status'] != 'ok':
+            raise WAQIFetchError(f"WAQI fetch failed for {label}: {res.get('data')}")
+        return res['data']
+
+
+def fetch_waqi_data(city, API_TOKEN, session=None, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                    backoff=DEFAULT_BACKOFF, rate_limiter=None, base_url=WAQI_BASE_URL, label=None):
+    # city is a feed name ("beijing") or a station uid ("@1451")
+    return _get_json(f"{base_url}/feed/{city}/", {"token": API_TOKEN}, label or city, session=session,
+                     timeout=timeout, retries=retries, backoff=backoff, rate_limiter=rate_limiter)
+
+
+def fetch_all_cities(cities, API_TOKEN, max_workers=DEFAULT_MAX_WORKERS, timeout=DEFAULT_TIMEOUT,
+                     retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, rate=DEFAULT_RATE,
+                     burst=DEFAULT_BURST, base_url=WAQI_BASE_URL, session=None):
+    # Fetch every city concurrently; returns [(city, data, error)] in the order given
+    rate_limiter = TokenBucket(rate, burst)
+    own_session = session is None
+    session = session or create_session(max_workers)
+
+    def fetch_one(city):
+        try:
+            return city, fetch_waqi_data(city, API_TOKEN, session=session, timeout=timeout, retries=retries,
+                                         backoff=backoff, rate_limiter=rate_limiter, base_url=base_url), None
+        except Exception as e:
+            return city, None, e
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(fetch_one, cities))
+    finally:
+        if own_session:
+            session.close()
+
+
+def tile_bounds(bounds, tile_degrees=DEFAULT_TILE_DEGREES):
+    # (lat1, lng1, lat2, lng2) -> equal tiles no larger than tile_degrees on either side, south-west first.
+    # Regions crossing the antimeridian have to be given as two boxes.
+    south, north = sorted((bounds[0], bounds[2]))
+    west, east = sorted((bounds[1], bounds[3]))
+    rows = max(1, math.ceil((north - south) / tile_degrees))
+    cols = max(1, math.ceil((east - west) / tile_degrees))
+    lat_step, lng_step = (north - south) / rows, (east - west) / cols
+    return [
+        (south + r * lat_step, west + c * lng_step,
+         north if r == rows - 1 else south + (r + 1) * lat_step, east if c == cols - 1 else west + (c + 1) * lng_step)
+        for r in range(rows) for c in range(cols)
+    ]
+
+
+def fetch_map_bounds(bounds, API_TOKEN, session=None, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                     backoff=DEFAULT_BACKOFF, rate_limiter=None, base_url=WAQI_BASE_URL):
+    # Every station inside one box: [{'uid', 'lat', 'lon', 'aqi', 'station': {'name', 'time'}}]
+    latlng = ",".join(f"{value:.6f}" for value in bounds)
+    return _get_json(f"{base_url}/map/bounds/", {"latlng": latlng, "token": API_TOKEN}, "map_bounds",
+                     session=session, timeout=timeout, retries=retries, backoff=backoff, rate_limiter=rate_limiter)
+
+
+def map_station_payload(entry):
+    # /map/bounds/ entry -> the /feed/ payload shape insert_data_batch reads, with the overall AQI only (no iaqi).
+    # station.time is ISO 8601 with the station's offset; time.s of a feed is the same local time without it.
+    station = entry.get('station') or {}
+    try:
+        local_time = datetime.fromisoformat(station['time']).strftime("%Y-%m-%d %H:%M:%S")
+    except (KeyError, TypeError, ValueError):
+        return None
+    return {
+        "aqi": entry.get('aqi'),
+        "idx": entry.get('uid'),
+        "dominentpol": None,
+        "iaqi": {},
+        "city": {"name": station.get('name'), "geo": [entry.get('lat'), entry.get('lon')]},
+        "time": {"s": local_time},
+    }
+
+
+def fetch_region(bounds, API_TOKEN, needs_detail=None, tile_degrees=DEFAULT_TILE_DEGREES,
+                 max_workers=DEFAULT_MAX_WORKERS, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF, rate=DEFAULT_RATE, burst=DEFAULT_BURST, base_url=WAQI_BASE_URL, session=None):
+    # All stations in a lat/lng box: one /map/bounds/ call per tile, tiles fetched concurrently.
+    # needs_detail(payload) picks the stations worth a /feed/@uid/ call for their full iaqi.
+    # Returns (payloads in feed shape, [(what, error)]); a failed tile or detail call does not stop the others.
+    rate_limiter = TokenBucket(rate, burst)
+    own_session = session is None
+    session = session or create_session(max_workers)
+    options = dict(session=session, timeout=timeout, retries=retries, backoff=backoff, rate_limiter=rate_limiter)
+    errors = []
+
+    def fetch_tile(tile):
+        try:
+            return fetch_map_bounds(tile, API_TOKEN, base_url=base_url, **options), None
+        except Exception as e:
+            return None, e
+
+    def fetch_detail(payload):
+        try:
+            data = fetch_waqi_data(f"@{payload['idx']}", API_TOKEN, base_url=base_url, label="map_detail", **options)
+        except Exception as e:
+            return payload, e
+        # Keep the map's name and position so the station maps to the same stations row either way
+        data['city'] = dict(data.get('city') or {}, name=payload['city']['name'], geo=payload['city']['geo'])
+        return data, None
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            # Tiles share their edges, so a station on one is listed twice
+            by_uid = {}
+            tiles = tile_bounds(bounds, tile_degrees)
+            for tile, (entries, error) in zip(tiles, pool.map(fetch_tile, tiles)):
+                if error is not None:
+                    errors.append((f"tile {tile}", error))
+                    continue
+                for entry in entries:
+                    payload = map_station_payload(entry)
+                    if payload is not None and payload['city']['name']:
+                        by_uid[payload['idx']] = payload
+
+            payloads = list(by_uid.values())
+            detailed = [p for p in payloads if needs_detail is not None and needs_detail(p)]
+            details = dict(zip((p['idx'] for p in detailed), pool.map(fetch_detail, detailed)))
+    finally:
+        if own_session:
+            session.close()
 
-def fetch_waqi_data(city, API_TOKEN):
-    url = f"https://api.waqi.info/feed/{city}/?token={API_TOKEN}"
-    res = requests.get(url).json()
-    if res['status'] != 'ok':
-        raise Exception(f"WAQI fetch failed for {city}")
-    return res['data']
+    result = []
+    for payload in payloads:
+        data, error = details.get(payload['idx'], (payload, None))
+        if error is not None:
+            errors.append((f"station @{payload['idx']}", error))
+        result.append(data)
+    return result, errors
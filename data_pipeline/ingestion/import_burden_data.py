@@ -1,13 +1,17 @@
 import os
 import sys
-import re
 
 # Add project root to sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import pandas as pd
-import psycopg2
-from config.db_config import DB_CONFIG
+from data_pipeline.db import connection
+from data_pipeline.bulk_load import copy_rows
+from data_pipeline.ingestion.import_manifest import check_file, record_file, UNCHANGED
+from data_pipeline.metrics import add_rows
+
+SCHEMA = "burden_data"
+MANIFEST_SECTION = "burden_data"
 
 def sanitize_table_name(filename):
     return filename.lower().replace(".xlsx", "").replace(" ", "_").replace("-", "_").replace(",", "").strip()
@@ -26,81 +30,111 @@ def sanitize_column_name(col):
         .replace("-", "_")
     )
 
-def clean_value(val):
-    if pd.isna(val):
-        return None
-    return re.sub(r"\s+", " ", str(val).replace('\xa0', ' ')).strip()
-
-def load_excel_to_table(file_path, raw_table_name):
-    print(f"📄 Loading: {file_path}")
-
-    # Load all values as strings
+def clean_text_series(values):
+    # Vectorized clean: drop [bracketed] notes, collapse whitespace (incl. non-breaking), empty -> None
+    cleaned = (
+        values.astype("string")
+        .str.replace(r"\[.*?\]", "", regex=True)
+        .str.replace(r"\s+", " ", regex=True)
+        .str.strip()
+    )
+    return cleaned.astype(object).where(cleaned.fillna("") != "", None)
+
+def _dedupe_columns(columns):
+    # "Mean value" and "Mean value [95% CI]" both clean to "Mean value": number repeats like pandas does (".1")
+    counts = {}
+    result = []
+    for col in columns:
+        if col in counts:
+            counts[col] += 1
+            result.append(f"{col}.{counts[col]}")
+        else:
+            counts[col] = 0
+            result.append(col)
+    return result
+
+def read_burden_workbook(file_path):
+    # Parse a workbook once and clean it in memory; column labels keep their (bracket-free) display names
     df = pd.read_excel(file_path, dtype=str)
+    df.columns = _dedupe_columns(clean_text_series(pd.Series(df.columns, dtype=object)).fillna("").tolist())
+    df = pd.DataFrame({col: clean_text_series(df[col]) for col in df.columns})
     df.dropna(axis=0, how="all", inplace=True)
     df.dropna(axis=1, how="all", inplace=True)
+    return df
 
+def export_cleaned_excel(df, output_path):
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    df.to_excel(output_path, index=False)
+    print(f"✅ Saved cleaned file to: {output_path}")
+
+def load_frame_to_table(df, raw_table_name):
     cleaned_columns = [sanitize_column_name(col) for col in df.columns]
-    df.columns = cleaned_columns
 
     if len(df.columns) == 0 or df.shape[0] == 0:
-        print(f"⚠️ Skipped empty file: {file_path}")
+        print(f"⚠️ Skipped empty sheet for: {raw_table_name}")
         return
 
-    schema = "burden_data"
+    schema = SCHEMA
     table_name = f"{schema}.{raw_table_name}"
 
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
-
-    # Create schema and drop table if exists
-    cur.execute(f"CREATE SCHEMA IF NOT EXISTS {schema};")
-    cur.execute(f"DROP TABLE IF EXISTS {table_name};")
-
-    # Create table
-    column_definitions = ",\n".join([f'"{col}" TEXT' for col in cleaned_columns])
-    cur.execute(f"""
-        CREATE TABLE {table_name} (
-            id SERIAL PRIMARY KEY,
-            {column_definitions}
-        );
-    """)
-
-    col_names = ", ".join([f'"{col}"' for col in cleaned_columns])
-    placeholders = ", ".join(["%s"] * len(cleaned_columns))
-    insert_sql = f"INSERT INTO {table_name} ({col_names}) VALUES ({placeholders})"
-
-    inserted = 0
-    expected_len = len(cleaned_columns)
-
-    for i, row in df.iterrows():
-        values = [clean_value(v) for v in row.tolist()]
-
-        if len(values) != expected_len:
-            print(f"❌ Skipped row {i}: expected {expected_len} values, got {len(values)}")
-            continue
-
-        if all(v is None or v == '' for v in values):
-            continue
-
-        try:
-            cur.execute(insert_sql, values)
-            inserted += 1
-        except Exception as e:
-            print(f"❌ Insert error at row {i}: {e}")
-            print(f"   → {values}")
-
-    conn.commit()
-    cur.close()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+
+        # Create schema and drop table if exists
+        cur.execute(f"CREATE SCHEMA IF NOT EXISTS {schema};")
+        cur.execute(f"DROP TABLE IF EXISTS {table_name};")
+
+        # Create table
+        column_definitions = ",\n".join([f'"{col}" TEXT' for col in cleaned_columns])
+        cur.execute(f"""
+            CREATE TABLE {table_name} (
+                id SERIAL PRIMARY KEY,
+                {column_definitions}
+            );
+        """)
+
+        inserted = copy_rows(cur, table_name, cleaned_columns, df.itertuples(index=False, name=None))
+
+        conn.commit()
+        cur.close()
+    add_rows(read=len(df), written=inserted, city=raw_table_name)
     print(f"✅ Done: {table_name} ({inserted} rows inserted)")
 
-def import_burden_data():
-    folder = "data/Cleaned Burden Datasets"
-    for filename in os.listdir(folder):
+def load_excel_to_table(file_path, raw_table_name):
+    print(f"📄 Loading: {file_path}")
+    load_frame_to_table(read_burden_workbook(file_path), raw_table_name)
+
+def _existing_tables():
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = %s", (SCHEMA,))
+        tables = {row[0] for row in cur.fetchall()}
+        cur.close()
+    return tables
+
+def import_burden_data(folder="data/Burden Datasets", force=False, export_folder=None):
+    # Raw workbooks are parsed and cleaned once, straight into the database; workbooks whose content
+    # did not change since the last load are skipped. export_folder also writes the cleaned XLSX copies.
+    existing_tables = _existing_tables()
+    for filename in sorted(os.listdir(folder)):
         if filename.endswith(".xlsx"):
             path = os.path.join(folder, filename)
             table_name = sanitize_table_name(filename)
-            load_excel_to_table(path, table_name)
+            export_path = os.path.join(export_folder, filename) if export_folder else None
+
+            status, _ = check_file(MANIFEST_SECTION, filename, path)
+            if (status == UNCHANGED and table_name in existing_tables and not force
+                    and (export_path is None or os.path.exists(export_path))):
+                print(f"⏭️ Unchanged, skipped: {filename}")
+                continue
+
+            print(f"📄 Loading: {path}")
+            df = read_burden_workbook(path)
+            load_frame_to_table(df, table_name)
+            if export_path:
+                export_cleaned_excel(df, export_path)
+            record_file(MANIFEST_SECTION, filename, path)
 
 if __name__ == "__main__":
-    import_burden_data()
+    export_folder = "data/Cleaned Burden Datasets" if "--export-cleaned" in sys.argv else None
+    import_burden_data(force="--force" in sys.argv, export_folder=export_folder)
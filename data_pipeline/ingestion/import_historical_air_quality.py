@@ -4,80 +4,208 @@ import os
 # Ensure project root is in sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+import io
+import re
 import pandas as pd
-import psycopg2
-from config.db_config import DB_CONFIG
+from data_pipeline.db import connection
+from data_pipeline.bulk_load import copy_dataframe, get_column_types
+from data_pipeline.watermarks import ensure_watermark_table, reset_watermarks
+from data_pipeline.ingestion.import_manifest import check_file, record_file, read_file, UNCHANGED, APPENDED
+from data_pipeline.transformation.merge_and_calculate_city_aqi import WATERMARK_STAGE as CITY_AQI_STAGE
+from data_pipeline.transformation.aqi_engine import POLLUTANTS
+from data_pipeline.metrics import add_rows
+
+SCHEMA = "historical_data"
+MANIFEST_SECTION = "historical_air_quality"
 
 def sanitize_table_name(filename):
     base = filename.lower().replace(".csv", "").replace("-", "_").replace(",", "").replace(" ", "_")
     return base  # Table name without schema
 
-def load_csv_as_table(file_path, raw_table_name):
-    df = pd.read_csv(file_path)
-
-    # 🧹 Clean and sort by date column if it exists
-    date_col = next((col for col in df.columns if "date" in col.lower()), None)
-    if date_col:
-    # Convert to lowercase just to match easily
-        filename_lower = raw_table_name.lower()
-
-        # Use correct parsing logic per city
-        if "delhi" in filename_lower:
-            df[date_col] = pd.to_datetime(df[date_col], dayfirst=False, errors='coerce')
-
-        else:  # Beijing and Paris are day/month/year
-            df[date_col] = pd.to_datetime(df[date_col], format="%d/%m/%Y", errors='coerce')
-
-    df = df.sort_values(by=date_col, ascending=False)
-
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
-
-    schema = "historical_data"
-    table_name = f"{schema}.{raw_table_name}"
-
-    # 🔧 Create schema if not exists
-    cur.execute(f"CREATE SCHEMA IF NOT EXISTS {schema};")
-
-    # Drop the table if it already exists
-    cur.execute(f"DROP TABLE IF EXISTS {table_name};")
-
-    # Create table based on CSV columns (all as TEXT initially)
-    columns = ",\n".join(
-        f"{col.lower().replace(' ', '_')} TEXT"
-        for col in df.columns
-    )
-
-    cur.execute(f"""
-        CREATE TABLE {table_name} (
-            id SERIAL PRIMARY KEY,
-            {columns}
-        );
-    """)
+# Tried in this order on a sample of each file. When a sample fits both, day/month wins over month/day
+# (as in the aqicn.org exports); "%Y/%m/%d" also matches unpadded dates such as Delhi's 2025/4/1.
+DATE_FORMATS = ["%Y-%m-%d", "%Y/%m/%d", "%d/%m/%Y", "%m/%d/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y%m%d"]
+DATE_SAMPLE_ROWS = 500
+
+def _normalize_header(columns):
+    # " pm25" -> "pm25", "Mean Value" -> "mean_value"
+    return [re.sub(r"\s+", "_", col.strip().lower()) for col in columns]
+
+def _date_column(columns):
+    return next((col for col in columns if "date" in col), None)
+
+def _read_csv(source, nrows=None):
+    # Raw text cells; skipinitialspace drops the blank after each comma (", 129" -> "129", ", ," -> missing)
+    df = pd.read_csv(source, dtype=str, skipinitialspace=True, nrows=nrows)
+    df.columns = _normalize_header(df.columns)
+    return df
+
+def detect_date_format(file_path, sample_rows=DATE_SAMPLE_ROWS):
+    # strptime format that parses every date in the first sample_rows rows, None if none does
+    sample = _read_csv(file_path, nrows=sample_rows)
+    date_col = _date_column(sample.columns)
+    if date_col is None:
+        return None
+    values = sample[date_col].str.strip().dropna()
+    values = values[values != ""]
+    for date_format in DATE_FORMATS:
+        if pd.to_datetime(values, format=date_format, errors='coerce').notna().all():
+            return date_format
+    return None
+
+def to_typed_frame(df, date_format, column_types=None, label=None):
+    # date column -> datetime, every other column -> float when all its non-empty cells are numbers (TEXT otherwise).
+    # Pollutant columns are always float: merge_city_data reads them as numbers, so cells that are not become NULL.
+    # column_types (column -> SQL type, as from get_column_types) keeps the types of an existing table.
+    # Returns (frame sorted newest first, column -> SQL type).
+    date_col = _date_column(df.columns)
+    types = {}
+    dropped = {}
+    for col in df.columns:
+        cells = df[col].str.strip()
+        cells = cells.where(cells != "")
+        if col == date_col:
+            # date_format None (nothing in DATE_FORMATS fit the sample) falls back to inference
+            df[col] = pd.to_datetime(cells, format=date_format, errors='coerce')
+            types[col] = "DATE"
+            continue
+        numbers = pd.to_numeric(cells, errors='coerce')
+        wanted = (column_types or {}).get(col)
+        bad = int(cells.notna().sum() - numbers.notna().sum())
+        if col in POLLUTANTS or wanted == "double precision" or (wanted is None and bad == 0):
+            df[col] = numbers
+            types[col] = "DOUBLE PRECISION"
+            if bad:
+                dropped[col] = bad
+        else:
+            df[col] = cells
+            types[col] = "TEXT"
+    if dropped:
+        print(f"⚠️ {label or 'CSV'}: non-numeric cells stored as NULL - "
+              f"{', '.join(f'{col}: {count}' for col, count in dropped.items())}")
+    if date_col is not None:
+        df = df.sort_values(by=date_col, ascending=False)
+    return df, types
+
+def _invalidate_city_aqi(cur, raw_table_name):
+    # Historical rows of this table changed, so merge_city_data must revisit them from the start, for the
+    # station(s) mapped to it in real_time_data.station_sources only. Before that table exists (migrations
+    # not applied yet) every station's csv mark is reset.
+    ensure_watermark_table(cur)
+    cur.execute("SELECT to_regclass('real_time_data.station_sources') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        reset_watermarks(cur, CITY_AQI_STAGE, source='csv')
+        return
+    cur.execute("SELECT station_id FROM real_time_data.station_sources WHERE historical_table = %s", (raw_table_name,))
+    for (station_id,) in cur.fetchall():
+        reset_watermarks(cur, CITY_AQI_STAGE, station_id=station_id, source='csv')
+
+def load_csv_as_table(file_path, raw_table_name, date_format):
+    # Returns the manifest fingerprint of the bytes loaded
+    data, fingerprint = read_file(file_path)
+    df, types = to_typed_frame(_read_csv(io.BytesIO(data)), date_format, label=os.path.basename(file_path))
+
+    with connection() as conn:
+        cur = conn.cursor()
+
+        table_name = f"{SCHEMA}.{raw_table_name}"
+
+        # 🔧 Create schema if not exists
+        cur.execute(f"CREATE SCHEMA IF NOT EXISTS {SCHEMA};")
+
+        # Drop the table if it already exists
+        cur.execute(f"DROP TABLE IF EXISTS {table_name};")
+
+        # Create table based on CSV columns: DATE for the date, DOUBLE PRECISION for measurements
+        columns = ",\n".join(
+            f"{col} {sql_type}"
+            for col, sql_type in types.items()
+        )
 
-    # Insert all rows
-    for _, row in df.iterrows():
-        values = [str(row[col]) if not pd.isna(row[col]) else None for col in df.columns]
-        placeholders = ", ".join(["%s"] * len(values))
-        col_names = ", ".join([col.lower().replace(" ", "_") for col in df.columns])
+        cur.execute(f"""
+            CREATE TABLE {table_name} (
+                id SERIAL PRIMARY KEY,
+                {columns}
+            );
+        """)
 
-        cur.execute(
-            f"INSERT INTO {table_name} ({col_names}) VALUES ({placeholders})",
-            values
-        )
+        # Bulk load all rows with COPY (NaN -> NULL)
+        copy_dataframe(cur, table_name, df)
+        _invalidate_city_aqi(cur, raw_table_name)
 
-    conn.commit()
-    cur.close()
-    conn.close()
+        conn.commit()
+        cur.close()
+    add_rows(read=len(df), written=len(df), city=raw_table_name.replace("_air_quality", ""))
     print(f"✅ Imported to table: {table_name}")
-
-def import_historical_data():
-    folder = "data/Air Quality Datasets"
-    for filename in os.listdir(folder):
+    return fingerprint
+
+def append_csv_rows(file_path, raw_table_name, loaded_bytes, date_format):
+    # Only parse what was appended after the previously loaded tail, header line reused for column names.
+    # Returns the manifest fingerprint of the file up to the end of that tail.
+    with open(file_path, "rb") as f:
+        header = f.readline()
+    tail, fingerprint = read_file(file_path, loaded_bytes)
+
+    table_name = f"{SCHEMA}.{raw_table_name}"
+    with connection() as conn:
+        cur = conn.cursor()
+        df, _ = to_typed_frame(_read_csv(io.BytesIO(header + tail)), date_format, get_column_types(cur, table_name),
+                               label=os.path.basename(file_path))
+        copy_dataframe(cur, table_name, df)
+        _invalidate_city_aqi(cur, raw_table_name)
+        conn.commit()
+        cur.close()
+    add_rows(read=len(df), written=len(df), city=raw_table_name.replace("_air_quality", ""))
+    print(f"✅ Appended {len(df)} rows to table: {table_name}")
+    return fingerprint
+
+def _existing_tables():
+    # Tables with a typed date column and no TEXT pollutant column; others (loaded by older versions, or with a
+    # stray word in a pollutant column) are left out so they get reloaded
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT table_name FROM information_schema.columns
+            WHERE table_schema = %s AND column_name LIKE '%%date%%' AND data_type = 'date'
+            EXCEPT
+            SELECT table_name FROM information_schema.columns
+            WHERE table_schema = %s AND column_name = ANY(%s) AND data_type <> 'double precision'
+        """, (SCHEMA, SCHEMA, POLLUTANTS))
+        tables = {row[0] for row in cur.fetchall()}
+        cur.close()
+    return tables
+
+def _date_format(file_path, filename, status, entry, force):
+    # Detected once per file and kept in the manifest; detected again when the file was replaced or on --force
+    if entry is not None and "date_format" in entry and status in (UNCHANGED, APPENDED) and not force:
+        return entry["date_format"]
+    date_format = detect_date_format(file_path)
+    if date_format is None:
+        print(f"⚠️ No known date format fits {filename}, dates are inferred row by row")
+    else:
+        print(f"🗓️ {filename}: dates look like {date_format}")
+    return date_format
+
+def import_historical_data(folder="data/Air Quality Datasets", force=False):
+    # Unchanged files are skipped, append-only growth only loads the new rows, anything else reloads
+    existing_tables = _existing_tables()
+    for filename in sorted(os.listdir(folder)):
         if filename.endswith(".csv"):
             file_path = os.path.join(folder, filename)
             raw_table_name = sanitize_table_name(filename)
-            load_csv_as_table(file_path, raw_table_name)
+
+            status, entry = check_file(MANIFEST_SECTION, filename, file_path)
+            if status == UNCHANGED and raw_table_name in existing_tables and not force:
+                print(f"⏭️ Unchanged, skipped: {filename}")
+                continue
+
+            date_format = _date_format(file_path, filename, status, entry, force)
+            if status == APPENDED and raw_table_name in existing_tables and not force:
+                fingerprint = append_csv_rows(file_path, raw_table_name, entry["size"], date_format)
+            else:
+                fingerprint = load_csv_as_table(file_path, raw_table_name, date_format)
+
+            record_file(MANIFEST_SECTION, filename, file_path, fingerprint=fingerprint, date_format=date_format)
 
 if __name__ == "__main__":
-    import_historical_data()
+    import_historical_data(force="--force" in sys.argv)
@@ -0,0 +1,131 @@
+import os
+import json
+import hashlib
+import threading
+
+# Content hashes, sizes and mtimes of every file the importers have loaded, per stage
+MANIFEST_PATH = "data/import_manifest.json"
+
+UNCHANGED = "unchanged"
+APPENDED = "appended"
+CHANGED = "changed"
+NEW = "new"
+
+_lock = threading.Lock()
+
+
+def load_manifest(path=MANIFEST_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_manifest(manifest, path=MANIFEST_PATH):
+    # Write to a temp file first so a crash never leaves a half-written manifest
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def file_hash(path, length=None):
+    # sha256 of the whole file, or of its first `length` bytes
+    digest = hashlib.sha256()
+    remaining = length
+    with open(path, "rb") as f:
+        while remaining is None or remaining > 0:
+            block = f.read(1 << 20 if remaining is None else min(1 << 20, remaining))
+            if not block:
+                break
+            digest.update(block)
+            if remaining is not None:
+                remaining -= len(block)
+    return digest.hexdigest()
+
+
+def read_file(path, offset=0):
+    # Bytes of a file from offset on, plus the fingerprint of everything up to where the read stopped.
+    # Recording that fingerprint instead of stat-ing the file again leaves rows appended meanwhile for the next run.
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        mtime = os.fstat(f.fileno()).st_mtime
+        remaining = offset
+        while remaining > 0:
+            block = f.read(min(1 << 20, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+        last_byte = block[-1:] if offset else b""
+        data = f.read()
+    digest.update(data)
+    size = offset - remaining + len(data)
+    return data, {
+        "size": size,
+        "mtime": mtime,
+        "sha256": digest.hexdigest(),
+        "ends_with_newline": size == 0 or (data[-1:] or last_byte) == b"\n",
+    }
+
+
+def _ends_with_newline(path):
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def check_file(section, key, path, manifest_path=MANIFEST_PATH):
+    # Compare a file against its manifest entry; returns (status, previous entry)
+    entry = load_manifest(manifest_path).get(section, {}).get(key)
+    if entry is None:
+        return NEW, None
+
+    stat = os.stat(path)
+    # Same size and mtime: trust it without reading the file
+    if stat.st_size == entry["size"] and stat.st_mtime == entry["mtime"]:
+        return UNCHANGED, entry
+
+    if stat.st_size == entry["size"]:
+        if file_hash(path) != entry["sha256"]:
+            return CHANGED, entry
+        # Only touched (e.g. fresh checkout): remember the new mtime for the fast path
+        _update_entry(section, key, manifest_path, mtime=stat.st_mtime)
+        return UNCHANGED, entry
+
+    # Grew, and everything we loaded before is still there byte for byte
+    if (stat.st_size > entry["size"] and entry.get("ends_with_newline")
+            and file_hash(path, entry["size"]) == entry["sha256"]):
+        return APPENDED, entry
+
+    return CHANGED, entry
+
+
+def _update_entry(section, key, manifest_path, **fields):
+    with _lock:
+        manifest = load_manifest(manifest_path)
+        manifest.setdefault(section, {}).setdefault(key, {}).update(fields)
+        _save_manifest(manifest, manifest_path)
+
+
+def record_file(section, key, path, manifest_path=MANIFEST_PATH, fingerprint=None, **extra):
+    # Store the fingerprint of a file after it was loaded successfully: the one read_file returned for the bytes
+    # actually loaded, or else the file's current one
+    if fingerprint is None:
+        stat = os.stat(path)
+        fingerprint = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": file_hash(path),
+            "ends_with_newline": _ends_with_newline(path),
+        }
+    entry = {**fingerprint, **extra}
+    with _lock:
+        manifest = load_manifest(manifest_path)
+        manifest.setdefault(section, {})[key] = entry
+        _save_manifest(manifest, manifest_path)
+    return entry
@@ -1,75 +1,138 @@
 import psycopg2
+from psycopg2.extras import execute_values
+from collections import Counter
 from datetime import datetime
 
-def insert_data(conn, data):
+from data_pipeline.metrics import add_rows
+from data_pipeline.last_seen import is_warmed, warm_last_seen, split_unchanged, remember
+
+POLLUTANTS = ['pm25', 'pm10', 'o3', 'co', 'no2', 'so2']
+
+# Station name -> station_id, only filled from committed transactions
+_station_ids = {}
+
+
+def clear_station_cache():
+    _station_ids.clear()
+
+
+def _to_int(value):
+    # WAQI reports missing AQI as "-"
     try:
-        cur = conn.cursor()
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _resolve_station_ids(cur, payloads):
+    # Upsert every station we have not seen yet and read back all their ids in one statement
+    new_stations = {}
+    for data in payloads:
         city_data = data['city']
+        if city_data['name'] not in _station_ids:
+            new_stations[city_data['name']] = (
+                city_data['name'],
+                city_data.get('name', 'Unknown'),
+                city_data.get('country', 'Unknown'),
+                city_data['geo'][0],
+                city_data['geo'][1]
+            )
+
+    station_ids = {name: _station_ids[name] for name in (d['city']['name'] for d in payloads) if name in _station_ids}
+    if not new_stations:
+        return station_ids
+
+    # DO UPDATE (a no-op write) rather than DO NOTHING: it waits for a concurrent insert of the same name and
+    # returns the row either way, where a separate SELECT in this snapshot could miss it. It rewrites a non-key
+    # column so the row lock does not block other writers' foreign key checks from observations, and rows are
+    # sorted by name so two writers lock their shared stations in the same order.
+    rows = execute_values(cur, """
+        INSERT INTO real_time_data.stations AS s (name, city, country, latitude, longitude)
+        VALUES %s
+        ON CONFLICT (name) DO UPDATE SET city = s.city
+        RETURNING station_id, name
+    """, sorted(new_stations.values()), template="(%s, %s, %s, %s::float, %s::float)",
+        page_size=len(new_stations), fetch=True)
+
+    station_ids.update({name: station_id for station_id, name in rows})
+    return station_ids
 
-        # Insert station or get its ID
-        cur.execute("""
-            INSERT INTO real_time_data.stations (name, city, country, latitude, longitude)
-            VALUES (%s, %s, %s, %s, %s)
-            ON CONFLICT (name) DO NOTHING
-            RETURNING station_id
-        """, (
-            city_data['name'],
-            city_data.get('name', 'Unknown'),
-            city_data.get('country', 'Unknown'),
-            city_data['geo'][0],
-            city_data['geo'][1]
-        ))
-
-        station_id = cur.fetchone()
-        if not station_id:
-            cur.execute("SELECT station_id FROM real_time_data.stations WHERE name = %s", (city_data['name'],))
-            station_id = cur.fetchone()
-        station_id = station_id[0]
-
-        # Prepare observation data
-        obs_time = datetime.strptime(data['time']['s'], "%Y-%m-%d %H:%M:%S")
-        aqi = data.get('aqi', None)
-        dominant = data.get('dominentpol', None)
-        iaqi = data.get('iaqi', {})
-
-        # 🔍 CHECK FOR EXISTING observation BEFORE INSERTING
-        cur.execute("""
-            SELECT observation_id FROM real_time_data.observations
-            WHERE station_id = %s AND datetime = %s
-        """, (station_id, obs_time))
-        existing = cur.fetchone()
-
-        if existing:
-            print(f"⚠️ Observation already exists for station {station_id} at {obs_time}")
+
+def insert_data_batch(conn, payloads, labels=None, quiet_errors=()):
+    # Write a list of WAQI payloads in one transaction, returns the number of new observations.
+    # labels name each payload's city in the run metrics (default: the station name).
+    # Errors of the quiet_errors types are raised without printing, for callers that report them themselves.
+    if not payloads:
+        return 0
+    labels = labels or [data['city']['name'] for data in payloads]
+
+    try:
+        cur = conn.cursor()
+        warming = not is_warmed()
+        if warming:
+            # Once per process, so later polls can be answered without the database
+            warm_last_seen(cur)
+
+        # Payloads with the same time.s as the last stored one are dropped before any SQL
+        new_payloads, new_labels, _ = split_unchanged(payloads, labels)
+        if not new_payloads:
+            if warming:
+                conn.commit()
             cur.close()
-            return
-
-        # INSERT OBSERVATION if not duplicate
-        cur.execute("""
-            INSERT INTO real_time_data.observations (station_id, datetime, aqi, dominant_pol, source, temperature, humidity, pressure, wind)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING observation_id
-        """, (
-            station_id, obs_time, aqi, dominant, 'waqi',
-            iaqi.get('t', {}).get('v'),
-            iaqi.get('h', {}).get('v'),
-            iaqi.get('p', {}).get('v'),
-            iaqi.get('w', {}).get('v')
-        ))
-
-        observation_id = cur.fetchone()[0]
-
-        for pol in ['pm25', 'pm10', 'o3', 'co', 'no2', 'so2']:
-            if pol in iaqi:
-                cur.execute("""
-                    INSERT INTO real_time_data.pollutants (observation_id, name, value)
-                    VALUES (%s, %s, %s)
-                """, (observation_id, pol, iaqi[pol]['v']))
+            for label, read in Counter(labels).items():
+                add_rows(read=read, written=0, city=label)
+            return 0
+
+        station_ids = _resolve_station_ids(cur, new_payloads)
+
+        # One row per (station, time), later payloads for the same key are dropped
+        observations = {}
+        for data in new_payloads:
+            station_id = station_ids[data['city']['name']]
+            obs_time = datetime.strptime(data['time']['s'], "%Y-%m-%d %H:%M:%S")
+            observations.setdefault((station_id, obs_time), data)
+
+        # Pollutant values are typed columns of the observation row (see migrations.py, version 5)
+        obs_rows = []
+        for (station_id, obs_time), data in observations.items():
+            iaqi = data.get('iaqi', {})
+            obs_rows.append((
+                station_id, obs_time, _to_int(data.get('aqi')), data.get('dominentpol', None), 'waqi',
+                iaqi.get('t', {}).get('v'),
+                iaqi.get('h', {}).get('v'),
+                iaqi.get('p', {}).get('v'),
+                iaqi.get('w', {}).get('v'),
+                *(iaqi.get(pol, {}).get('v') for pol in POLLUTANTS)
+            ))
+
+        # Existing (station_id, datetime) pairs are skipped by the unique index
+        pollutant_columns = ", ".join(POLLUTANTS)
+        inserted = execute_values(cur, f"""
+            INSERT INTO real_time_data.observations (station_id, datetime, aqi, dominant_pol, source, temperature, humidity, pressure, wind, {pollutant_columns})
+            VALUES %s
+            ON CONFLICT (station_id, datetime) DO NOTHING
+            RETURNING observation_id, station_id
+        """, obs_rows, template="(%s, %s, %s, %s, %s, %s::float, %s::float, %s::float, %s::float" + ", %s::float" * len(POLLUTANTS) + ")",
+            page_size=len(obs_rows), fetch=True)
 
         conn.commit()
         cur.close()
+        _station_ids.update(station_ids)
+        remember(new_payloads)
+
+        station_labels = {station_ids[data['city']['name']]: label for data, label in zip(new_payloads, new_labels)}
+        written = Counter(station_labels[station_id] for _, station_id in inserted)
+        for label, read in Counter(labels).items():
+            add_rows(read=read, written=written[label], city=label)
+        return len(inserted)
 
     except Exception as e:
         conn.rollback()
-        print(f"[WAQI Error] {e}")
-        raise e
\ No newline at end of file
+        if not isinstance(e, quiet_errors):
+            print(f"[WAQI Error] {e}")
+        raise e
+
+
+def insert_data(conn, data):
+    if insert_data_batch(conn, [data]) == 0:
+        print(f"⚠️ Observation already exists for station {data['city']['name']} at {data['time']['s']}")
@@ -0,0 +1,119 @@
+import os
+import sys
+import json
+import threading
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import db_config
+from data_pipeline.metrics import count_cache
+
+# Station name -> time.s of the newest observation stored for it. WAQI feeds change about once an hour, so a poll
+# that returns that time.s again (or an older one, from a stale edge cache) is dropped before insert_data_batch
+# sends any SQL.
+LAST_SEEN_PATH = getattr(db_config, 'LAST_SEEN_CACHE_PATH', 'data/last_seen_observations.json')
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_lock = threading.Lock()
+_state = {'loaded': False, 'warmed': False}
+_last_seen = {}
+_stats = {'hits': 0, 'misses': 0}
+
+
+def _load(path=LAST_SEEN_PATH):
+    # Called with _lock held; the file is only read once per process
+    if _state['loaded']:
+        return
+    _state['loaded'] = True
+    if os.path.exists(path):
+        with open(path) as f:
+            _last_seen.update(json.load(f))
+
+
+def _save(path=LAST_SEEN_PATH):
+    # Write to a temp file first so a crash never leaves a half-written cache
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(_last_seen, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def is_warmed():
+    return _state['warmed']
+
+
+def warm_last_seen(cur, path=LAST_SEEN_PATH):
+    # Newest stored observation per station, from the database. The database wins over the local file:
+    # a station it has no rows for (e.g. after a rebuild) is forgotten so its next payload is inserted.
+    cur.execute("""
+        SELECT s.name, latest.datetime
+        FROM real_time_data.stations s
+        CROSS JOIN LATERAL (
+            SELECT MAX(o.datetime) AS datetime FROM real_time_data.observations o WHERE o.station_id = s.station_id
+        ) latest
+        WHERE latest.datetime IS NOT NULL
+    """)
+    rows = cur.fetchall()
+    with _lock:
+        _state['loaded'] = _state['warmed'] = True
+        _last_seen.clear()
+        _last_seen.update({name: last.strftime(TIME_FORMAT) for name, last in rows})
+        _save(path)
+    return len(rows)
+
+
+def _is_newer(seen, last):
+    # time.s is zero-padded "%Y-%m-%d %H:%M:%S", so text order is time order and nothing needs parsing
+    return last is None or seen > last
+
+
+def split_unchanged(payloads, labels=None):
+    # (new payloads, their labels, unchanged count): a payload is unchanged when its time.s is not newer than
+    # the last one seen for its station. Counts a hit per unchanged payload and a miss per new one.
+    labels = labels or [data['city']['name'] for data in payloads]
+    fresh, fresh_labels = [], []
+    with _lock:
+        _load()
+        for data, label in zip(payloads, labels):
+            if not _is_newer(data['time']['s'], _last_seen.get(data['city']['name'])):
+                _stats['hits'] += 1
+            else:
+                _stats['misses'] += 1
+                fresh.append(data)
+                fresh_labels.append(label)
+    unchanged = len(payloads) - len(fresh)
+    count_cache("last_seen", hits=unchanged, misses=len(fresh))
+    return fresh, fresh_labels, unchanged
+
+
+def is_new(data):
+    # Same test as split_unchanged, without counting a hit or miss
+    with _lock:
+        _load()
+        return _is_newer(data['time']['s'], _last_seen.get(data['city']['name']))
+
+
+def remember(payloads, path=LAST_SEEN_PATH):
+    # Call after the payloads were committed (inserted or already there)
+    with _lock:
+        _load(path)
+        for data in payloads:
+            name, seen = data['city']['name'], data['time']['s']
+            if _is_newer(seen, _last_seen.get(name)):
+                _last_seen[name] = seen
+        _save(path)
+
+
+def last_seen_stats():
+    with _lock:
+        return dict(_stats, stations=len(_last_seen))
+
+
+def clear_last_seen():
+    # Forget everything in memory; the next use reads the file again
+    with _lock:
+        _last_seen.clear()
+        _state.update(loaded=False, warmed=False)
+        _stats.update(hits=0, misses=0)
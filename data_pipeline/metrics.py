@@ -0,0 +1,282 @@
+import os
+import sys
+import json
+import time
+import threading
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import psycopg2.extensions
+
+from config import db_config
+
+# Run records go to <METRICS_DIR>/runs/, the Prometheus textfile to <METRICS_DIR>/metrics/
+METRICS_DIR = getattr(db_config, 'METRICS_DIR', 'logs')
+PROMETHEUS_PREFIX = "air_quality_pipeline"
+HTTP_QUANTILES = [0.5, 0.9, 0.99]
+ALL = "all"   # city label for numbers that are not split by city
+
+_lock = threading.Lock()
+_current_stage = contextvars.ContextVar("metrics_stage", default=None)
+_run = {"run_id": None, "started_at": None, "start": None}
+_stages = {}                    # stage -> {'status', 'seconds', 'error'}
+_rows = defaultdict(int)        # (stage, city, 'read' | 'written') -> rows
+_round_trips = defaultdict(int) # stage -> statements, commits and server-side fetches sent
+_errors = defaultdict(int)      # (stage, city, kind) -> count
+_http = defaultdict(list)       # (service, city) -> [(seconds, status)]
+_caches = defaultdict(int)      # (cache, 'hits' | 'misses') -> count
+
+
+def reset_metrics():
+    # Start a new run record; everything collected so far is dropped
+    with _lock:
+        now = datetime.now()
+        _run.update(run_id=now.strftime("%Y%m%d_%H%M%S"), started_at=now.isoformat(timespec="seconds"),
+                    start=time.perf_counter())
+        for collected in (_stages, _rows, _round_trips, _errors, _http, _caches):
+            collected.clear()
+
+
+@contextmanager
+def stage_scope(name):
+    # Attribute rows, round trips and errors recorded in this block (same thread) to stage `name`
+    token = _current_stage.set(name)
+    try:
+        yield
+    finally:
+        _current_stage.reset(token)
+
+
+def current_stage():
+    return _current_stage.get() or "unassigned"
+
+
+def add_rows(read=0, written=0, city=ALL):
+    stage = current_stage()
+    with _lock:
+        _rows[(stage, city, "read")] += read
+        _rows[(stage, city, "written")] += written
+
+
+def count_error(kind, city=ALL):
+    with _lock:
+        _errors[(current_stage(), city, kind)] += 1
+
+
+def count_round_trip(n=1):
+    # n > 1 adds round trips made elsewhere on this stage's behalf (e.g. in a worker process)
+    stage = current_stage()
+    with _lock:
+        _round_trips[stage] += n
+
+
+def round_trips(stage=None):
+    # Round trips of one stage, or of the whole run
+    with _lock:
+        return _round_trips.get(stage, 0) if stage is not None else sum(_round_trips.values())
+
+
+def observe_http(service, city, seconds, status):
+    # One HTTP attempt (retries are separate observations); status is the HTTP code or "error"
+    with _lock:
+        _http[(service, city)].append((seconds, str(status)))
+
+
+def count_cache(cache, hits=0, misses=0):
+    with _lock:
+        _caches[(cache, "hits")] += hits
+        _caches[(cache, "misses")] += misses
+
+
+def record_stage(name, status, seconds=None, error=None):
+    with _lock:
+        _stages[name] = {"status": status, "seconds": seconds, "error": None if error is None else str(error)}
+
+
+def record_stage_results(results):
+    # Copy the outcome of stage_runner.run_stages into the run record
+    for name, r in results.items():
+        seconds = r['end'] - r['start'] if r['status'] == 'done' else None
+        record_stage(name, r['status'], seconds, r['error'])
+        if r['status'] == 'failed':
+            with _lock:
+                _errors[(name, ALL, "stage_failed")] += 1
+
+
+class MeteredCursor(psycopg2.extensions.cursor):
+    # Every call below is one request/response with the server (a named cursor also pays one per fetch)
+    def execute(self, query, vars=None):
+        count_round_trip()
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        for vars in vars_list:
+            count_round_trip()
+            super().execute(query, vars)
+
+    def copy_expert(self, sql, file, size=8192):
+        count_round_trip()
+        return super().copy_expert(sql, file, size)
+
+    def fetchmany(self, size=None):
+        if self.name:
+            count_round_trip()
+        return super().fetchmany(self.arraysize if size is None else size)
+
+    def fetchall(self):
+        if self.name:
+            count_round_trip()
+        return super().fetchall()
+
+
+class MeteredConnection(psycopg2.extensions.connection):
+    # Connection factory used by the pool so every stage's round trips are counted
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = MeteredCursor
+
+    def commit(self):
+        count_round_trip()
+        return super().commit()
+
+    def rollback(self):
+        count_round_trip()
+        return super().rollback()
+
+
+def _percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def run_record(extra=None):
+    # Everything collected since reset_metrics() as a JSON-serializable dict
+    with _lock:
+        cities = defaultdict(lambda: defaultdict(lambda: {"rows_read": 0, "rows_written": 0, "errors": {}}))
+        for (stage, city, direction), rows in _rows.items():
+            cities[stage][city][f"rows_{direction}"] += rows
+        for (stage, city, kind), count in _errors.items():
+            cities[stage][city]["errors"][kind] = count
+
+        stages = {}
+        for stage in sorted(set(_stages) | set(cities) | set(_round_trips)):
+            entry = dict(_stages.get(stage, {"status": None, "seconds": None, "error": None}))
+            entry["round_trips"] = _round_trips.get(stage, 0)
+            entry["rows_read"] = sum(c["rows_read"] for c in cities[stage].values())
+            entry["rows_written"] = sum(c["rows_written"] for c in cities[stage].values())
+            entry["errors"] = sum(sum(c["errors"].values()) for c in cities[stage].values())
+            entry["cities"] = {city: dict(c) for city, c in sorted(cities[stage].items())}
+            stages[stage] = entry
+
+        http = {}
+        for (service, city), observations in sorted(_http.items()):
+            seconds = sorted(s for s, _ in observations)
+            statuses = defaultdict(int)
+            for _, status in observations:
+                statuses[status] += 1
+            http.setdefault(service, {})[city] = {
+                "requests": len(observations),
+                "seconds_sum": sum(seconds),
+                **{f"p{int(q * 100)}_ms": 1000 * _percentile(seconds, q) for q in HTTP_QUANTILES},
+                "status": dict(statuses),
+            }
+
+        caches = {}
+        for (cache, kind), count in sorted(_caches.items()):
+            caches.setdefault(cache, {"hits": 0, "misses": 0})[kind] = count
+
+        record = {
+            "run_id": _run["run_id"],
+            "started_at": _run["started_at"],
+            "seconds": time.perf_counter() - _run["start"] if _run["start"] is not None else None,
+            "stages": stages,
+            "http": http,
+            "caches": caches,
+        }
+    record.update(extra or {})
+    return record
+
+
+def _write_atomically(path, text):
+    # Readers (node_exporter, dashboards) never see a half-written file
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def write_run_record(record, folder=None):
+    path = os.path.join(folder or os.path.join(METRICS_DIR, "runs"), f"run_{record['run_id']}.json")
+    _write_atomically(path, json.dumps(record, indent=2, default=str) + "\n")
+    return path
+
+
+def _label_text(labels):
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values())
+    return ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped))
+
+
+def prometheus_text(record):
+    # Gauges describing the last run, in the text exposition format read by node_exporter's textfile collector
+    metrics = defaultdict(list)   # name -> [(labels, value)]
+    help_text = {}
+    kinds = {}
+
+    def add(name, help_line, labels, value, kind="gauge"):
+        full_name = f"{PROMETHEUS_PREFIX}_{name}"
+        help_text.setdefault(full_name, help_line)
+        kinds.setdefault(full_name, kind)
+        metrics[full_name].append((labels, value))
+
+    started = datetime.fromisoformat(record["started_at"]).timestamp() if record.get("started_at") else 0
+    add("last_run_timestamp_seconds", "Start of the last pipeline run (unix time)", {}, started)
+    if record.get("seconds") is not None:
+        add("last_run_duration_seconds", "Wall time of the last pipeline run", {}, record["seconds"])
+
+    for stage, entry in record["stages"].items():
+        if entry["seconds"] is not None:
+            add("stage_duration_seconds", "Wall time of each stage in the last run", {"stage": stage}, entry["seconds"])
+        if entry["status"] is not None:
+            add("stage_success", "1 if the stage finished in the last run, 0 if it failed or was skipped",
+                {"stage": stage}, 1 if entry["status"] == "done" else 0)
+        add("stage_db_round_trips", "Statements, commits and server-side fetches sent by each stage",
+            {"stage": stage}, entry["round_trips"])
+        for city, c in entry["cities"].items():
+            add("rows_read", "Rows read by each stage and city", {"stage": stage, "city": city}, c["rows_read"])
+            add("rows_written", "Rows written by each stage and city", {"stage": stage, "city": city}, c["rows_written"])
+            for kind, count in c["errors"].items():
+                add("errors", "Errors by stage, city and kind", {"stage": stage, "city": city, "kind": kind}, count)
+
+    for service, cities in record["http"].items():
+        for city, h in cities.items():
+            labels = {"service": service, "city": city}
+            for q in HTTP_QUANTILES:
+                add("http_request_duration_seconds", "HTTP request latency per attempt",
+                    dict(labels, quantile=str(q)), h[f"p{int(q * 100)}_ms"] / 1000, kind="summary")
+            metrics[f"{PROMETHEUS_PREFIX}_http_request_duration_seconds_sum"].append((labels, h["seconds_sum"]))
+            metrics[f"{PROMETHEUS_PREFIX}_http_request_duration_seconds_count"].append((labels, h["requests"]))
+            for status, count in h["status"].items():
+                add("http_responses", "HTTP attempts by response status", dict(labels, status=status), count)
+
+    for cache, counts in record.get("caches", {}).items():
+        add("cache_hits", "Lookups answered by each cache in the last run", {"cache": cache}, counts["hits"])
+        add("cache_misses", "Lookups each cache could not answer in the last run", {"cache": cache}, counts["misses"])
+
+    lines = []
+    for name, samples in metrics.items():
+        if name in help_text:
+            lines += [f"# HELP {name} {help_text[name]}", f"# TYPE {name} {kinds[name]}"]
+        for labels, value in samples:
+            lines.append(f"{name}{{{_label_text(labels)}}} {value}" if labels else f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus_textfile(record, path=None):
+    path = path or os.path.join(METRICS_DIR, "metrics", f"{PROMETHEUS_PREFIX}.prom")
+    _write_atomically(path, prometheus_text(record))
+    return path
@@ -0,0 +1,358 @@
+import os
+import sys
+import json
+from datetime import datetime
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data_pipeline.db import connection
+from data_pipeline.cleaning.remove_duplicates import remove_observation_duplicates
+
+# Monthly observation partitions kept ready ahead of the current month
+FUTURE_PARTITION_MONTHS = 3
+
+# Arbitrary key for pg_advisory_lock so two processes never migrate at the same time
+MIGRATION_LOCK_KEY = 72010015
+
+
+def _month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def _add_months(month_start, months):
+    month_index = month_start.month - 1 + months
+    return datetime(month_start.year + month_index // 12, month_index % 12 + 1, 1)
+
+
+def _partition_name(month_start):
+    return f"observations_y{month_start.year}m{month_start.month:02d}"
+
+
+def ensure_month_partition(cur, month_start):
+    # Create the partition for one month. Rows that already landed in the default partition
+    # for that month are moved over first, otherwise attaching the new range would fail.
+    name = _partition_name(month_start)
+    cur.execute("SELECT to_regclass(%s)", (f"real_time_data.{name}",))
+    if cur.fetchone()[0] is not None:
+        return False
+
+    bounds = (month_start, _add_months(month_start, 1))
+    cur.execute(f"CREATE TABLE real_time_data.{name} (LIKE real_time_data.observations INCLUDING DEFAULTS)")
+    cur.execute(f"""
+        WITH moved AS (
+            DELETE FROM real_time_data.observations_default
+            WHERE datetime >= %s AND datetime < %s
+            RETURNING *
+        )
+        INSERT INTO real_time_data.{name} SELECT * FROM moved
+    """, bounds)
+    cur.execute(f"ALTER TABLE real_time_data.observations ATTACH PARTITION real_time_data.{name} FOR VALUES FROM (%s) TO (%s)", bounds)
+    return True
+
+
+def maintain_partitions(cur, months_ahead=FUTURE_PARTITION_MONTHS, today=None):
+    # Partitions for the current month and the next months_ahead ones, plus one for every month that
+    # has rows sitting in the default partition (late or backfilled data). Returns how many were created.
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('real_time_data.observations')")
+    row = cur.fetchone()
+    if row is None or row[0] != 'p':
+        return 0
+    current = _month_start(today or datetime.now())
+    months = {_add_months(current, i) for i in range(months_ahead + 1)}
+
+    # The default partition only ever holds a handful of stray rows, so scanning it is cheap
+    cur.execute("""
+        SELECT DISTINCT date_trunc('month', datetime) FROM real_time_data.observations_default
+        WHERE datetime IS NOT NULL
+    """)
+    months.update(row[0] for row in cur.fetchall())
+    return sum(ensure_month_partition(cur, month) for month in sorted(months))
+
+
+# === MIGRATIONS ===
+# Each one runs once, in its own transaction, and is recorded in real_time_data.schema_migrations.
+# They are written to be safe on databases created before migrations existed.
+
+def _create_base_tables(conn, cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS real_time_data.stations (
+            station_id SERIAL PRIMARY KEY,
+            name TEXT UNIQUE,
+            city TEXT,
+            country TEXT,
+            latitude FLOAT,
+            longitude FLOAT
+        );
+
+        CREATE TABLE IF NOT EXISTS real_time_data.observations (
+            observation_id SERIAL PRIMARY KEY,
+            station_id INTEGER REFERENCES real_time_data.stations(station_id),
+            datetime TIMESTAMP,
+            aqi INTEGER,
+            dominant_pol TEXT,
+            source TEXT,
+            temperature FLOAT,
+            humidity FLOAT,
+            pressure FLOAT,
+            wind FLOAT
+        );
+
+        CREATE TABLE IF NOT EXISTS real_time_data.pollutants (
+            pollutant_id SERIAL PRIMARY KEY,
+            observation_id INTEGER REFERENCES real_time_data.observations(observation_id),
+            name TEXT,
+            value FLOAT
+        );
+    """)
+
+
+def _unique_station_datetime(conn, cur):
+    # Unique (station_id, datetime) lets the batch writer skip known observations with ON CONFLICT.
+    # Existing duplicates would block the index, so clear them out first.
+    cur.execute("SELECT to_regclass('real_time_data.observations_station_datetime_key')")
+    if cur.fetchone()[0] is None:
+        conn.commit()
+        remove_observation_duplicates(conn)
+        cur.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS observations_station_datetime_key
+            ON real_time_data.observations (station_id, datetime);
+        """)
+
+
+def _pollutants_covering_index(conn, cur):
+    # The pivot in merge_public_sources and the deduplication join pollutants on observation_id;
+    # INCLUDE lets the pivot read name/value from the index alone
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS pollutants_observation_id_idx
+        ON real_time_data.pollutants (observation_id) INCLUDE (name, value);
+    """)
+
+
+def _partition_observations(conn, cur):
+    # Rebuild observations as a table range-partitioned by month on datetime.
+    # Unique indexes on a partitioned table must contain the partition key, so observation_id is
+    # unique together with datetime (the sequence still hands out unique ids), and pollutants can
+    # no longer hold a foreign key to it.
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = 'real_time_data.observations'::regclass")
+    if cur.fetchone()[0] == 'p':
+        return
+
+    cur.execute("SELECT pg_get_serial_sequence('real_time_data.observations', 'observation_id')")
+    sequence = cur.fetchone()[0]
+    cur.execute("""
+        SELECT DISTINCT date_trunc('month', datetime) FROM real_time_data.observations
+        WHERE datetime IS NOT NULL
+    """)
+    months_with_data = sorted(row[0] for row in cur.fetchall())
+
+    cur.execute(f"""
+        ALTER TABLE real_time_data.pollutants DROP CONSTRAINT IF EXISTS pollutants_observation_id_fkey;
+        ALTER TABLE real_time_data.observations RENAME TO observations_unpartitioned;
+        ALTER INDEX IF EXISTS real_time_data.observations_station_datetime_key
+            RENAME TO observations_unpartitioned_station_datetime_key;
+
+        CREATE TABLE real_time_data.observations (
+            observation_id INTEGER NOT NULL DEFAULT nextval('{sequence}'),
+            station_id INTEGER REFERENCES real_time_data.stations(station_id),
+            datetime TIMESTAMP,
+            aqi INTEGER,
+            dominant_pol TEXT,
+            source TEXT,
+            temperature FLOAT,
+            humidity FLOAT,
+            pressure FLOAT,
+            wind FLOAT
+        ) PARTITION BY RANGE (datetime);
+
+        ALTER SEQUENCE {sequence} OWNED BY real_time_data.observations.observation_id;
+        CREATE UNIQUE INDEX observations_observation_id_key ON real_time_data.observations (observation_id, datetime);
+        CREATE UNIQUE INDEX observations_station_datetime_key ON real_time_data.observations (station_id, datetime);
+        CREATE TABLE real_time_data.observations_default PARTITION OF real_time_data.observations DEFAULT;
+    """)
+
+    # One partition per month that has data, plus the upcoming ones
+    for month in months_with_data:
+        ensure_month_partition(cur, month)
+    maintain_partitions(cur)
+
+    columns = "observation_id, station_id, datetime, aqi, dominant_pol, source, temperature, humidity, pressure, wind"
+    cur.execute(f"""
+        INSERT INTO real_time_data.observations ({columns})
+        SELECT {columns} FROM real_time_data.observations_unpartitioned
+    """)
+    # CASCADE also drops a materialized merged_observations_pollutants built on the old table;
+    # create_schema_and_table(materialized_view=True) recreates it on the next run
+    cur.execute("DROP TABLE real_time_data.observations_unpartitioned CASCADE")
+
+
+POLLUTANT_COLUMNS = ['pm25', 'pm10', 'o3', 'co', 'no2', 'so2']
+
+
+def _pollutant_columns(conn, cur):
+    # Pollutant values move from one pollutants row per (observation, name) onto typed columns of the
+    # observation itself. Existing rows are pivoted over once; pollutants becomes a read-only view with
+    # the old shape for readers that still expect it (pollutant_id no longer exists and is always NULL).
+    cur.execute("ALTER TABLE real_time_data.observations "
+                + ", ".join(f"ADD COLUMN IF NOT EXISTS {pol} DOUBLE PRECISION" for pol in POLLUTANT_COLUMNS))
+
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('real_time_data.pollutants')")
+    row = cur.fetchone()
+    if row is not None and row[0] == 'r':
+        pivot = ", ".join(f"MAX(CASE WHEN name = '{pol}' THEN value END) AS {pol}" for pol in POLLUTANT_COLUMNS)
+        cur.execute(f"""
+            UPDATE real_time_data.observations o
+            SET {", ".join(f"{pol} = p.{pol}" for pol in POLLUTANT_COLUMNS)}
+            FROM (
+                SELECT observation_id, {pivot}
+                FROM real_time_data.pollutants
+                GROUP BY observation_id
+            ) p
+            WHERE o.observation_id = p.observation_id
+        """)
+        # CASCADE also drops a materialized merged_observations_pollutants built on the old table
+        cur.execute("DROP TABLE real_time_data.pollutants CASCADE")
+
+    values = ", ".join(f"('{pol}', o.{pol})" for pol in POLLUTANT_COLUMNS)
+    cur.execute(f"""
+        CREATE OR REPLACE VIEW real_time_data.pollutants AS
+        SELECT NULL::INTEGER AS pollutant_id, o.observation_id, v.name, v.value
+        FROM real_time_data.observations o
+        CROSS JOIN LATERAL (VALUES {values}) AS v (name, value)
+        WHERE v.value IS NOT NULL
+    """)
+
+
+# Where each station's historical CSV table and burden workbook live; these three used to be hard-coded
+# in the transformations, new stations get a row here (either side may be NULL)
+DEFAULT_STATION_SOURCES = [
+    (1, "beijing_air_quality", "china_dataset"),
+    (2, "delhi_air_quality", "india_dataset"),
+    (3, "paris_air_quality", "france_dataset"),
+]
+
+
+def _station_sources(conn, cur):
+    # No foreign key to stations: a mapping may be added before the station's first live reading
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS real_time_data.station_sources (
+            station_id INTEGER PRIMARY KEY,
+            historical_table TEXT,
+            burden_table TEXT
+        );
+    """)
+    cur.executemany("""
+        INSERT INTO real_time_data.station_sources (station_id, historical_table, burden_table)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (station_id) DO NOTHING
+    """, DEFAULT_STATION_SOURCES)
+
+
+MIGRATIONS = [
+    (1, "create base tables", _create_base_tables),
+    (2, "unique observations (station_id, datetime)", _unique_station_datetime),
+    (3, "covering index on pollutants (observation_id)", _pollutants_covering_index),
+    (4, "partition observations by month", _partition_observations),
+    (5, "pollutant values as observation columns", _pollutant_columns),
+    (6, "station to historical/burden table mapping", _station_sources),
+]
+
+
+def apply_migrations(conn):
+    # Bring real_time_data up to the latest version; returns the versions applied in this call
+    cur = conn.cursor()
+    cur.execute("CREATE SCHEMA IF NOT EXISTS real_time_data;")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS real_time_data.schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at TIMESTAMP DEFAULT now()
+        );
+    """)
+    conn.commit()
+
+    applied = []
+    cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+    try:
+        cur.execute("SELECT version FROM real_time_data.schema_migrations")
+        done = {row[0] for row in cur.fetchall()}
+        for version, name, migrate in MIGRATIONS:
+            if version in done:
+                continue
+            print(f"🛠️ Applying migration {version}: {name}")
+            migrate(conn, cur)
+            cur.execute("INSERT INTO real_time_data.schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+            conn.commit()
+            applied.append(version)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+        conn.commit()
+        cur.close()
+    return applied
+
+
+# === PLAN CHECKS ===
+# Hot-path queries and the relation whose index each one should use. Sequential scans are disabled
+# while explaining, so a tiny table still shows whether an index path exists at all.
+PLAN_CHECKS = [
+    ("insert_data conflict lookup", "observations", """
+        SELECT observation_id FROM real_time_data.observations
+        WHERE station_id = 1 AND datetime = date_trunc('hour', now()::timestamp)
+    """),
+    ("deduplication window", "observations", """
+        SELECT station_id, datetime FROM real_time_data.observations
+        WHERE observation_id > 0 AND observation_id <= 100
+    """),
+    ("merge_public_sources window", "observations", """
+        SELECT observation_id, pm25, pm10, o3, no2, so2, co FROM real_time_data.observations
+        WHERE observation_id > 0 AND observation_id <= 100
+    """),
+]
+
+
+def _index_scans(plan, relation=""):
+    # (relation, index) for every index-based node in an EXPLAIN (FORMAT JSON) plan;
+    # bitmap index scans carry no relation of their own, they read it from the heap scan above
+    relation = plan.get("Relation Name", relation)
+    found = [(relation, plan["Index Name"])] if "Index Name" in plan else []
+    for child in plan.get("Plans", []):
+        found += _index_scans(child, relation)
+    return found
+
+
+def check_query_plans(conn):
+    # Returns {check name: True/False}; prints the plan of every check that falls back to a seq scan
+    results = {}
+    cur = conn.cursor()
+    try:
+        cur.execute("SET LOCAL enable_seqscan = off")
+        for name, relation, query in PLAN_CHECKS:
+            cur.execute(f"EXPLAIN (FORMAT JSON) {query}")
+            plan = cur.fetchone()[0]
+            plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+            scans = _index_scans(plan)
+            ok = any(rel.startswith(relation) for rel, _ in scans)
+            results[name] = ok
+            if ok:
+                print(f"✅ {name}: {', '.join(sorted({index for _, index in scans}))}")
+            else:
+                print(f"❌ {name}: no index path\n{json.dumps(plan, indent=2)}")
+    finally:
+        conn.rollback()
+        cur.close()
+    return results
+
+
+if __name__ == "__main__":
+    with connection() as conn:
+        applied = apply_migrations(conn)
+        cur = conn.cursor()
+        created = maintain_partitions(cur)
+        conn.commit()
+        cur.close()
+        print(f"✅ Schema up to date ({len(applied)} migrations applied, {created} partitions created)")
+        if "--check" in sys.argv:
+            sys.exit(0 if all(check_query_plans(conn).values()) else 1)
@@ -0,0 +1,179 @@
+import os
+import sys
+import shutil
+from datetime import datetime
+from functools import reduce
+
+import pandas as pd
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+# pyarrow is optional: without it the cache is skipped and readers have to query the database
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from config import db_config
+from data_pipeline.db import connection
+from data_pipeline.watermarks import ensure_watermark_table, get_watermark, set_watermark, reset_watermarks
+from data_pipeline.metrics import add_rows
+
+# Local copy of the analytical tables, one Parquet file per station_id=<id>/year=<yyyy> partition
+PARQUET_CACHE_DIR = getattr(db_config, 'PARQUET_CACHE_DIR', 'data/parquet_cache')
+CACHE_STAGE = "parquet_cache"
+
+# Cached table -> source relation, columns stored in the files (partition keys live in the path)
+# and the column used to find partitions that changed since the last export
+CACHE_TABLES = {
+    "final_city_merged": {
+        "relation": "transformations.final_city_merged",
+        "columns": [
+            ("datetime", "timestamp"), ("source", "string"),
+            ("pm25", "float64"), ("pm10", "float64"), ("o3", "float64"),
+            ("no2", "float64"), ("so2", "float64"), ("co", "float64"),
+            ("aqi", "int32"), ("aqi_category", "string"),
+        ],
+        "change_column": "updated_at",
+    },
+    "merged_observations_pollutants": {
+        "relation": "transformations.merged_observations_pollutants",
+        "columns": [
+            ("observation_id", "int32"), ("datetime", "timestamp"), ("source", "string"),
+            ("temperature", "float64"), ("humidity", "float64"), ("pressure", "float64"), ("wind", "float64"),
+            ("pm25", "float64"), ("pm10", "float64"), ("o3", "float64"),
+            ("no2", "float64"), ("so2", "float64"), ("co", "float64"),
+        ],
+        "change_column": "observation_id",
+    },
+}
+
+
+def _arrow_type(name):
+    return pa.timestamp("us") if name == "timestamp" else getattr(pa, name)()
+
+
+def _schema(table):
+    return pa.schema([(col, _arrow_type(kind)) for col, kind in CACHE_TABLES[table]["columns"]])
+
+
+def _partition_path(cache_dir, table, station_id, year):
+    return os.path.join(cache_dir, table, f"station_id={station_id}", f"year={year}", "part-0.parquet")
+
+
+def _changed_partitions(cur, table, since):
+    # (station_id, year, newest change value) for every partition touched after `since`
+    spec = CACHE_TABLES[table]
+    change_column = spec["change_column"]
+    where = f"WHERE {change_column} > %s" if since is not None else ""
+    cur.execute(f"""
+        SELECT station_id, EXTRACT(YEAR FROM datetime)::int AS year, MAX({change_column})
+        FROM {spec['relation']}
+        {where}
+        GROUP BY station_id, year
+        ORDER BY station_id, year
+    """, (since,) if since is not None else None)
+    return [row for row in cur.fetchall() if row[0] is not None and row[1] is not None]
+
+
+def _write_partition(cur, table, station_id, year, cache_dir):
+    # Rewrite one partition from the database; the rename keeps readers from seeing half a file
+    spec = CACHE_TABLES[table]
+    columns = [col for col, _ in spec["columns"]]
+    cur.execute(f"""
+        SELECT {', '.join(columns)}
+        FROM {spec['relation']}
+        WHERE station_id = %s AND datetime >= %s AND datetime < %s
+        ORDER BY datetime
+    """, (station_id, datetime(year, 1, 1), datetime(year + 1, 1, 1)))
+    rows = cur.fetchall()
+
+    schema = _schema(table)
+    values = list(zip(*rows)) if rows else [[] for _ in columns]
+    arrow_table = pa.Table.from_arrays(
+        [pa.array(list(col), type=field.type) for col, field in zip(values, schema)], schema=schema
+    )
+
+    path = _partition_path(cache_dir, table, station_id, year)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    pq.write_table(arrow_table, tmp_path)
+    os.replace(tmp_path, path)
+    return len(rows)
+
+
+def reset_cache(cur, table):
+    # Next export of `table` rewrites the whole dataset (call after the source table is rebuilt)
+    reset_watermarks(cur, CACHE_STAGE, source=table)
+
+
+def export_parquet_cache(tables=None, cache_dir=PARQUET_CACHE_DIR, full_refresh=False):
+    # Refresh the local Parquet copies, only partitions whose rows changed since the last export
+    if pa is None:
+        print("⚠️ pyarrow is not installed, skipping the Parquet cache.")
+        return 0
+
+    exported = 0
+    with connection() as conn:
+        cur = conn.cursor()
+        ensure_watermark_table(cur)
+        conn.commit()
+
+        for table in tables or CACHE_TABLES:
+            if full_refresh:
+                reset_cache(cur, table)
+            last_datetime, last_observation_id = get_watermark(cur, CACHE_STAGE, source=table)
+            since = last_datetime if CACHE_TABLES[table]["change_column"] == "updated_at" else last_observation_id
+
+            # No mark: start over so partitions that no longer exist in the database disappear too
+            if since is None:
+                shutil.rmtree(os.path.join(cache_dir, table), ignore_errors=True)
+
+            partitions = _changed_partitions(cur, table, since)
+            rows = sum(_write_partition(cur, table, station_id, year, cache_dir) for station_id, year, _ in partitions)
+
+            if partitions:
+                newest = max(change for _, _, change in partitions)
+                if CACHE_TABLES[table]["change_column"] == "updated_at":
+                    set_watermark(cur, CACHE_STAGE, source=table, last_datetime=newest)
+                else:
+                    set_watermark(cur, CACHE_STAGE, source=table, last_observation_id=newest)
+            conn.commit()
+
+            print(f"🗂️ Parquet cache {table}: {len(partitions)} partitions rewritten ({rows} rows)")
+            add_rows(read=rows, written=rows, city=table)
+            exported += rows
+        cur.close()
+    return exported
+
+
+def read_cached(table, station_ids=None, start=None, end=None, columns=None, cache_dir=PARQUET_CACHE_DIR):
+    # Read a cached table as a DataFrame. station_ids and the [start, end) datetime range are pushed
+    # down: only matching station/year directories are opened and row groups are filtered on datetime.
+    if pa is None:
+        raise ImportError("pyarrow is required to read the Parquet cache")
+
+    path = os.path.join(cache_dir, table)
+    if not os.path.isdir(path):
+        raise FileNotFoundError(f"No Parquet cache for {table} in {cache_dir}, run export_parquet_cache first")
+
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    conditions = []
+    if station_ids is not None:
+        conditions.append(ds.field("station_id").isin(list(station_ids)))
+    if start is not None:
+        start = pd.Timestamp(start).to_pydatetime()
+        conditions += [ds.field("year") >= start.year, ds.field("datetime") >= start]
+    if end is not None:
+        end = pd.Timestamp(end).to_pydatetime()
+        conditions += [ds.field("year") <= end.year, ds.field("datetime") < end]
+    condition = reduce(lambda a, b: a & b, conditions) if conditions else None
+
+    return dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+
+if __name__ == "__main__":
+    export_parquet_cache(full_refresh="--full-refresh" in sys.argv)
@@ -1,5 +1,6 @@
 import sys
 import os
+import argparse
 from datetime import datetime
 import pandas as pd
 import psycopg2
@@ -7,87 +8,110 @@ import psycopg2
 # Add project root to sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from config.db_config import DB_CONFIG, API_TOKEN, CITIES
-from data_pipeline.ingestion.fetch_waqi import fetch_waqi_data
-from data_pipeline.insert_to_db import insert_data
+from config import db_config
+from config.db_config import API_TOKEN, CITIES
+from data_pipeline.db import connection
+from data_pipeline.ingestion.fetch_waqi import DEFAULT_TILE_DEGREES, fetch_all_cities, fetch_region
+from data_pipeline.spool import append_to_spool, flush_spool, spool_backlog
 from data_pipeline.output.clean_export_data import clean_observations, clean_pollutants
 from data_pipeline.cleaning.remove_duplicates import remove_observation_duplicates
-
-def run_daily():
+from data_pipeline.migrations import apply_migrations, maintain_partitions
+from data_pipeline.metrics import count_error
+from data_pipeline.last_seen import is_new, last_seen_stats
+
+# Lat/lng boxes (lat1, lng1, lat2, lng2) ingested through WAQI's map endpoint on every run, next to CITIES
+WAQI_BOUNDS = getattr(db_config, 'WAQI_BOUNDS', [])
+WAQI_TILE_DEGREES = getattr(db_config, 'WAQI_TILE_DEGREES', DEFAULT_TILE_DEGREES)
+# Station names or uids inside those boxes that also get a /feed/ call for their pollutant breakdown
+WAQI_DETAIL_STATIONS = getattr(db_config, 'WAQI_DETAIL_STATIONS', [])
+# City label of map payloads in the logs and run metrics (one per station would be thousands)
+BOUNDS_LABEL = "bounds"
+
+def _needs_detail(payload):
+    # Listed stations only, and only when the map shows a reading newer than the stored one
+    listed = payload['city']['name'] in WAQI_DETAIL_STATIONS or payload['idx'] in WAQI_DETAIL_STATIONS
+    return listed and is_new(payload)
+
+def fetch_regions(bounds, log_file):
+    # Payloads of every station in the boxes; failed tiles and stations are counted and logged to log_file.
+    # The ingestion daemon polls the same boxes through this function.
+    payloads = []
+    for box in bounds:
+        region, errors = fetch_region(box, API_TOKEN, needs_detail=_needs_detail, tile_degrees=WAQI_TILE_DEGREES)
+        for what, error in errors:
+            count_error("fetch", BOUNDS_LABEL)
+            log_file.write(f"{datetime.now()} - ERROR: WAQI bounds {box} - {what} - {error}\n")
+        log_file.write(f"{datetime.now()} - SUCCESS: WAQI bounds {box} - {len(region)} stations\n")
+        payloads += region
+    return payloads
+
+def run_daily(bounds=None):
+    # bounds: boxes to ingest through the map endpoint, WAQI_BOUNDS by default
     os.makedirs("logs", exist_ok=True)
     log_path = f"logs/waqi_log_{datetime.now().strftime('%Y%m%d')}.txt"
 
-    with open(log_path, "w") as log_file:
+    # Appended to, so several runs on the same day keep each other's lines
+    with open(log_path, "a") as log_file:
+        # Fetch all cities concurrently and spool the payloads locally; none of this waits on the database
+        fetched = []
+        for city, data, fetch_error in fetch_all_cities(CITIES, API_TOKEN):
+            if fetch_error is not None:
+                count_error("fetch", city)
+                log_file.write(f"{datetime.now()} - ERROR: WAQI - {city} - {fetch_error}\n")
+            else:
+                fetched.append((city, data))
+                log_file.write(f"{datetime.now()} - SUCCESS: WAQI - {city}\n")
+        region = fetch_regions(WAQI_BOUNDS if bounds is None else bounds, log_file)
+        append_to_spool([data for _, data in fetched] + region,
+                        labels=[city for city, _ in fetched] + [BOUNDS_LABEL] * len(region))
+
         try:
-            conn = psycopg2.connect(**DB_CONFIG)
-            create_tables(conn)
+            with connection() as conn:
+                create_tables(conn)
 
-            for city in CITIES:
+                # Drain the spool: this run's payloads plus whatever an earlier outage left behind
+                inserted = None
                 try:
-                    data = fetch_waqi_data(city, API_TOKEN)
-                    insert_data(conn, data)
-                    log_file.write(f"{datetime.now()} - SUCCESS: WAQI - {city}\n")
+                    flushed, inserted = flush_spool(conn)
+                    log_file.write(f"{datetime.now()} - SUCCESS: Spool flush - {flushed} payloads, {inserted} new observations\n")
                 except Exception as e:
-                    log_file.write(f"{datetime.now()} - ERROR: WAQI - {city} - {e}\n")
-
-            # Deduplicate
-            # Deduplicate
-            try:
-                remove_observation_duplicates()
-            except psycopg2.errors.UndefinedTable:
-                log_file.write(f"{datetime.now()} - SKIPPED: Deduplication (table doesn't exist yet)\n")
-            except Exception as e:
-                log_file.write(f"{datetime.now()} - ERROR: Deduplication - {e}\n")
-
-
-            conn.close()
+                    count_error("insert")
+                    log_file.write(f"{datetime.now()} - ERROR: Spool flush - {e}\n")
+
+                cache = last_seen_stats()
+                print(f"🗃️ Last-seen cache: {cache['hits']} unchanged payloads skipped, {cache['misses']} sent to the database")
+
+                # Deduplicate rows ingested since the last run, on the same connection
+                if inserted == 0:
+                    log_file.write(f"{datetime.now()} - SKIPPED: Deduplication (no new observations)\n")
+                else:
+                    try:
+                        removed = remove_observation_duplicates(conn, incremental=True)
+                        log_file.write(f"{datetime.now()} - SUCCESS: Deduplication - {removed} rows removed\n")
+                    except psycopg2.errors.UndefinedTable:
+                        log_file.write(f"{datetime.now()} - SKIPPED: Deduplication (table doesn't exist yet)\n")
+                    except Exception as e:
+                        count_error("deduplicate")
+                        log_file.write(f"{datetime.now()} - ERROR: Deduplication - {e}\n")
 
         except Exception as conn_err:
-            log_file.write(f"{datetime.now()} - ERROR: DB connection failed - {conn_err}\n")
+            count_error("db_connection")
+            segments, size = spool_backlog()
+            log_file.write(f"{datetime.now()} - ERROR: DB connection failed - {conn_err} - "
+                           f"{size} bytes in {segments} spool segment(s) kept for the next run\n")
 
 def create_tables(conn):
+    # Schema changes live in data_pipeline/migrations.py; each run also keeps next months' partitions ready
+    apply_migrations(conn)
     cur = conn.cursor()
-
-    cur.execute("CREATE SCHEMA IF NOT EXISTS real_time_data;")
-
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS real_time_data.stations (
-            station_id SERIAL PRIMARY KEY,
-            name TEXT UNIQUE,
-            city TEXT,
-            country TEXT,
-            latitude FLOAT,
-            longitude FLOAT
-        );
-    """)
-
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS real_time_data.observations (
-            observation_id SERIAL PRIMARY KEY,
-            station_id INTEGER REFERENCES real_time_data.stations(station_id),
-            datetime TIMESTAMP,
-            aqi INTEGER,
-            dominant_pol TEXT,
-            source TEXT,
-            temperature FLOAT,
-            humidity FLOAT,
-            pressure FLOAT,
-            wind FLOAT
-        );
-    """)
-
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS real_time_data.pollutants (
-            pollutant_id SERIAL PRIMARY KEY,
-            observation_id INTEGER REFERENCES real_time_data.observations(observation_id),
-            name TEXT,
-            value FLOAT
-        );
-    """)
-
+    maintain_partitions(cur)
     conn.commit()
     cur.close()
     print("✅ Tables checked/created in schema real_time_data.")
 
 if __name__ == "__main__":
-    run_daily()
+    parser = argparse.ArgumentParser(description="Fetch the latest WAQI readings into real_time_data")
+    parser.add_argument("--bounds", action="append", metavar="LAT1,LNG1,LAT2,LNG2",
+                        type=lambda text: tuple(float(v) for v in text.split(",")),
+                        help="also ingest every station in this box (repeatable, default WAQI_BOUNDS)")
+    run_daily(bounds=parser.parse_args().bounds)
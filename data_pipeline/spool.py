@@ -0,0 +1,297 @@
+import os
+import sys
+import json
+import fcntl
+from datetime import datetime
+from contextlib import contextmanager
+
+import psycopg2
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import db_config
+from data_pipeline.metrics import ALL, count_error
+from data_pipeline.insert_to_db import insert_data_batch
+
+# Fetched WAQI payloads are appended here before anything touches the database, one JSON line
+# {"label", "data"} each. The newest segment is segment_<n>.jsonl.open; it is sealed (renamed to .jsonl)
+# once it reaches SPOOL_SEGMENT_BYTES or when a flush starts. flush_spool() drains sealed segments
+# oldest first into Postgres and deletes each one when it is fully written. Replaying a segment after a
+# crash is harmless: insert_data_batch skips observations that are already stored.
+# Records that can never be inserted (corrupt lines, payloads missing a field insert_data_batch needs, rows the
+# database rejects) are moved to dead_letter.jsonl instead of blocking the spool.
+SPOOL_DIR = getattr(db_config, 'SPOOL_DIR', 'data/spool')
+SPOOL_SEGMENT_BYTES = getattr(db_config, 'SPOOL_SEGMENT_BYTES', 8 * 1024 * 1024)
+# Payloads per insert_data_batch call while draining
+SPOOL_FLUSH_BATCH = getattr(db_config, 'SPOOL_FLUSH_BATCH', 5000)
+
+OPEN_SUFFIX = ".jsonl.open"
+SEALED_SUFFIX = ".jsonl"
+CHECKPOINT_FILE = "flush_checkpoint.json"
+DEAD_LETTER_FILE = "dead_letter.jsonl"
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Errors caused by a batch's content: the batch is split to find the payloads responsible. Anything else
+# (connection lost, server down, missing table) leaves the batch in the spool for the next flush.
+DATA_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError, KeyError, IndexError, TypeError, ValueError, AttributeError)
+
+
+@contextmanager
+def _locked(spool_dir, name, blocking=True):
+    # flock on spool_dir/<name>, shared by every process using the spool; yields False if not blocking and busy
+    os.makedirs(spool_dir, exist_ok=True)
+    with open(os.path.join(spool_dir, name), "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _segments(spool_dir, suffix):
+    if not os.path.isdir(spool_dir):
+        return []
+    return sorted(name for name in os.listdir(spool_dir) if name.startswith("segment_") and name.endswith(suffix))
+
+
+def _next_segment_name(spool_dir):
+    numbers = [int(name[len("segment_"):].split(".")[0]) for name in _segments(spool_dir, OPEN_SUFFIX)
+               + _segments(spool_dir, SEALED_SUFFIX)]
+    return f"segment_{max(numbers, default=0) + 1:012d}{OPEN_SUFFIX}"
+
+
+def _fsync_dir(spool_dir):
+    # Make a rename or a new file survive a power cut
+    fd = os.open(spool_dir, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _seal(spool_dir, name):
+    os.rename(os.path.join(spool_dir, name), os.path.join(spool_dir, name[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX))
+    _fsync_dir(spool_dir)
+
+
+def _drop_torn_tail(path):
+    # A crash in the middle of an append leaves a line without its newline; cut it off so the next
+    # record does not get glued to it (that payload was never acknowledged)
+    with open(path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        f.seek(0)
+        data = f.read()
+        f.truncate(data.rfind(b"\n") + 1)
+        count_error("spool_torn_line")
+
+
+def append_to_spool(payloads, labels=None, spool_dir=SPOOL_DIR, segment_bytes=SPOOL_SEGMENT_BYTES):
+    # Durably append payloads (fsync before returning); returns how many were written.
+    # labels name each payload's city in the run metrics when it is flushed (default: the station name).
+    if not payloads:
+        return 0
+    labels = labels or [data['city']['name'] for data in payloads]
+    lines = "".join(json.dumps({"label": label, "data": data}, ensure_ascii=False) + "\n"
+                    for data, label in zip(payloads, labels))
+
+    with _locked(spool_dir, "append.lock"):
+        open_segments = _segments(spool_dir, OPEN_SUFFIX)
+        name = open_segments[-1] if open_segments else _next_segment_name(spool_dir)
+        path = os.path.join(spool_dir, name)
+        created = not os.path.exists(path)
+        if not created:
+            _drop_torn_tail(path)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        if created:
+            _fsync_dir(spool_dir)
+        if size >= segment_bytes:
+            _seal(spool_dir, name)
+    return len(payloads)
+
+
+def seal_open_segment(spool_dir=SPOOL_DIR):
+    # Close the segment being appended to, so a flush also drains the latest payloads
+    with _locked(spool_dir, "append.lock"):
+        for name in _segments(spool_dir, OPEN_SUFFIX):
+            if os.path.getsize(os.path.join(spool_dir, name)) > 0:
+                _seal(spool_dir, name)
+
+
+def spool_backlog(spool_dir=SPOOL_DIR):
+    # (segments, bytes) waiting to be flushed, the open segment included
+    names = _segments(spool_dir, SEALED_SUFFIX) + _segments(spool_dir, OPEN_SUFFIX)
+    return len(names), sum(os.path.getsize(os.path.join(spool_dir, name)) for name in names)
+
+
+def payload_problem(data):
+    # Why insert_data_batch could not take this payload, None when it can
+    if not isinstance(data, dict):
+        return "payload is not an object"
+    city = data.get('city')
+    if not isinstance(city, dict) or not isinstance(city.get('name'), str) or not city['name']:
+        return "missing city.name"
+    geo = city.get('geo')
+    if not isinstance(geo, (list, tuple)) or len(geo) < 2:
+        return "missing city.geo"
+    try:
+        float(geo[0]), float(geo[1])
+    except (TypeError, ValueError):
+        return "non-numeric city.geo"
+    reading = data.get('time')
+    seen = reading.get('s') if isinstance(reading, dict) else None
+    if not isinstance(seen, str):
+        return "missing time.s"
+    try:
+        datetime.strptime(seen, TIME_FORMAT)
+    except ValueError:
+        return f"unparseable time.s {seen!r}"
+    iaqi = data.get('iaqi', {})
+    if not isinstance(iaqi, dict) or not all(isinstance(value, dict) for value in iaqi.values()):
+        return "malformed iaqi"
+    return None
+
+
+def _dead_letter(spool_dir, records):
+    # Durably set aside [{"reason", "label", "data"} or {"reason", "line"}]; they are never retried
+    if not records:
+        return
+    with open(os.path.join(spool_dir, DEAD_LETTER_FILE), "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(dict(record, at=datetime.now().isoformat(timespec="seconds")), ensure_ascii=False) + "\n")
+            print(f"☠️ Dead-lettered spooled payload ({record.get('label', 'unreadable line')}): {record['reason']}")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def dead_letter_count(spool_dir=SPOOL_DIR):
+    path = os.path.join(spool_dir, DEAD_LETTER_FILE)
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb") as f:
+        return sum(1 for _ in f)
+
+
+def _load_checkpoint(spool_dir):
+    # {"segment": name, "offset": bytes already written to the database}
+    path = os.path.join(spool_dir, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_checkpoint(spool_dir, checkpoint):
+    tmp_path = os.path.join(spool_dir, CHECKPOINT_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, os.path.join(spool_dir, CHECKPOINT_FILE))
+
+
+def _read_batch(f, batch_size):
+    # Up to batch_size valid payloads and their labels from the current position.
+    # Returns (payloads, labels, records to dead-letter, offset after the last line read, True at the end of the segment).
+    payloads, labels, rejected = [], [], []
+    while len(payloads) < batch_size:
+        line = f.readline()
+        if not line:
+            return payloads, labels, rejected, f.tell(), True
+        if not line.endswith(b"\n"):
+            # Torn write from a crash while appending; nothing after it was acknowledged
+            count_error("spool_torn_line")
+            return payloads, labels, rejected, f.tell(), True
+        try:
+            record = json.loads(line)
+            data, label = record["data"], record["label"]
+        except (ValueError, TypeError, KeyError):
+            count_error("spool_corrupt_line")
+            rejected.append({"reason": "unreadable spool line", "line": line.decode("utf-8", "replace").rstrip("\n")})
+            continue
+        problem = payload_problem(data)
+        if problem is not None:
+            count_error("spool_invalid_payload", label if isinstance(label, str) else ALL)
+            rejected.append({"reason": problem, "label": label, "data": data})
+            continue
+        payloads.append(data)
+        labels.append(label)
+    return payloads, labels, rejected, f.tell(), False
+
+
+def _insert_or_quarantine(conn, payloads, labels, spool_dir):
+    # insert_data_batch, halving the batch on DATA_ERRORS until the payloads the database rejects are isolated and
+    # dead-lettered; the rest is still inserted. Returns (observations inserted, payloads dead-lettered).
+    # Each split is silent, _dead_letter reports every rejected payload once.
+    try:
+        return insert_data_batch(conn, payloads, labels=labels, quiet_errors=DATA_ERRORS), 0
+    except DATA_ERRORS as e:
+        if len(payloads) == 1:
+            count_error("spool_rejected_payload", labels[0])
+            _dead_letter(spool_dir, [{"reason": f"rejected: {type(e).__name__}: {e}".strip(), "label": labels[0],
+                                      "data": payloads[0]}])
+            return 0, 1
+        half = len(payloads) // 2
+        first = _insert_or_quarantine(conn, payloads[:half], labels[:half], spool_dir)
+        second = _insert_or_quarantine(conn, payloads[half:], labels[half:], spool_dir)
+        return first[0] + second[0], first[1] + second[1]
+
+
+def flush_spool(conn, batch_size=SPOOL_FLUSH_BATCH, spool_dir=SPOOL_DIR):
+    # Drain every spooled payload into real_time_data, oldest first; returns (payloads flushed, observations inserted).
+    # At-least-once: the checkpoint moves after each committed batch, so a crash replays at most one batch.
+    # Only one flusher runs at a time; a second one returns (0, 0) straight away. Connection and server errors
+    # propagate with the checkpoint unchanged; bad payloads are dead-lettered and do not stop the flush.
+    flushed = inserted = dead = 0
+    with _locked(spool_dir, "flush.lock", blocking=False) as acquired:
+        if not acquired:
+            print("⏭️ Spool is being flushed by another process")
+            return 0, 0
+        seal_open_segment(spool_dir)
+        checkpoint = _load_checkpoint(spool_dir)
+
+        for name in _segments(spool_dir, SEALED_SUFFIX):
+            path = os.path.join(spool_dir, name)
+            offset = checkpoint.get("offset", 0) if checkpoint.get("segment") == name else 0
+            with open(path, "rb") as f:
+                f.seek(offset)
+                done = False
+                while not done:
+                    payloads, labels, rejected, offset, done = _read_batch(f, batch_size)
+                    # Set aside before the checkpoint moves past them
+                    _dead_letter(spool_dir, rejected)
+                    dead += len(rejected)
+                    if payloads:
+                        batch_inserted, batch_dead = _insert_or_quarantine(conn, payloads, labels, spool_dir)
+                        inserted += batch_inserted
+                        flushed += len(payloads) - batch_dead
+                        dead += batch_dead
+                    checkpoint = {"segment": name, "offset": offset}
+                    _save_checkpoint(spool_dir, checkpoint)
+            # Checkpoint first: a crash before the remove replays the segment, never skips part of a new one
+            checkpoint = {}
+            _save_checkpoint(spool_dir, checkpoint)
+            os.remove(path)
+
+    if flushed:
+        print(f"📤 Flushed {flushed} spooled payloads ({inserted} new observations)")
+    if dead:
+        print(f"⚠️ {dead} spooled payloads moved to {os.path.join(spool_dir, DEAD_LETTER_FILE)}")
+    return flushed, inserted
+
+
+if __name__ == "__main__":
+    from data_pipeline.db import connection
+    with connection() as conn:
+        flush_spool(conn)
@@ -0,0 +1,133 @@
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from data_pipeline.metrics import stage_scope
+
+# A pipeline is a dict: stage name -> (callable, [names of stages it depends on])
+
+
+def downstream_of(stages, name):
+    # name plus every stage that (transitively) depends on it
+    selected = {name}
+    changed = True
+    while changed:
+        changed = False
+        for stage, (_, deps) in stages.items():
+            if stage not in selected and selected.intersection(deps):
+                selected.add(stage)
+                changed = True
+    return selected
+
+
+def select_stages(stages, only=None, start_from=None):
+    for name in list(only or []) + ([start_from] if start_from else []):
+        if name not in stages:
+            raise ValueError(f"Unknown stage '{name}', expected one of: {', '.join(stages)}")
+    selected = set(stages)
+    if start_from:
+        selected &= downstream_of(stages, start_from)
+    if only:
+        selected &= set(only)
+    return selected
+
+
+def _check_acyclic(stages):
+    visiting, done = set(), set()
+
+    def visit(name, path):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Stage dependency cycle: {' -> '.join(path + [name])}")
+        visiting.add(name)
+        for dep in stages[name][1]:
+            if dep not in stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dep}'")
+            visit(dep, path + [name])
+        visiting.discard(name)
+        done.add(name)
+
+    for name in stages:
+        visit(name, [])
+
+
+def run_stages(stages, max_workers=4, only=None, start_from=None):
+    # Run every selected stage as soon as its dependencies are done; dependencies outside the
+    # selection count as satisfied. Returns {name: {'status', 'start', 'end', 'error'}}.
+    _check_acyclic(stages)
+    selected = select_stages(stages, only, start_from)
+    pending = {name: {dep for dep in stages[name][1] if dep in selected} for name in selected}
+    results = {}
+    run_start = time.perf_counter()
+
+    def run(name):
+        start = time.perf_counter() - run_start
+        # Rows, round trips and errors recorded by the stage are labelled with its name
+        with stage_scope(name):
+            stages[name][0]()
+        return start, time.perf_counter() - run_start
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        running = {}
+        while pending or running:
+            # Stages whose dependencies failed can never run
+            for name in [n for n, deps in pending.items() if any(results.get(d, {}).get('status') in ('failed', 'skipped') for d in deps)]:
+                del pending[name]
+                results[name] = {'status': 'skipped', 'start': None, 'end': None, 'error': None}
+                print(f"⏭️ Skipped {name} (a dependency failed)")
+
+            for name in [n for n, deps in pending.items() if all(results.get(d, {}).get('status') == 'done' for d in deps)]:
+                del pending[name]
+                running[pool.submit(run, name)] = name
+
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    start, end = future.result()
+                    results[name] = {'status': 'done', 'start': start, 'end': end, 'error': None}
+                    print(f"✅ Finished {name} ({end - start:.2f}s)\n")
+                except Exception as e:
+                    end = time.perf_counter() - run_start
+                    results[name] = {'status': 'failed', 'start': None, 'end': end, 'error': e}
+                    print(f"❌ Stage {name} failed: {e}")
+                    traceback.print_exc()
+
+    return results
+
+
+def critical_path(stages, results):
+    # Longest chain of completed stages by summed duration, following declared dependencies
+    durations = {n: r['end'] - r['start'] for n, r in results.items() if r['status'] == 'done'}
+    best = {}
+
+    def chain(name):
+        if name not in best:
+            dep_chains = [chain(dep) for dep in stages[name][1] if dep in durations]
+            longest = max(dep_chains, key=lambda c: c[0], default=(0.0, []))
+            best[name] = (longest[0] + durations[name], longest[1] + [name])
+        return best[name]
+
+    return max((chain(name) for name in durations), key=lambda c: c[0], default=(0.0, []))
+
+
+def print_timing_report(stages, results):
+    done = {n: r for n, r in results.items() if r['status'] == 'done'}
+    if not done:
+        return
+    wall = max(r['end'] for r in done.values())
+    total = sum(r['end'] - r['start'] for r in done.values())
+
+    print(f"⏱️ Stage timings (wall {wall:.2f}s, sum of stages {total:.2f}s)")
+    for name, r in sorted(results.items(), key=lambda item: item[1]['start'] if item[1]['start'] is not None else float('inf')):
+        if r['status'] == 'done':
+            print(f"   {name:<26} {r['start']:7.2f}s → {r['end']:7.2f}s  ({r['end'] - r['start']:.2f}s)")
+        else:
+            print(f"   {name:<26} {r['status']}")
+
+    length, path = critical_path(stages, results)
+    print(f"🧭 Critical path ({length:.2f}s): {' → '.join(path)}")
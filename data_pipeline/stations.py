@@ -0,0 +1,29 @@
+# Stations the transformations work on: every station with live data in real_time_data.stations plus every
+# station mapped in real_time_data.station_sources (migration 6) to a historical table and/or burden table.
+
+
+def load_stations(cur):
+    # [{'station_id', 'name', 'label', 'historical_table', 'burden_table'}] ordered by station_id.
+    # A table is None when the station has no mapping or the table has not been imported yet.
+    # label is the city metrics are recorded under: the historical table's city when mapped (as import_historical
+    # does), otherwise the station name.
+    cur.execute("""
+        SELECT COALESCE(s.station_id, src.station_id) AS station_id,
+               COALESCE(s.name, 'station ' || src.station_id) AS name,
+               COALESCE(regexp_replace(src.historical_table, '_air_quality$', ''), s.name,
+                        'station ' || src.station_id) AS label,
+               CASE WHEN to_regclass('historical_data.' || quote_ident(src.historical_table)) IS NOT NULL
+                    THEN src.historical_table END AS historical_table,
+               CASE WHEN to_regclass('burden_data.' || quote_ident(src.burden_table)) IS NOT NULL
+                    THEN src.burden_table END AS burden_table
+        FROM real_time_data.stations s
+        FULL JOIN real_time_data.station_sources src ON src.station_id = s.station_id
+        ORDER BY 1
+    """)
+    columns = [desc[0] for desc in cur.description]
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+
+def burden_stations(cur):
+    # [(burden_table, station_id)] for stations whose burden table exists, in the order their rows are merged
+    return sorted((s['burden_table'], s['station_id']) for s in load_stations(cur) if s['burden_table'])
@@ -0,0 +1,52 @@
+import os
+import sys
+import uuid
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pandas as pd
+
+# resource is POSIX only, peak RSS is simply not reported elsewhere
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from config import db_config
+
+# Rows per chunk in streaming mode, optionally overridden in config/db_config.py
+STREAM_CHUNK_SIZE = getattr(db_config, 'STREAM_CHUNK_SIZE', 10_000)
+
+
+def iter_query_chunks(conn, query, params=None, chunk_size=STREAM_CHUNK_SIZE):
+    # Yield the result of query as DataFrames of at most chunk_size rows. A named (server-side) cursor
+    # keeps the result set in the database; pd.read_sql(chunksize=...) would still fetch every row first.
+    cur = conn.cursor(name=f"stream_{uuid.uuid4().hex}")
+    cur.itersize = chunk_size
+    try:
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            columns = [desc[0] for desc in cur.description]
+            # Same conversion pd.read_sql applies, so chunks look exactly like a full read
+            yield pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+    finally:
+        cur.close()
+
+
+def peak_rss_mb():
+    # Highest resident set size of this process so far, None where it cannot be measured
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def print_peak_rss(label):
+    peak = peak_rss_mb()
+    if peak is not None:
+        print(f"📈 Peak RSS after {label}: {peak:.1f} MB")
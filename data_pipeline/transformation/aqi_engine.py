@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+
+POLLUTANTS = ['pm25', 'pm10', 'o3', 'no2', 'so2', 'co']
+
+# AQI Breakpoints (EPA)
+AQI_BREAKPOINTS = {
+    'pm25': [(0.0, 12.0, 0, 50), (12.1, 35.4, 51, 100), (35.5, 55.4, 101, 150),
+             (55.5, 150.4, 151, 200), (150.5, 250.4, 201, 300), (250.5, 350.4, 301, 400), (350.5, 500.4, 401, 500)],
+    'pm10': [(0, 54, 0, 50), (55, 154, 51, 100), (155, 254, 101, 150),
+             (255, 354, 151, 200), (355, 424, 201, 300), (425, 504, 301, 400), (505, 604, 401, 500)],
+    'o3': [(0.0, 0.054, 0, 50), (0.055, 0.070, 51, 100), (0.071, 0.085, 101, 150),
+           (0.086, 0.105, 151, 200), (0.106, 0.200, 201, 300)],
+    'no2': [(0, 53, 0, 50), (54, 100, 51, 100), (101, 360, 101, 150),
+            (361, 649, 151, 200), (650, 1249, 201, 300)],
+    'so2': [(0, 35, 0, 50), (36, 75, 51, 100), (76, 185, 101, 150),
+            (186, 304, 151, 200), (305, 604, 201, 300)],
+    'co': [(0.0, 4.4, 0, 50), (4.5, 9.4, 51, 100), (9.5, 12.4, 101, 150),
+           (12.5, 15.4, 151, 200), (15.5, 30.4, 201, 300)]
+}
+
+AQI_CATEGORIES = [
+    (0, 50, "Good"),
+    (51, 100, "Moderate"),
+    (101, 150, "Unhealthy for Sensitive Groups"),
+    (151, 200, "Unhealthy"),
+    (201, 300, "Very Unhealthy"),
+    (301, 500, "Hazardous"),
+]
+
+# Breakpoint tables as sorted column arrays: (bp_low, bp_high, aqi_low, aqi_high)
+_BREAKPOINT_ARRAYS = {
+    pol: tuple(np.array(col, dtype=float) for col in zip(*bps))
+    for pol, bps in AQI_BREAKPOINTS.items()
+}
+_CATEGORY_LOWS = np.array([low for low, _, _ in AQI_CATEGORIES], dtype=float)
+_CATEGORY_HIGHS = np.array([high for _, high, _ in AQI_CATEGORIES], dtype=float)
+_CATEGORY_LABELS = np.array([label for _, _, label in AQI_CATEGORIES] + ["Out of Range"], dtype=object)
+
+
+def calculate_sub_index(pollutant, values):
+    # Same result as calculate_aqi(), evaluated over a whole column at once
+    values = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    bp_low, bp_high, aqi_low, aqi_high = _BREAKPOINT_ARRAYS[pollutant]
+
+    # Last breakpoint whose lower bound is <= value
+    idx = np.searchsorted(bp_low, values, side='right') - 1
+    idx_safe = np.clip(idx, 0, len(bp_low) - 1)
+
+    # Values below the first range, in gaps between ranges or above the last one get no AQI
+    in_range = (idx >= 0) & (values <= bp_high[idx_safe])
+
+    with np.errstate(invalid='ignore'):
+        sub_index = (
+            (aqi_high[idx_safe] - aqi_low[idx_safe]) / (bp_high[idx_safe] - bp_low[idx_safe])
+            * (values - bp_low[idx_safe]) + aqi_low[idx_safe]
+        )
+    return np.where(in_range, np.round(sub_index), np.nan)
+
+
+def categorize_aqi(aqi_values):
+    # Same labels as the row-by-row get_aqi_category() merge_city_data used to apply: a missing AQI (NaN) is
+    # "Out of Range" too, as it always was in final_city_merged
+    aqi_values = pd.to_numeric(pd.Series(aqi_values), errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    idx = np.searchsorted(_CATEGORY_LOWS, aqi_values, side='right') - 1
+    idx_safe = np.clip(idx, 0, len(_CATEGORY_LOWS) - 1)
+    in_range = (idx >= 0) & (aqi_values <= _CATEGORY_HIGHS[idx_safe])
+    return _CATEGORY_LABELS[np.where(in_range, idx_safe, len(AQI_CATEGORIES))]
+
+
+def calculate_aqi_frame(df, pollutants=POLLUTANTS):
+    # Per-pollutant sub-indices, overall AQI, dominant pollutant and category for every row of df
+    n_rows = len(df)
+    sub_indices = np.column_stack([
+        calculate_sub_index(pol, df[pol]) if pol in df.columns else np.full(n_rows, np.nan)
+        for pol in pollutants
+    ])
+
+    has_value = ~np.isnan(sub_indices)
+    any_value = has_value.any(axis=1)
+
+    # First pollutant wins ties, rows without any sub-index get no AQI
+    dominant_idx = np.argmax(np.where(has_value, sub_indices, -np.inf), axis=1)
+    aqi = np.where(any_value, sub_indices[np.arange(n_rows), dominant_idx], np.nan)
+    dominant = np.where(any_value, np.array(pollutants, dtype=object)[dominant_idx], None)
+
+    result = pd.DataFrame(index=df.index)
+    for i, pol in enumerate(pollutants):
+        result[f'aqi_{pol}'] = pd.array(sub_indices[:, i], dtype='Float64').astype('Int64')
+    result['aqi'] = pd.array(aqi, dtype='Float64').astype('Int64')
+    result['dominant_pollutant'] = pd.Series(dominant, index=df.index, dtype=object)
+    result['aqi_category'] = pd.Series(categorize_aqi(aqi), index=df.index, dtype=object)
+    return result
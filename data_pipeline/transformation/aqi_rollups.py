@@ -0,0 +1,160 @@
+import sys
+import os
+
+# Ensure project root is in sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data_pipeline.db import connection
+from data_pipeline.watermarks import ensure_watermark_table, get_watermark, set_watermark, reset_watermarks
+from data_pipeline.metrics import add_rows
+
+WATERMARK_STAGE = "aqi_rollups"
+METRICS = ['pm25', 'pm10', 'o3', 'no2', 'so2', 'co', 'aqi']
+
+# Granularity -> rollup table; each level is rebuilt from the one before it
+ROLLUP_TABLES = {
+    "day": "transformations.aqi_rollup_daily",
+    "month": "transformations.aqi_rollup_monthly",
+    "year": "transformations.aqi_rollup_yearly",
+}
+
+
+def _metric_columns(metric):
+    # Per metric: number of non-null values, their sum, min and max (avg = sum / count)
+    value_type = "INTEGER" if metric == "aqi" else "DOUBLE PRECISION"
+    sum_type = "BIGINT" if metric == "aqi" else "DOUBLE PRECISION"
+    return f"{metric}_count BIGINT, {metric}_sum {sum_type}, {metric}_min {value_type}, {metric}_max {value_type}"
+
+
+ROLLUP_COLUMNS = ["station_id", "bucket", "row_count"] + [f"{m}_{agg}" for m in METRICS for agg in ("count", "sum", "min", "max")]
+
+# Aggregates over raw rows (daily) and over finer rollups (monthly, yearly)
+FROM_ROWS = ", ".join(f"COUNT({m}), SUM({m}), MIN({m}), MAX({m})" for m in METRICS)
+FROM_ROLLUP = ", ".join(f"SUM({m}_count), SUM({m}_sum), MIN({m}_min), MAX({m}_max)" for m in METRICS)
+UPDATE_SET = ", ".join(f"{col} = EXCLUDED.{col}" for col in ROLLUP_COLUMNS[2:])
+
+
+# Upper end of this run's updated_at window. Rows become visible at commit but carry the time they were written,
+# so a transaction still open can later add rows below MAX(updated_at), behind the watermark. The window therefore
+# ends just before the oldest open transaction that has written anything (every stage connects as the same role, so
+# all of them show up here); rows written after this query are stamped later and fall in the next window. This is
+# why final_city_merged stamps rows with clock_timestamp(): with now() (the transaction start) a merge that had not
+# written yet could still add rows below the bound, and a fixed safety lag would have to guess how long merges run.
+WINDOW_END_QUERY = """
+    SELECT (LEAST(statement_timestamp(), MIN(xact_start)) - interval '1 microsecond')::timestamp
+    FROM pg_stat_activity
+    WHERE datname = current_database() AND backend_xid IS NOT NULL AND pid <> pg_backend_pid()
+"""
+
+
+def create_rollup_tables(cur):
+    cur.execute("CREATE SCHEMA IF NOT EXISTS transformations;")
+    for granularity, table in ROLLUP_TABLES.items():
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                station_id INTEGER,
+                bucket TIMESTAMP,
+                row_count BIGINT,
+                {', '.join(_metric_columns(m) for m in METRICS)},
+                PRIMARY KEY (station_id, bucket)
+            );
+        """)
+
+
+def reset_rollups(cur):
+    # Next run recomputes every bucket (call after final_city_merged is rebuilt)
+    reset_watermarks(cur, WATERMARK_STAGE)
+
+
+def _touched_buckets_query(granularity):
+    # Buckets of `granularity` that contain a final_city_merged row changed in (since, until]
+    return f"""
+        SELECT DISTINCT station_id, date_trunc('{granularity}', datetime) AS bucket
+        FROM transformations.final_city_merged
+        WHERE updated_at > %(since)s AND updated_at <= %(until)s
+    """
+
+
+def update_rollups(full_refresh=False):
+    # Recompute only the day/month/year buckets touched since the last run. Returns the touched day buckets.
+    with connection() as conn:
+        cur = conn.cursor()
+        ensure_watermark_table(cur)
+        create_rollup_tables(cur)
+        if full_refresh:
+            reset_rollups(cur)
+
+        cur.execute("SELECT to_regclass('transformations.final_city_merged')")
+        if cur.fetchone()[0] is None:
+            print("⚠️ Skipped: transformations.final_city_merged does not exist yet.")
+            conn.commit()
+            cur.close()
+            return 0
+
+        since, _ = get_watermark(cur, WATERMARK_STAGE)
+        # Window end first, then the newest row in a fresh snapshot: everything stamped up to it is committed by then
+        cur.execute(WINDOW_END_QUERY)
+        window_end = cur.fetchone()[0]
+        cur.execute("SELECT MAX(updated_at) FROM transformations.final_city_merged")
+        until = cur.fetchone()[0]
+        if until is not None:
+            until = min(until, window_end)
+        if until is None or (since is not None and until <= since):
+            print("✅ AQI rollups already up to date")
+            conn.commit()
+            cur.close()
+            return 0
+
+        if since is None:
+            # First run or after a rebuild: start from empty tables so no stale bucket survives
+            for table in ROLLUP_TABLES.values():
+                cur.execute(f"TRUNCATE {table}")
+        params = {"since": since or "-infinity", "until": until}
+        columns = ", ".join(ROLLUP_COLUMNS)
+
+        # Days straight from the rows. Incrementally, the range join lets each touched day use the
+        # (station_id, datetime) key; a rebuild touches every day, so one grouped scan is cheaper.
+        if since is None:
+            day_query = f"""
+                SELECT station_id, date_trunc('day', datetime), COUNT(*), {FROM_ROWS}
+                FROM transformations.final_city_merged
+                WHERE updated_at <= %(until)s
+                GROUP BY 1, 2
+            """
+        else:
+            day_query = f"""
+                SELECT f.station_id, t.bucket, COUNT(*), {FROM_ROWS}
+                FROM ({_touched_buckets_query('day')}) t
+                JOIN transformations.final_city_merged f
+                  ON f.station_id = t.station_id AND f.datetime >= t.bucket AND f.datetime < t.bucket + interval '1 day'
+                GROUP BY f.station_id, t.bucket
+            """
+        cur.execute(f"""
+            INSERT INTO {ROLLUP_TABLES['day']} ({columns})
+            {day_query}
+            ON CONFLICT (station_id, bucket) DO UPDATE SET {UPDATE_SET}
+        """, params)
+        touched_days = cur.rowcount
+        add_rows(written=touched_days)
+
+        # Months from days, years from months
+        for granularity, finer in [("month", "day"), ("year", "month")]:
+            cur.execute(f"""
+                INSERT INTO {ROLLUP_TABLES[granularity]} ({columns})
+                SELECT r.station_id, t.bucket, SUM(r.row_count), {FROM_ROLLUP}
+                FROM ({_touched_buckets_query(granularity)}) t
+                JOIN {ROLLUP_TABLES[finer]} r
+                  ON r.station_id = t.station_id AND r.bucket >= t.bucket AND r.bucket < t.bucket + interval '1 {granularity}'
+                GROUP BY r.station_id, t.bucket
+                ON CONFLICT (station_id, bucket) DO UPDATE SET {UPDATE_SET}
+            """, params)
+
+        set_watermark(cur, WATERMARK_STAGE, last_datetime=until)
+        conn.commit()
+        cur.close()
+    print(f"✅ AQI rollups updated ({touched_days} daily buckets recomputed)")
+    return touched_days
+
+
+if __name__ == "__main__":
+    update_rollups(full_refresh="--full-refresh" in sys.argv)
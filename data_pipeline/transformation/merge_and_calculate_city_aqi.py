@@ -4,56 +4,49 @@ import os
 # Ensure project root is in sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import pandas as pd
-import psycopg2
-from config.db_config import DB_CONFIG
-
-# AQI Breakpoints (EPA)
-AQI_BREAKPOINTS = {
-    'pm25': [(0.0, 12.0, 0, 50), (12.1, 35.4, 51, 100), (35.5, 55.4, 101, 150),
-             (55.5, 150.4, 151, 200), (150.5, 250.4, 201, 300), (250.5, 350.4, 301, 400), (350.5, 500.4, 401, 500)],
-    'pm10': [(0, 54, 0, 50), (55, 154, 51, 100), (155, 254, 101, 150),
-             (255, 354, 151, 200), (355, 424, 201, 300), (425, 504, 301, 400), (505, 604, 401, 500)],
-    'o3': [(0.0, 0.054, 0, 50), (0.055, 0.070, 51, 100), (0.071, 0.085, 101, 150),
-           (0.086, 0.105, 151, 200), (0.106, 0.200, 201, 300)],
-    'no2': [(0, 53, 0, 50), (54, 100, 51, 100), (101, 360, 101, 150),
-            (361, 649, 151, 200), (650, 1249, 201, 300)],
-    'so2': [(0, 35, 0, 50), (36, 75, 51, 100), (76, 185, 101, 150),
-            (186, 304, 151, 200), (305, 604, 201, 300)],
-    'co': [(0.0, 4.4, 0, 50), (4.5, 9.4, 51, 100), (9.5, 12.4, 101, 150),
-           (12.5, 15.4, 151, 200), (15.5, 30.4, 201, 300)]
-}
-
-AQI_CATEGORIES = [
-    (0, 50, "Good"),
-    (51, 100, "Moderate"),
-    (101, 150, "Unhealthy for Sensitive Groups"),
-    (151, 200, "Unhealthy"),
-    (201, 300, "Very Unhealthy"),
-    (301, 500, "Hazardous"),
-]
-
-def calculate_aqi(pollutant, value):
-    try:
-        if value is None or pd.isna(value):
-            return None
-        value = float(value)
-        for bp_low, bp_high, aqi_low, aqi_high in AQI_BREAKPOINTS[pollutant]:
-            if bp_low <= value <= bp_high:
-                return round((aqi_high - aqi_low) / (bp_high - bp_low) * (value - bp_low) + aqi_low)
-    except:
-        return None
-    return None
+from config import db_config
+from data_pipeline.db import connection, configure_pool, pool_settings
+from data_pipeline.bulk_load import upsert_dataframe
+from data_pipeline.watermarks import ensure_watermark_table, get_watermark, set_watermark, reset_watermarks
+from data_pipeline.transformation.aqi_engine import POLLUTANTS, calculate_aqi_frame
+from data_pipeline.output.parquet_cache import reset_cache
+from data_pipeline.transformation.aqi_rollups import reset_rollups
+from data_pipeline.streaming import STREAM_CHUNK_SIZE, iter_query_chunks, print_peak_rss
+from data_pipeline.metrics import add_rows, count_error, count_round_trip, round_trips
+from data_pipeline.stations import load_stations
 
-def get_aqi_category(aqi_value):
-    if aqi_value is None:
-        return None
-    for low, high, label in AQI_CATEGORIES:
-        if low <= aqi_value <= high:
-            return label
-    return "Out of Range"
+FINAL_TABLE = "transformations.final_city_merged"
+FINAL_COLUMNS = ['station_id', 'datetime', 'source', 'pm25', 'pm10', 'o3', 'no2', 'so2', 'co', 'aqi', 'aqi_category']
+WATERMARK_STAGE = "final_city_merged"
+# Every upsert also bumps updated_at, which is how the Parquet cache finds changed partitions
+UPDATE_COLUMNS = [col for col in FINAL_COLUMNS if col not in ('station_id', 'datetime', 'source')] + ['updated_at']
+# Stations merged at the same time, each in its own process and connection; optionally overridden in config/db_config.py
+MERGE_CITY_WORKERS = getattr(db_config, 'MERGE_CITY_WORKERS', min(4, os.cpu_count() or 1))
+
+def create_table_if_needed(cur, full_refresh=False):
+    # Rebuild from scratch when asked, or when the table predates the incremental key
+    cur.execute("SELECT to_regclass('transformations.final_city_merged_key')")
+    if cur.fetchone()[0] is not None and not full_refresh:
+        # Tables from before the Parquet cache only need the change-tracking column, tables from before the
+        # rollup window fix (see aqi_rollups.py) its write-time default
+        cur.execute("""
+            SELECT column_default FROM information_schema.columns
+            WHERE table_schema = 'transformations' AND table_name = 'final_city_merged' AND column_name = 'updated_at'
+        """)
+        row = cur.fetchone()
+        if row is None:
+            cur.execute("""
+                ALTER TABLE transformations.final_city_merged ADD COLUMN updated_at TIMESTAMP DEFAULT clock_timestamp();
+                CREATE INDEX final_city_merged_updated_at_idx ON transformations.final_city_merged (updated_at);
+            """)
+        elif row[0] != "clock_timestamp()":
+            cur.execute("ALTER TABLE transformations.final_city_merged ALTER COLUMN updated_at SET DEFAULT clock_timestamp()")
+        return False
 
-def create_table_if_needed(cur):
     cur.execute("""
         CREATE SCHEMA IF NOT EXISTS transformations;
         DROP TABLE IF EXISTS transformations.final_city_merged;
@@ -68,85 +61,211 @@ def create_table_if_needed(cur):
             so2 DOUBLE PRECISION,
             co DOUBLE PRECISION,
             aqi INTEGER,
-            aqi_category TEXT
+            aqi_category TEXT,
+            updated_at TIMESTAMP DEFAULT clock_timestamp(),
+            CONSTRAINT final_city_merged_key UNIQUE (station_id, datetime, source)
         );
+        CREATE INDEX final_city_merged_updated_at_idx ON transformations.final_city_merged (updated_at);
     """)
+    reset_watermarks(cur, WATERMARK_STAGE)
+    reset_cache(cur, "final_city_merged")
+    reset_rollups(cur)
+    return True
+
+
+def _live_query(station_id, last_observation_id):
+    # Live data past the last processed observation_id
+    return """
+        SELECT observation_id, station_id, datetime, source, pm25, pm10, o3, no2, so2, co
+        FROM transformations.merged_observations_pollutants
+        WHERE station_id = %s AND observation_id > %s
+        ORDER BY observation_id
+    """, (station_id, last_observation_id or 0)
+
+
+def _historical_query(historical_table, last_hist_datetime):
+    # Historical data past the last processed date, None for stations without a historical table.
+    # Columns are typed by import_historical (DATE, DOUBLE PRECISION), nothing is parsed here.
+    if historical_table is None:
+        return None
+    query = f"SELECT *, date::timestamp AS datetime FROM historical_data.{historical_table}"
+    if last_hist_datetime is None:
+        return query, None
+    return query + " WHERE date > %s", (last_hist_datetime,)
+
+
+def _prepare_historical(df_hist, station_id):
+    df_hist['station_id'] = station_id
+    df_hist['source'] = 'csv'
+    for pol in POLLUTANTS:
+        if pol not in df_hist:
+            df_hist[pol] = float('nan')
+    # An all-NULL column comes back as objects; this is a dtype cast, not parsing
+    df_hist[POLLUTANTS] = df_hist[POLLUTANTS].astype(float)
+    df_hist['datetime'] = pd.to_datetime(df_hist['datetime'])
+    return df_hist
+
+
+def _add_aqi(df):
+    # Vectorized AQI over whole columns (see aqi_engine)
+    aqi = calculate_aqi_frame(df)
+    df['aqi'] = aqi['aqi']
+    df['aqi_category'] = aqi['aqi_category']
+    return df
+
+
+def _upsert_city_rows(cur, df_city):
+    # Upsert with COPY, rows without a parsable datetime are dropped
+    df_city = df_city[df_city['datetime'].notna()]
+    return upsert_dataframe(cur, FINAL_TABLE, df_city, conflict_columns=['station_id', 'datetime', 'source'],
+                            update_columns=UPDATE_COLUMNS)
 
 
-def merge_city_data():
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
-    create_table_if_needed(cur)
-    
-    all_final_rows = []
+def _merge_city_in_memory(conn, cur, station, live_query, hist_query):
+    station_id = station['station_id']
+    df_live = pd.read_sql(live_query[0], conn, params=live_query[1])
+    parts = [_add_aqi(df_live)[FINAL_COLUMNS]]
+    df_hist = None
+    if hist_query is not None:
+        df_hist = _prepare_historical(pd.read_sql(hist_query[0], conn, params=hist_query[1]), station_id)
+        parts.append(_add_aqi(df_hist)[FINAL_COLUMNS])
+    hist_rows = 0 if df_hist is None else len(df_hist)
 
-    for city_id, city_name in [(1, 'beijing'), (2, 'delhi'), (3, 'paris')]:
-        print(f"📥 Processing {city_name.capitalize()} (station_id={city_id})...")
+    print(f"📥 Processing {station['name']} (station_id={station_id}): "
+          f"{len(df_live)} new live rows, {hist_rows} new historical rows")
 
-        # Live data
-        df_live = pd.read_sql(f"""
-            SELECT station_id, datetime, source, pm25, pm10, o3, no2, so2, co
-            FROM transformations.merged_observations_pollutants
-            WHERE station_id = {city_id}
-        """, conn)
+    if df_live.empty and hist_rows == 0:
+        return 0, 0, None, None
 
-        # Historical data
-        df_hist = pd.read_sql(f"SELECT * FROM historical_data.{city_name}_air_quality", conn)
-        df_hist.columns = [col.strip().lower().replace("_", "") for col in df_hist.columns]
-        df_hist['datetime'] = pd.to_datetime(df_hist['date'], dayfirst=False, errors='coerce')
-        df_hist['station_id'] = city_id
-        df_hist['source'] = 'csv'
+    rows = _upsert_city_rows(cur, pd.concat(parts, ignore_index=True))
 
-        for pol in ['pm25', 'pm10', 'o3', 'no2', 'so2', 'co']:
-            df_hist[pol] = pd.to_numeric(df_hist.get(pol), errors='coerce')
+    last_observation_id = int(df_live['observation_id'].max()) if not df_live.empty else None
+    last_datetime = df_hist['datetime'].max() if hist_rows and df_hist['datetime'].notna().any() else None
+    return rows, len(df_live) + hist_rows, last_observation_id, last_datetime
 
-        def row_max_aqi(row):
-            values = [calculate_aqi(pol, row[pol]) for pol in ['pm25', 'pm10', 'o3', 'no2', 'so2', 'co']]
-            values = [v for v in values if v is not None]
-            return max(values) if values else None
 
-        for df in [df_live, df_hist]:
-            df['aqi'] = df.apply(row_max_aqi, axis=1)
-            df['aqi_category'] = df['aqi'].apply(get_aqi_category)
+def _merge_city_streaming(conn, cur, station, live_query, hist_query, chunk_size):
+    # Same steps chunk by chunk; rows stay in source order, so later duplicates still win the upsert
+    station_id = station['station_id']
+    rows = live_rows = hist_rows = 0
+    last_observation_id = last_datetime = None
 
-        df_live = df_live[['station_id', 'datetime', 'source', 'pm25', 'pm10', 'o3', 'no2', 'so2', 'co', 'aqi', 'aqi_category']]
-        df_hist = df_hist[['station_id', 'datetime', 'source', 'pm25', 'pm10', 'o3', 'no2', 'so2', 'co', 'aqi', 'aqi_category']]
+    for df_live in iter_query_chunks(conn, *live_query, chunk_size=chunk_size):
+        rows += _upsert_city_rows(cur, _add_aqi(df_live)[FINAL_COLUMNS])
+        live_rows += len(df_live)
+        last_observation_id = int(df_live['observation_id'].max())
 
-        all_final_rows.append(pd.concat([df_live, df_hist], ignore_index=True))
+    for df_hist in (iter_query_chunks(conn, *hist_query, chunk_size=chunk_size) if hist_query else []):
+        df_hist = _add_aqi(_prepare_historical(df_hist, station_id))
+        rows += _upsert_city_rows(cur, df_hist[FINAL_COLUMNS])
+        hist_rows += len(df_hist)
+        if df_hist['datetime'].notna().any():
+            chunk_max = df_hist['datetime'].max()
+            last_datetime = chunk_max if last_datetime is None else max(last_datetime, chunk_max)
 
-    df_final = pd.concat(all_final_rows, ignore_index=True)
+    print(f"📥 Processed {station['name']} (station_id={station_id}) in chunks of {chunk_size}: "
+          f"{live_rows} new live rows, {hist_rows} new historical rows")
+    return rows, live_rows + hist_rows, last_observation_id, last_datetime
 
-    # ✅ Sort the data by datetime
-    df_final = (
-    pd.concat(all_final_rows, ignore_index=True)
-    .sort_values(by=['station_id', 'datetime'], ascending=[True, False])
-)
 
-    for _, row in df_final.iterrows():
-        if pd.isna(row['datetime']):
+def _merge_station(station, stream=False, chunk_size=STREAM_CHUNK_SIZE):
+    # read -> AQI -> write for one station on its own connection and transaction; returns (rows written, rows read).
+    # Stations never share rows or watermarks, so any number of them can commit at the same time.
+    station_id = station['station_id']
+    with connection() as conn:
+        cur = conn.cursor()
+        _, last_observation_id = get_watermark(cur, WATERMARK_STAGE, station_id, 'waqi')
+        last_hist_datetime, _ = get_watermark(cur, WATERMARK_STAGE, station_id, 'csv')
+        live_query = _live_query(station_id, last_observation_id)
+        hist_query = _historical_query(station['historical_table'], last_hist_datetime)
+
+        if stream:
+            rows, rows_read, new_observation_id, new_hist_datetime = _merge_city_streaming(
+                conn, cur, station, live_query, hist_query, chunk_size)
+        else:
+            rows, rows_read, new_observation_id, new_hist_datetime = _merge_city_in_memory(
+                conn, cur, station, live_query, hist_query)
+
+        # Move the marks forward in the same transaction as the rows they cover
+        if new_observation_id is not None:
+            set_watermark(cur, WATERMARK_STAGE, station_id, 'waqi', last_observation_id=new_observation_id)
+        if new_hist_datetime is not None:
+            set_watermark(cur, WATERMARK_STAGE, station_id, 'csv', last_datetime=new_hist_datetime.to_pydatetime())
+
+        conn.commit()
+        cur.close()
+    return rows, rows_read
+
+
+def _init_worker(settings):
+    # Spawned workers start with a fresh pool pointed at the parent's database
+    configure_pool(*settings)
+
+
+def _merge_station_in_worker(station, stream, chunk_size):
+    # Round trips are counted in the worker, hand them back with the row counts
+    before = round_trips()
+    rows, rows_read = _merge_station(station, stream, chunk_size)
+    return rows, rows_read, round_trips() - before
+
+
+def _merge_stations(stations, workers, stream, chunk_size):
+    # Yields (station, (rows written, rows read) or the exception it failed with) as stations finish
+    if workers <= 1:
+        for station in stations:
+            try:
+                yield station, _merge_station(station, stream, chunk_size)
+            except Exception as e:
+                yield station, e
+        return
+
+    # spawn, not fork: stages run in threads and a forked child could inherit a lock held by another one
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(pool_settings(),)) as pool:
+        futures = {pool.submit(_merge_station_in_worker, station, stream, chunk_size): station for station in stations}
+        for future in as_completed(futures):
+            try:
+                rows, rows_read, trips = future.result()
+            except Exception as e:
+                yield futures[future], e
+                continue
+            count_round_trip(trips)
+            yield futures[future], (rows, rows_read)
+
+
+def merge_city_data(full_refresh=False, stream=False, chunk_size=STREAM_CHUNK_SIZE, workers=None):
+    # Every station in real_time_data.stations / station_sources, up to `workers` of them in parallel processes.
+    # stream=True reads through server-side cursors chunk_size rows at a time instead of whole tables
+    with connection() as conn:
+        cur = conn.cursor()
+        ensure_watermark_table(cur)
+        if create_table_if_needed(cur, full_refresh):
+            print("🧱 Full rebuild of transformations.final_city_merged")
+        stations = load_stations(cur)
+        conn.commit()
+        cur.close()
+
+    workers = max(1, min(workers or MERGE_CITY_WORKERS, len(stations)))
+    print(f"🏭 Merging {len(stations)} stations with {workers} worker(s)")
+
+    total_rows = 0
+    failed = []
+    for station, result in _merge_stations(stations, workers, stream, chunk_size):
+        if isinstance(result, Exception):
+            print(f"❌ Station {station['name']} (station_id={station['station_id']}) failed: {result}")
+            count_error("merge", city=station['label'])
+            failed.append(station['name'])
             continue
-        cur.execute("""
-            INSERT INTO transformations.final_city_merged (
-                station_id, datetime, source, pm25, pm10, o3, no2, so2, co, aqi, aqi_category
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (
-            row['station_id'],
-            row['datetime'],
-            row['source'],
-            float(row['pm25']) if pd.notna(row['pm25']) else None,
-            float(row['pm10']) if pd.notna(row['pm10']) else None,
-            float(row['o3']) if pd.notna(row['o3']) else None,
-            float(row['no2']) if pd.notna(row['no2']) else None,
-            float(row['so2']) if pd.notna(row['so2']) else None,
-            float(row['co']) if pd.notna(row['co']) else None,
-            int(row['aqi']) if pd.notna(row['aqi']) else None,
-            row['aqi_category']
-        ))
-
-    conn.commit()
-    cur.close()
-    conn.close()
-    print("✅ Final table created: transformations.final_city_merged (sorted by datetime)")
+        rows, rows_read = result
+        add_rows(read=rows_read, written=rows, city=station['label'])
+        total_rows += rows
+
+    # Stations that finished keep their rows and watermarks, the failed ones are picked up again next run
+    if failed:
+        raise RuntimeError(f"merge_city_data failed for {len(failed)} station(s): {', '.join(failed)}")
+    print(f"✅ transformations.final_city_merged up to date ({total_rows} rows inserted/updated)")
+    print_peak_rss("merge_city_data")
+    return total_rows
 
 if __name__ == "__main__":
-    merge_city_data()
\ No newline at end of file
+    merge_city_data(full_refresh="--full-refresh" in sys.argv, stream="--stream" in sys.argv)
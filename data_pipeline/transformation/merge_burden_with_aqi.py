@@ -5,47 +5,23 @@ import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import pandas as pd
-import psycopg2
-from config.db_config import DB_CONFIG
+from data_pipeline.db import connection
+from data_pipeline.bulk_load import copy_dataframe
+from data_pipeline.transformation.aqi_rollups import update_rollups
+from data_pipeline.streaming import STREAM_CHUNK_SIZE, iter_query_chunks, print_peak_rss
+from data_pipeline.metrics import add_rows
+from data_pipeline.stations import burden_stations
 
 
-def merge_burden_data():
+MERGED_COLUMNS = [
+    "station_id", "year", "country", "ghe_cause",
+    "mean_value", "mean_lower_value", "mean_upper_value",
+    "age_standardized_rate", "age_standardized_rate_lower",
+    "age_standardized_rate_upper", "avg_aqi"
+]
 
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
-
-    # Step 1: Load and aggregate AQI by station_id and year
-    query_aqi = """
-        SELECT station_id, EXTRACT(YEAR FROM datetime)::int AS year, AVG(aqi)::float AS avg_aqi
-        FROM transformations.final_city_merged
-        GROUP BY station_id, year
-    """
-    aqi_df = pd.read_sql(query_aqi, conn)
-
-    # Step 2: Load burden datasets
-    china_df = pd.read_sql("SELECT * FROM burden_data.china_dataset", conn)
-    france_df = pd.read_sql("SELECT * FROM burden_data.france_dataset", conn)
-    india_df = pd.read_sql("SELECT * FROM burden_data.india_dataset", conn)
-
-    # Step 3: Add station_id and ensure year is int
-    china_df["station_id"] = 1
-    india_df["station_id"] = 2
-    france_df["station_id"] = 3
-
-    for df in [china_df, france_df, india_df]:
-        df["year"] = df["year"].astype(int)
-
-    # Step 4: Combine burden datasets
-    burden_df = pd.concat([china_df, france_df, india_df], ignore_index=True)
-
-    # Step 5: Merge burden data with AQI
-    merged_df = pd.merge(
-        burden_df,
-        aqi_df,
-        on=["station_id", "year"],
-        how="inner"
-    )
 
+def _create_merged_table(conn, cur):
     # Step 6: Drop old table if it exists
     cur.execute("DROP TABLE IF EXISTS transformations.final_city_burden_merged")
     conn.commit()
@@ -69,34 +45,79 @@ def merge_burden_data():
     """)
     conn.commit()
 
-    # Step 8: Insert merged data
-    for _, row in merged_df.iterrows():
-        cur.execute("""
-            INSERT INTO transformations.final_city_burden_merged (
-                station_id, year, country, ghe_cause,
-                mean_value, mean_lower_value, mean_upper_value,
-                age_standardized_rate, age_standardized_rate_lower,
-                age_standardized_rate_upper, avg_aqi
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (
-            row["station_id"],
-            row["year"],
-            row["country__territory__area"],
-            row["ghe_cause"],
-            float(row["mean_value"]),
-            float(row["mean_lower_value"]),
-            float(row["mean_upper_value"]),
-            float(row["age_standardized_rate"]),
-            float(row["age_standardized_rate_lower_value"]),
-            float(row["age_standardized_rate_upper_value"]),
-            float(row["avg_aqi"])
-        ))
 
-    conn.commit()
-    cur.close()
-    conn.close()
+def _prepare_burden(df, station_id):
+    # Step 3: Add station_id and ensure year is int
+    df["station_id"] = station_id
+    df["year"] = df["year"].astype(int)
+    return df
+
+
+def _copy_merged(cur, merged_df):
+    # Step 8: Bulk load merged data
+    merged_df = merged_df.rename(columns={
+        "country__territory__area": "country",
+        "age_standardized_rate_lower_value": "age_standardized_rate_lower",
+        "age_standardized_rate_upper_value": "age_standardized_rate_upper",
+    })
+    return copy_dataframe(cur, "transformations.final_city_burden_merged", merged_df, columns=MERGED_COLUMNS)
+
+
+def merge_burden_data(stream=False, chunk_size=STREAM_CHUNK_SIZE):
+    # stream=True reads each burden table through a server-side cursor chunk_size rows at a time
+
+    with connection() as conn:
+        cur = conn.cursor()
+
+        # Step 1: Yearly AQI per station from the rollup (same value as AVG(aqi) over final_city_merged)
+        query_aqi = """
+            SELECT station_id, EXTRACT(YEAR FROM bucket)::int AS year,
+                   (aqi_sum::numeric / NULLIF(aqi_count, 0))::float AS avg_aqi
+            FROM transformations.aqi_rollup_yearly
+        """
+        aqi_df = pd.read_sql(query_aqi, conn)
+
+        # Burden table -> station_id from real_time_data.station_sources, in the order rows are appended
+        burden_tables = burden_stations(cur)
+        if not burden_tables:
+            print("⚠️ No burden table is mapped to a station yet, final_city_burden_merged will be empty.")
+
+        if stream:
+            _create_merged_table(conn, cur)
+            for table, station_id in burden_tables:
+                for chunk in iter_query_chunks(conn, f"SELECT * FROM burden_data.{table}", chunk_size=chunk_size):
+                    chunk = _prepare_burden(chunk, station_id)
+                    written = _copy_merged(cur, pd.merge(chunk, aqi_df, on=["station_id", "year"], how="inner"))
+                    add_rows(read=len(chunk), written=written, city=table)
+        else:
+            # Step 2: Load burden datasets
+            burden_dfs = [_prepare_burden(pd.read_sql(f"SELECT * FROM burden_data.{table}", conn), station_id)
+                          for table, station_id in burden_tables]
+
+            _create_merged_table(conn, cur)
+            # Without burden tables the merged table stays empty, as in streaming mode
+            if burden_dfs:
+                # Step 4: Combine burden datasets
+                burden_df = pd.concat(burden_dfs, ignore_index=True)
+
+                # Step 5: Merge burden data with AQI
+                merged_df = pd.merge(
+                    burden_df,
+                    aqi_df,
+                    on=["station_id", "year"],
+                    how="inner"
+                )
+
+                _copy_merged(cur, merged_df)
+                for (table, station_id), burden in zip(burden_tables, burden_dfs):
+                    add_rows(read=len(burden), written=int((merged_df["station_id"] == station_id).sum()), city=table)
+
+        conn.commit()
+        cur.close()
     
     print("✅ Done! Table 'final_city_burden_merged' has been created and populated.")
+    print_peak_rss("merge_burden_data")
 
 if __name__ == "__main__":
+    update_rollups()
     merge_burden_data()
\ No newline at end of file
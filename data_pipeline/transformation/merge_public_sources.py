@@ -4,14 +4,57 @@ import os
 # Ensure project root is in sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-import psycopg2
-import pandas as pd
-from config.db_config import DB_CONFIG
+from data_pipeline.db import connection
+from data_pipeline.watermarks import ensure_watermark_table, get_watermark, set_watermark, reset_watermarks
+from data_pipeline.output.parquet_cache import reset_cache
+from data_pipeline.metrics import add_rows
+from data_pipeline.cleaning.fill_gaps import reset_gap_fill
+
+MERGED_COLUMNS = """
+    observation_id, station_id, datetime, source, temperature,
+    humidity, pressure, wind, pm25, pm10, o3, no2, so2, co
+"""
+WATERMARK_STAGE = "merged_observations_pollutants"
+
+# Observations with their pollutant columns, {window} narrows it to a range of observation_ids.
+# Only observations with at least one pollutant value, as the join on the old pollutants table did.
+SOURCE_QUERY = """
+    SELECT
+        o.observation_id,
+        o.station_id,
+        o.datetime,
+        o.source,
+        o.temperature,
+        o.humidity,
+        o.pressure,
+        o.wind,
+        o.pm25,
+        o.pm10,
+        o.o3,
+        o.no2,
+        o.so2,
+        o.co
+    FROM
+        real_time_data.observations o
+    WHERE
+        num_nonnulls(o.pm25, o.pm10, o.o3, o.no2, o.so2, o.co) > 0
+        {window}
+"""
+
+
+def _relation_kind(cur):
+    # 'r' table, 'm' materialized view, None when missing
+    cur.execute("""
+        SELECT c.relkind
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'transformations' AND c.relname = 'merged_observations_pollutants'
+    """)
+    row = cur.fetchone()
+    return row[0] if row else None
 
-# Ensure project root is in sys.path
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-def create_schema_and_table():
+def create_schema_and_table(materialized_view=False):
     create_schema_query = "CREATE SCHEMA IF NOT EXISTS transformations;"
 
     create_table_query = """
@@ -33,64 +76,78 @@ def create_schema_and_table():
     );
     """
 
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
-    cur.execute(create_schema_query)
-    cur.execute(create_table_query)
-    conn.commit()
-    cur.close()
-    conn.close()
+    # Same name either way, so readers do not care which mode is active
+    create_view_query = f"""
+    CREATE MATERIALIZED VIEW transformations.merged_observations_pollutants AS
+    {SOURCE_QUERY.format(window="")};
+    CREATE UNIQUE INDEX merged_observations_pollutants_mv_key
+        ON transformations.merged_observations_pollutants (observation_id);
+    """
+
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(create_schema_query)
+        ensure_watermark_table(cur)
+        kind = _relation_kind(cur)
+
+        if materialized_view and kind != 'm':
+            if kind == 'r':
+                cur.execute("DROP TABLE transformations.merged_observations_pollutants;")
+            cur.execute(create_view_query)
+        elif not materialized_view and kind != 'r':
+            if kind == 'm':
+                cur.execute("DROP MATERIALIZED VIEW transformations.merged_observations_pollutants;")
+            cur.execute(create_table_query)
+            # A new, empty table has to be filled from the first observation again
+            reset_watermarks(cur, WATERMARK_STAGE)
+            reset_cache(cur, "merged_observations_pollutants")
+            reset_gap_fill(cur)
+        if not materialized_view:
+            # Per-station time ranges, read by fill_gaps and merge_city_data
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS merged_observations_pollutants_station_datetime_idx
+                    ON transformations.merged_observations_pollutants (station_id, datetime);
+            """)
+
+        conn.commit()
+        cur.close()
     print("✅ Schema and table created (if not exist).")
 
-def merge_public_sources():
-    conn = psycopg2.connect(**DB_CONFIG)
+def merge_public_sources(materialized_view=False):
+    with connection() as conn:
+        cur = conn.cursor()
 
-    # Query to get merged and pivoted data
-    query = """
-    SELECT
-        o.observation_id,
-        o.station_id,
-        o.datetime,
-        o.source,
-        o.temperature,
-        o.humidity,
-        o.pressure,
-        o.wind,
-        MAX(CASE WHEN p.name = 'pm25' THEN p.value END) AS pm25,
-        MAX(CASE WHEN p.name = 'pm10' THEN p.value END) AS pm10,
-        MAX(CASE WHEN p.name = 'o3' THEN p.value END) AS o3,
-        MAX(CASE WHEN p.name = 'no2' THEN p.value END) AS no2,
-        MAX(CASE WHEN p.name = 'so2' THEN p.value END) AS so2,
-        MAX(CASE WHEN p.name = 'co' THEN p.value END) AS co
-    FROM
-        real_time_data.observations o
-    JOIN
-        real_time_data.pollutants p
-    ON
-        o.observation_id = p.observation_id
-    GROUP BY
-        o.observation_id, o.station_id, o.datetime, o.source, o.temperature, o.humidity, o.pressure, o.wind
-    ORDER BY o.observation_id;
-    """
+        if materialized_view:
+            # CONCURRENTLY keeps the view readable while it refreshes (needs the unique index)
+            cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY transformations.merged_observations_pollutants;")
+            conn.commit()
+            cur.close()
+            print("✅ Refreshed materialized view transformations.merged_observations_pollutants")
+            return
 
-    df = pd.read_sql_query(query, conn)
+        # Only observations above the high-water mark are copied, entirely inside the database.
+        # The upper bound is fixed first so rows committed while we run are picked up next time.
+        ensure_watermark_table(cur)
+        _, since_id = get_watermark(cur, WATERMARK_STAGE)
+        cur.execute("SELECT COALESCE(MAX(observation_id), 0) FROM real_time_data.observations")
+        until_id = cur.fetchone()[0]
 
-    # Insert into the new table
-    cur = conn.cursor()
-    for _, row in df.iterrows():
-        cur.execute("""
-                INSERT INTO transformations.merged_observations_pollutants (
-                observation_id, station_id, datetime, source, temperature,
-                humidity, pressure, wind, pm25, pm10, o3, no2, so2, co
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        window = "AND o.observation_id > %(since_id)s AND o.observation_id <= %(until_id)s"
+        cur.execute(f"""
+            INSERT INTO transformations.merged_observations_pollutants ({MERGED_COLUMNS})
+            {SOURCE_QUERY.format(window=window)}
             ON CONFLICT (observation_id) DO NOTHING;
-        """, tuple(row))
-    
-    conn.commit()
-    cur.close()
-    conn.close()
-    print("✅ Data merged and inserted into transformations.merged_observations_pollutants")
+        """, {"since_id": since_id or 0, "until_id": until_id})
+        inserted = cur.rowcount
+        add_rows(written=inserted)
+
+        set_watermark(cur, WATERMARK_STAGE, last_observation_id=until_id)
+        conn.commit()
+        cur.close()
+    print(f"✅ Data merged and inserted into transformations.merged_observations_pollutants ({inserted} new rows)")
+    return inserted
 
 if __name__ == "__main__":
-    create_schema_and_table()
-    merge_public_sources()
+    use_view = "--materialized-view" in sys.argv
+    create_schema_and_table(materialized_view=use_view)
+    merge_public_sources(materialized_view=use_view)
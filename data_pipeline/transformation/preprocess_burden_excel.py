@@ -1,43 +1,35 @@
 import os
-import pandas as pd
-import re
+import sys
+
+# Ensure project root is in sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data_pipeline.ingestion.import_manifest import check_file, record_file, UNCHANGED
+from data_pipeline.ingestion.import_burden_data import read_burden_workbook, export_cleaned_excel
+
+MANIFEST_SECTION = "preprocess_burden_excel"
 
 # === SETUP ===
 input_folder = "data/Burden Datasets"
 output_folder = "data/Cleaned Burden Datasets"
 
-# Make sure output folder exists
-os.makedirs(output_folder, exist_ok=True)
-
-# === CLEANING FUNCTION ===
-def clean_cell(cell):
-    if pd.isna(cell):
-        return None
-    text = str(cell)
-    text = re.sub(r'\[.*?\]', '', text)  # remove bracket content
-    return text.strip()
-
 # === PROCESS ALL FILES ===
-def preprocess_excel():
-    for filename in os.listdir(input_folder):
+# Optional export only: import_burden_data cleans the raw workbooks in memory and loads them directly
+def preprocess_excel(force=False):
+    for filename in sorted(os.listdir(input_folder)):
         if filename.endswith(".xlsx"):
             input_path = os.path.join(input_folder, filename)
             output_path = os.path.join(output_folder, filename)
 
-            print(f"📄 Cleaning: {filename}")
-
-            # Load file
-            df = pd.read_excel(input_path, dtype=str)
-
-            # Clean column names
-            df.columns = [clean_cell(col) for col in df.columns]
+            # Source workbook unchanged and its cleaned copy still there: nothing to redo
+            status, _ = check_file(MANIFEST_SECTION, filename, input_path)
+            if status == UNCHANGED and os.path.exists(output_path) and not force:
+                print(f"⏭️ Unchanged, skipped: {filename}")
+                continue
 
-            # Clean data values
-            df_cleaned = df.applymap(clean_cell)
-
-            # Save cleaned file
-            df_cleaned.to_excel(output_path, index=False)
-            print(f"✅ Saved cleaned file to: {output_path}")
+            print(f"📄 Cleaning: {filename}")
+            export_cleaned_excel(read_burden_workbook(input_path), output_path)
+            record_file(MANIFEST_SECTION, filename, input_path)
 
 if __name__ == "__main__":
-    preprocess_excel()
+    preprocess_excel(force="--force" in sys.argv)
@@ -0,0 +1,82 @@
+# Per-stage high-water marks so stages can pick up only what changed since their last run.
+# Stage-wide marks (not tied to one station/source) use ALL_STATIONS / ALL_SOURCES.
+
+from psycopg2 import errors
+
+ALL_STATIONS = 0
+ALL_SOURCES = 'all'
+
+
+def ensure_watermark_table(cur):
+    cur.execute("SELECT to_regclass('pipeline_state.watermarks')")
+    if cur.fetchone()[0] is not None:
+        return
+    # Stages run in parallel and two concurrent CREATE ... IF NOT EXISTS can still collide on the catalog;
+    # the savepoint lets the loser carry on with the table the other stage just created
+    cur.execute("SAVEPOINT ensure_watermark_table")
+    try:
+        cur.execute("""
+            CREATE SCHEMA IF NOT EXISTS pipeline_state;
+            CREATE TABLE IF NOT EXISTS pipeline_state.watermarks (
+                stage TEXT,
+                station_id INTEGER,
+                source TEXT,
+                last_datetime TIMESTAMP,
+                last_observation_id INTEGER,
+                updated_at TIMESTAMP DEFAULT now(),
+                PRIMARY KEY (stage, station_id, source)
+            );
+        """)
+    except (errors.UniqueViolation, errors.DuplicateSchema, errors.DuplicateTable):
+        cur.execute("ROLLBACK TO SAVEPOINT ensure_watermark_table")
+    cur.execute("RELEASE SAVEPOINT ensure_watermark_table")
+
+
+def get_watermark(cur, stage, station_id=ALL_STATIONS, source=ALL_SOURCES):
+    # Returns (last_datetime, last_observation_id), both None when the stage never ran
+    cur.execute("""
+        SELECT last_datetime, last_observation_id
+        FROM pipeline_state.watermarks
+        WHERE stage = %s AND station_id = %s AND source = %s
+    """, (stage, station_id, source))
+    row = cur.fetchone()
+    return row if row else (None, None)
+
+
+def set_watermark(cur, stage, station_id=ALL_STATIONS, source=ALL_SOURCES, last_datetime=None, last_observation_id=None):
+    # Never moves a mark backwards, a NULL argument leaves that part untouched
+    cur.execute("""
+        INSERT INTO pipeline_state.watermarks (stage, station_id, source, last_datetime, last_observation_id)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (stage, station_id, source) DO UPDATE SET
+            last_datetime = GREATEST(pipeline_state.watermarks.last_datetime, EXCLUDED.last_datetime),
+            last_observation_id = GREATEST(pipeline_state.watermarks.last_observation_id, EXCLUDED.last_observation_id),
+            updated_at = now()
+    """, (stage, station_id, source, last_datetime, last_observation_id))
+
+
+def reset_watermarks(cur, stage, station_id=None, source=None):
+    # Forget marks for a stage (optionally one station/source) so its next run starts from scratch
+    query = "DELETE FROM pipeline_state.watermarks WHERE stage = %s"
+    params = [stage]
+    if station_id is not None:
+        query += " AND station_id = %s"
+        params.append(station_id)
+    if source is not None:
+        query += " AND source = %s"
+        params.append(source)
+    cur.execute(query, params)
+
+
+def rewind_watermarks(cur, stage, observation_ids, source=ALL_SOURCES):
+    # Move existing last_observation_id marks back to at most {station_id: id}, so the stage revisits
+    # rows an upstream stage changed in place. Stations without a mark are already read from the start.
+    if not observation_ids:
+        return
+    cur.execute("""
+        UPDATE pipeline_state.watermarks w
+        SET last_observation_id = LEAST(w.last_observation_id, r.last_observation_id),
+            updated_at = now()
+        FROM unnest(%s::int[], %s::int[]) AS r (station_id, last_observation_id)
+        WHERE w.stage = %s AND w.source = %s AND w.station_id = r.station_id
+    """, (list(observation_ids), list(observation_ids.values()), stage, source))
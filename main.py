@@ -1,5 +1,7 @@
 import sys
 import os
+import argparse
+from functools import partial
 
 # Ensure root directory is in sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), 'data_pipeline')))
@@ -8,37 +10,91 @@ from data_pipeline.run_daily import run_daily
 from data_pipeline.ingestion.import_historical_air_quality import import_historical_data
 from data_pipeline.ingestion.import_burden_data import import_burden_data
 from data_pipeline.transformation.merge_public_sources import merge_public_sources, create_schema_and_table
+from data_pipeline.cleaning.fill_gaps import fill_gaps
 from data_pipeline.transformation.merge_and_calculate_city_aqi import merge_city_data
-from data_pipeline.transformation.preprocess_burden_excel import preprocess_excel
+from data_pipeline.transformation.aqi_rollups import update_rollups
 from data_pipeline.transformation.merge_burden_with_aqi import merge_burden_data
+from data_pipeline.output.parquet_cache import export_parquet_cache
+from data_pipeline.db import acquire_stats, close_pool
+from data_pipeline.streaming import STREAM_CHUNK_SIZE
+from data_pipeline.stage_runner import run_stages, print_timing_report
+from data_pipeline.metrics import reset_metrics, record_stage_results, run_record, write_run_record, write_prometheus_textfile
 
-def main():
-    print("🚀 Starting Full Pipeline...\n")
-
-    run_daily()
-    print("✅ Finished run_daily\n")
+# stage -> (function, stages that must finish first)
+STAGES = {
+    "run_daily": (run_daily, []),
+    "import_historical_data": (import_historical_data, []),
+    "import_burden_data": (import_burden_data, []),
+    "create_schema_and_table": (create_schema_and_table, []),
+    "merge_public_sources": (merge_public_sources, ["run_daily", "create_schema_and_table"]),
+    "fill_gaps": (fill_gaps, ["merge_public_sources"]),
+    "merge_city_data": (merge_city_data, ["fill_gaps", "import_historical_data"]),
+    "update_rollups": (update_rollups, ["merge_city_data"]),
+    "merge_burden_data": (merge_burden_data, ["update_rollups", "import_burden_data"]),
+    "export_parquet_cache": (export_parquet_cache, ["merge_city_data"]),
+}
+# Only run when asked for (--parquet-cache, or named in --only/--from)
+OPTIONAL_STAGES = {"export_parquet_cache"}
 
-    import_historical_data()
-    print("✅ Imported historical air quality data\n")
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the air quality pipeline")
+    parser.add_argument("--only", nargs="+", metavar="STAGE", choices=list(STAGES),
+                        help="run just these stages (their dependencies are assumed done)")
+    parser.add_argument("--from", dest="start_from", metavar="STAGE", choices=list(STAGES),
+                        help="run this stage and everything downstream of it")
+    parser.add_argument("--workers", type=int, default=4, help="stages run at the same time")
+    parser.add_argument("--stream", action="store_true",
+                        help="read the transformation inputs in chunks through server-side cursors")
+    parser.add_argument("--chunk-size", type=int, default=STREAM_CHUNK_SIZE, help="rows per chunk with --stream")
+    parser.add_argument("--merge-workers", type=int, default=None,
+                        help="stations merge_city_data processes at the same time (default MERGE_CITY_WORKERS)")
+    parser.add_argument("--parquet-cache", action="store_true",
+                        help="refresh the local Parquet copy of the transformation tables")
+    parser.add_argument("--export-cleaned-excel", action="store_true",
+                        help="also write the cleaned burden workbooks to data/Cleaned Burden Datasets")
+    parser.add_argument("--skip-ingestion", action="store_true",
+                        help="leave out run_daily (when data_pipeline/daemon.py keeps real_time_data current)")
+    args = parser.parse_args(argv)
 
-    import_burden_data()
-    print("✅ Imported burden datasets\n")
+    requested = set(args.only or []) | {args.start_from}
+    stages = {name: stage for name, stage in STAGES.items()
+              if name not in OPTIONAL_STAGES or args.parquet_cache or name in requested}
+    if args.stream:
+        for name, func in [("merge_city_data", merge_city_data), ("merge_burden_data", merge_burden_data)]:
+            stages[name] = (partial(func, stream=True, chunk_size=args.chunk_size), STAGES[name][1])
+    if args.merge_workers is not None:
+        stages["merge_city_data"] = (partial(stages["merge_city_data"][0], workers=args.merge_workers),
+                                     STAGES["merge_city_data"][1])
+    if args.export_cleaned_excel:
+        stages["import_burden_data"] = (partial(import_burden_data, export_folder="data/Cleaned Burden Datasets"), [])
 
-    create_schema_and_table()
+    only = args.only
+    if args.skip_ingestion:
+        # Stages outside the selection count as done, so everything downstream of run_daily still runs
+        only = [name for name in (only or stages) if name != "run_daily"]
 
-    merge_public_sources()
-    print("✅ Merged public sources\n")
+    print("🚀 Starting Full Pipeline...\n")
 
-    merge_city_data()
-    print("✅ Merged and calculated AQI per city\n")
+    reset_metrics()
+    results = run_stages(stages, max_workers=args.workers, only=only, start_from=args.start_from)
+    print_timing_report(stages, results)
 
-    preprocess_excel()
-    print("✅ Preprocessed burden Excel files\n")
+    stats = acquire_stats()
+    print(f"🔌 DB connections: {stats['count']} acquired, "
+          f"avg {stats['mean_ms']:.1f} ms, p95 {stats['p95_ms']:.1f} ms, max {stats['max_ms']:.1f} ms to acquire")
+    close_pool()
 
-    merge_burden_data()
-    print("✅ Merged AQI with burden datasets\n")
+    # Per-stage/per-city numbers of this run, as JSON and as a Prometheus textfile
+    record_stage_results(results)
+    record = run_record(extra={"argv": sys.argv[1:] if argv is None else list(argv), "db_connections": stats})
+    print(f"📝 Run record: {write_run_record(record)}, metrics: {write_prometheus_textfile(record)}")
 
+    failed = [name for name, r in results.items() if r['status'] != 'done']
+    if failed:
+        print(f"\n❌ Pipeline finished with failed or skipped stages: {', '.join(failed)}")
+        return 1
     print("\n🎉 Full pipeline execution complete!")
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
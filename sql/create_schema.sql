@@ -1,3 +1,6 @@
+-- Reference schema for real_time_data. Live databases are created and upgraded by
+-- data_pipeline/migrations.py, which also creates the monthly observation partitions.
+
 CREATE TABLE IF NOT EXISTS stations (
     station_id SERIAL PRIMARY KEY,
     name TEXT UNIQUE,
@@ -7,8 +10,23 @@ CREATE TABLE IF NOT EXISTS stations (
     longitude FLOAT
 );
 
+-- Historical table (schema historical_data) and burden table (schema burden_data) of each station,
+-- read by the transformations; no foreign key so a mapping can exist before the station's first reading
+CREATE TABLE IF NOT EXISTS station_sources (
+    station_id INTEGER PRIMARY KEY,
+    historical_table TEXT,
+    burden_table TEXT
+);
+
+INSERT INTO station_sources (station_id, historical_table, burden_table) VALUES
+    (1, 'beijing_air_quality', 'china_dataset'),
+    (2, 'delhi_air_quality', 'india_dataset'),
+    (3, 'paris_air_quality', 'france_dataset')
+ON CONFLICT (station_id) DO NOTHING;
+
+-- Range-partitioned by month on datetime (observations_yYYYYmMM), stray rows go to observations_default
 CREATE TABLE IF NOT EXISTS observations (
-    observation_id SERIAL PRIMARY KEY,
+    observation_id SERIAL,
     station_id INTEGER REFERENCES stations(station_id),
     datetime TIMESTAMP,
     aqi INTEGER,
@@ -17,12 +35,27 @@ CREATE TABLE IF NOT EXISTS observations (
     temperature FLOAT,
     humidity FLOAT,
     pressure FLOAT,
-    wind FLOAT
-);
+    wind FLOAT,
+    pm25 DOUBLE PRECISION,
+    pm10 DOUBLE PRECISION,
+    o3 DOUBLE PRECISION,
+    co DOUBLE PRECISION,
+    no2 DOUBLE PRECISION,
+    so2 DOUBLE PRECISION
+) PARTITION BY RANGE (datetime);
+
+CREATE TABLE IF NOT EXISTS observations_default PARTITION OF observations DEFAULT;
+
+-- Unique indexes on a partitioned table have to include the partition key
+CREATE UNIQUE INDEX IF NOT EXISTS observations_observation_id_key
+    ON observations (observation_id, datetime);
+
+CREATE UNIQUE INDEX IF NOT EXISTS observations_station_datetime_key
+    ON observations (station_id, datetime);
 
-CREATE TABLE IF NOT EXISTS pollutants (
-    pollutant_id SERIAL PRIMARY KEY,
-    observation_id INTEGER REFERENCES observations(observation_id),
-    name TEXT,
-    value FLOAT
-);
\ No newline at end of file
+-- Read-only view in the old one-row-per-pollutant shape, values live on observations
+CREATE OR REPLACE VIEW pollutants AS
+SELECT NULL::INTEGER AS pollutant_id, o.observation_id, v.name, v.value
+FROM observations o
+CROSS JOIN LATERAL (VALUES ('pm25', o.pm25), ('pm10', o.pm10), ('o3', o.o3), ('co', o.co), ('no2', o.no2), ('so2', o.so2)) AS v (name, value)
+WHERE v.value IS NOT NULL;
@@ -0,0 +1,50 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data_pipeline.transformation.aqi_engine import (AQI_BREAKPOINTS, POLLUTANTS, calculate_aqi_frame,
+                                                     calculate_sub_index, categorize_aqi)
+from benchmarks.aqi_engine_benchmark import calculate_aqi, get_aqi_category, legacy_aqi, make_sample
+
+
+def _edge_values(pollutant):
+    # Every breakpoint edge, the gaps between ranges, below and above the scale, missing and unparseable values
+    values = [-1.0, np.nan, None, "n/a"]
+    ranges = AQI_BREAKPOINTS[pollutant]
+    for (low, high, _, _), following in zip(ranges, ranges[1:] + [None]):
+        values += [low, high, (low + high) / 2]
+        values.append((high + following[0]) / 2 if following else high + 1)
+    return values
+
+
+@pytest.mark.parametrize("pollutant", POLLUTANTS)
+def test_sub_index_matches_scalar_reference_on_edges(pollutant):
+    values = _edge_values(pollutant)
+    expected = [calculate_aqi(pollutant, v) for v in values]
+    got = calculate_sub_index(pollutant, values)
+    assert [None if np.isnan(v) else int(v) for v in got] == expected
+
+
+def test_categories_match_scalar_reference():
+    aqi = [-1, 0, 50, 50.5, 51, 100, 101, 150, 151, 200, 201, 300, 301, 500, 501, np.nan]
+    assert list(categorize_aqi(aqi)) == [get_aqi_category(v) for v in aqi]
+
+
+def test_missing_aqi_is_out_of_range():
+    result = calculate_aqi_frame(pd.DataFrame({pol: [np.nan, 1.0] for pol in POLLUTANTS}))
+    assert result['aqi'].isna().tolist() == [True, False]
+    assert result['aqi_category'].tolist() == ["Out of Range", "Good"]
+
+
+def test_frame_matches_row_by_row_path():
+    df = make_sample(2000, seed=7)
+    legacy_values, legacy_categories = legacy_aqi(df)
+    result = calculate_aqi_frame(df)
+    assert (legacy_values.astype('Float64').astype('Int64').fillna(-1) == result['aqi'].fillna(-1)).all()
+    assert (legacy_categories == result['aqi_category']).all()
@@ -0,0 +1,122 @@
+import os
+import sys
+import csv
+import io
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+import psycopg2
+import pytest
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data_pipeline import bulk_load
+from data_pipeline.bulk_load import to_copy_text, copy_rows, copy_dataframe, upsert_rows
+
+
+class RecordingCursor:
+    # Keeps the SQL and CSV text each copy_expert call would have sent to Postgres
+    def __init__(self):
+        self.copies = []
+
+    def copy_expert(self, sql, buffer):
+        self.copies.append((sql, buffer.read()))
+
+
+def _copied_text(rows, columns=("a", "b"), column_types=None, **kwargs):
+    cur = RecordingCursor()
+    copy_rows(cur, "t", list(columns), rows, column_types or {}, **kwargs)
+    return "".join(text for _, text in cur.copies)
+
+
+@pytest.mark.parametrize("value, integer, expected", [
+    (None, False, None),
+    (np.nan, False, None),
+    (float("nan"), True, None),
+    (pd.NaT, False, None),
+    (pd.NA, False, None),
+    (np.datetime64("NaT"), False, None),
+    (True, False, "t"),
+    (np.bool_(False), False, "f"),
+    (3, False, "3"),
+    (np.int64(7), False, "7"),
+    (2.5, False, "2.5"),
+    (np.float32(0.5), False, "0.5"),
+    (4.0, True, "4"),
+    (4.0, False, "4.0"),
+    (4.5, True, "4.5"),
+    (datetime(2025, 4, 10, 8, 30), False, "2025-04-10 08:30:00"),
+    (pd.Timestamp("2025-04-10 08:30:00"), False, "2025-04-10 08:30:00"),
+    (np.datetime64("2025-04-10T08:30:00"), False, "2025-04-10 08:30:00"),
+    (date(2025, 4, 10), False, "2025-04-10"),
+    ("Beijing", False, "Beijing"),
+])
+def test_to_copy_text(value, integer, expected):
+    assert to_copy_text(value, integer) == expected
+
+
+def test_null_is_unquoted_and_empty_string_is_quoted():
+    assert _copied_text([(None, ""), (np.nan, "x")]) == ',""\n,"x"\n'
+
+
+def test_quotes_commas_and_newlines_round_trip():
+    rows = [('say "hi"', "a,b"), ("line one\nline two", "back\\slash")]
+    text = _copied_text(rows)
+    assert text.startswith('"say ""hi""","a,b"\n')
+    assert [tuple(r) for r in csv.reader(io.StringIO(text))] == rows
+
+
+def test_integer_columns_drop_the_float_suffix():
+    # pandas turns an int column with gaps into float64, the COPY text must still parse as an integer
+    df = pd.DataFrame({"station_id": [1, None, 3], "pm25": [1.0, 2.0, None]})
+    cur = RecordingCursor()
+    copy_dataframe(cur, "t", df, column_types={"station_id": "integer", "pm25": "double precision"})
+    assert cur.copies[0][1] == '"1","1.0"\n,"2.0"\n"3",\n'
+
+
+def test_copy_rows_quotes_column_names_and_chunks(monkeypatch):
+    monkeypatch.setattr(bulk_load, "COPY_CHUNK_SIZE", 2)
+    cur = RecordingCursor()
+    copied = copy_rows(cur, "t", ["city", 'odd"name'], iter([("a", 1), ("b", 2), ("c", 3)]), {})
+    assert copied == 3
+    assert [sql for sql, _ in cur.copies] == ['COPY t ("city", "odd""name") FROM STDIN WITH (FORMAT csv)'] * 2
+    assert [text for _, text in cur.copies] == ['"a","1"\n"b","2"\n', '"c","3"\n']
+
+
+def test_copy_rows_empty_input_sends_nothing():
+    cur = RecordingCursor()
+    assert copy_rows(cur, "t", ["a"], [], {}) == 0
+    assert cur.copies == []
+
+
+@pytest.fixture
+def pg_cursor():
+    # Runs against the database named by the libpq environment (PGHOST, PGUSER, PGDATABASE, ...)
+    if not os.environ.get("PGDATABASE"):
+        pytest.skip("PGDATABASE not set")
+    conn = psycopg2.connect("")
+    try:
+        with conn.cursor() as cur:
+            cur.execute("CREATE TEMP TABLE bulk_load_test (id integer PRIMARY KEY, note text, value double precision)")
+            yield cur
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def test_upsert_keeps_the_last_row_per_key(pg_cursor):
+    pg_cursor.execute("INSERT INTO bulk_load_test VALUES (1, 'old', 0), (2, 'untouched', 0)")
+    rows = [(1, "first", 1.0), (3, 'new, "quoted"', None), (1, "last", 2.0)]
+    merged = upsert_rows(pg_cursor, "bulk_load_test", ["id", "note", "value"], rows, ["id"])
+    pg_cursor.execute("SELECT id, note, value FROM bulk_load_test ORDER BY id")
+    assert merged == 2
+    assert pg_cursor.fetchall() == [(1, "last", 2.0), (2, "untouched", 0.0), (3, 'new, "quoted"', None)]
+
+
+def test_upsert_with_no_update_columns_keeps_existing_rows(pg_cursor):
+    pg_cursor.execute("INSERT INTO bulk_load_test VALUES (1, 'old', 0)")
+    upsert_rows(pg_cursor, "bulk_load_test", ["id", "note", "value"], [(1, "new", 5.0), (2, "", 1.0)], ["id"], [])
+    pg_cursor.execute("SELECT id, note, value FROM bulk_load_test ORDER BY id")
+    assert pg_cursor.fetchall() == [(1, "old", 0.0), (2, "", 1.0)]
@@ -0,0 +1,113 @@
+import os
+import sys
+import json
+
+import pytest
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data_pipeline import daemon
+
+FEED = os.path.join(os.path.dirname(__file__), "fixtures", "waqi", "feed_1451.json")
+
+
+def _payload(time_s="2025-04-10 08:00:00"):
+    with open(FEED, encoding="utf-8") as f:
+        data = json.load(f)["data"]
+    data["time"]["s"] = time_s
+    return data
+
+
+@pytest.fixture
+def ingestion(monkeypatch, tmp_path):
+    # Daemon polling one station, with WAQI and the spool replaced per test and logs written to tmp_path
+    monkeypatch.chdir(tmp_path)
+    spooled = []
+    monkeypatch.setattr(daemon, "append_to_spool", lambda payloads, labels=None: spooled.extend(payloads))
+    instance = daemon.IngestionDaemon(cities=["beijing"], bounds=[(39.0, 115.0, 41.0, 117.0)], health_port=0)
+    instance.spooled = spooled
+    yield instance, instance.schedules.setdefault("beijing", daemon.StationSchedule("beijing"))
+    instance.session.close()
+
+
+def test_schedule_learns_the_update_interval():
+    schedule = daemon.StationSchedule("beijing", interval=3600)
+    now = 1_000_000.0
+    assert schedule.polled(_payload("2025-04-10 08:00:00"), now)
+    assert not schedule.polled(_payload("2025-04-10 08:00:00"), now + 600)
+    assert schedule.polled(_payload("2025-04-10 10:00:00"), now + 1200)
+    assert 3600 < schedule.interval < 7200
+    assert schedule.unchanged_polls == 0
+
+
+def test_poll_spools_only_new_readings(monkeypatch, ingestion):
+    instance, schedule = ingestion
+    monkeypatch.setattr(daemon, "fetch_waqi_data", lambda *args, **kwargs: _payload())
+    instance._poll(schedule)
+    instance._poll(schedule)
+    assert len(instance.spooled) == 1
+    assert (schedule.polls, schedule.changes) == (2, 1)
+
+
+def test_poll_survives_payload_without_time(monkeypatch, ingestion):
+    instance, schedule = ingestion
+    broken = _payload()
+    del broken["time"]["s"]
+    monkeypatch.setattr(daemon, "fetch_waqi_data", lambda *args, **kwargs: broken)
+    instance._poll(schedule)
+    assert instance.spooled == []
+    assert schedule.failures == 1 and "missing time.s" in schedule.last_error
+    assert schedule.last_time is None
+
+
+def test_poll_retries_reading_the_spool_could_not_take(monkeypatch, ingestion):
+    instance, schedule = ingestion
+    monkeypatch.setattr(daemon, "fetch_waqi_data", lambda *args, **kwargs: _payload())
+
+    def disk_full(payloads, labels=None):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(daemon, "append_to_spool", disk_full)
+    instance._poll(schedule)
+    assert schedule.failures == 1 and schedule.last_time is None
+
+    monkeypatch.setattr(daemon, "append_to_spool", lambda payloads, labels=None: instance.spooled.extend(payloads))
+    instance._poll(schedule)
+    assert len(instance.spooled) == 1 and schedule.failures == 0
+
+
+def test_poll_bounds_survives_errors(monkeypatch, ingestion):
+    instance, _ = ingestion
+
+    def broken_regions(bounds, log_file):
+        raise RuntimeError("map endpoint down")
+
+    monkeypatch.setattr(daemon, "fetch_regions", broken_regions)
+    instance._poll_bounds()
+    assert instance.spooled == []
+    with open(os.path.join("logs", os.listdir("logs")[0])) as f:
+        assert "map endpoint down" in f.read()
+
+
+def test_flush_counts_inserted_rows_when_deduplication_fails(monkeypatch, ingestion):
+    instance, _ = ingestion
+    instance.schema_ready = True
+
+    class Connection:
+        def __enter__(self):
+            return None
+
+        def __exit__(self, *exc):
+            return False
+
+    def broken_dedupe(conn, incremental=False):
+        raise RuntimeError("canceling statement due to lock timeout")
+
+    monkeypatch.setattr(daemon, "connection", Connection)
+    monkeypatch.setattr(daemon, "flush_spool", lambda conn: (3, 2))
+    monkeypatch.setattr(daemon, "remove_observation_duplicates", broken_dedupe)
+    instance._flush()
+    assert instance.flush_state["inserted"] == 2 and instance.flush_state["last_error"] is None
+    with open(os.path.join("logs", os.listdir("logs")[0])) as f:
+        assert "ERROR: Deduplication - canceling statement" in f.read()
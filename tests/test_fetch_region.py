@@ -0,0 +1,166 @@
+import os
+import sys
+import json
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data_pipeline.ingestion.fetch_waqi import tile_bounds, map_station_payload, fetch_region
+
+# Recorded WAQI responses: map_bounds.json is one /map/bounds/ answer for the whole test region, feed_<uid>.json
+# the /feed/@uid/ answers. The stand-in server only returns the map entries inside each requested tile, as WAQI does,
+# so a station on a shared tile edge is listed by both tiles.
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "waqi")
+REGION = (38.0, 115.0, 42.0, 119.0)   # 2 x 2 tiles of 2 degrees; uid 3303 sits on the edge at lat 40
+MAP_UIDS = {1451, 1450, 3303, 1397, 1524}   # uid 12345 has no time and is left out
+
+
+def _load(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+class RecordedWAQI(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        server = self.server
+        with server.lock:
+            server.requests.append(url.path)
+            queued = server.fail.get(url.path)
+            status = queued.pop(0) if queued else 200
+        if status != 200:
+            self._send(status, {"status": "error", "data": "Service unavailable"})
+        elif url.path == "/map/bounds/":
+            south, west, north, east = (float(v) for v in parse_qs(url.query)["latlng"][0].split(","))
+            entries = [e for e in _load("map_bounds.json")["data"]
+                       if south <= e["lat"] <= north and west <= e["lon"] <= east]
+            self._send(200, {"status": "ok", "data": entries})
+        elif url.path.startswith("/feed/@"):
+            name = f"feed_{url.path.split('@')[1].strip('/')}.json"
+            if os.path.exists(os.path.join(FIXTURES, name)):
+                self._send(200, _load(name))
+            else:
+                self._send(200, {"status": "error", "data": "Unknown station"})
+        else:
+            self._send(404, {"status": "error", "data": "Not found"})
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def waqi():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RecordedWAQI)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.fail = {}   # path -> HTTP statuses to answer with before the recorded response
+    server.base_url = f"http://127.0.0.1:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _fetch(waqi, **kwargs):
+    return fetch_region(REGION, "test-token", tile_degrees=2.0, backoff=0, base_url=waqi.base_url, **kwargs)
+
+
+def test_tile_bounds_single_tile_for_small_region():
+    assert tile_bounds((39.4, 115.4, 41.1, 117.5), 5.0) == [(39.4, 115.4, 41.1, 117.5)]
+
+
+def test_tile_bounds_normalizes_corner_order():
+    assert tile_bounds((41.1, 117.5, 39.4, 115.4), 5.0) == [(39.4, 115.4, 41.1, 117.5)]
+
+
+def test_tile_bounds_exact_multiple_shares_edges():
+    tiles = tile_bounds((0.0, 0.0, 10.0, 5.0), 5.0)
+    assert tiles == [(0.0, 0.0, 5.0, 5.0), (5.0, 0.0, 10.0, 5.0)]
+
+
+def test_tile_bounds_remainder_adds_a_tile_and_keeps_outer_edges():
+    tiles = tile_bounds((0.0, 0.0, 10.5, 1.0), 5.0)
+    assert len(tiles) == 3
+    assert all(north - south <= 5.0 for south, _, north, _ in tiles)
+    assert tiles[0][0] == 0.0 and tiles[-1][2] == 10.5
+
+
+def test_tile_bounds_degenerate_box():
+    assert tile_bounds((40.0, 116.0, 40.0, 116.0), 5.0) == [(40.0, 116.0, 40.0, 116.0)]
+
+
+def test_map_station_payload_converts_iso_time_to_local_time_s():
+    entry = _load("map_bounds.json")["data"][0]
+    payload = map_station_payload(entry)
+    assert payload["time"] == {"s": "2025-04-10 08:00:00"}
+    assert payload["idx"] == 1451
+    assert payload["city"] == {"name": entry["station"]["name"], "geo": [entry["lat"], entry["lon"]]}
+    assert payload["iaqi"] == {}
+
+
+@pytest.mark.parametrize("station", [
+    {"name": "No time"},
+    {"name": "Bad time", "time": "yesterday"},
+    {"name": "Null time", "time": None},
+    None,
+])
+def test_map_station_payload_without_time_is_none(station):
+    assert map_station_payload({"uid": 1, "lat": 1.0, "lon": 2.0, "aqi": "5", "station": station}) is None
+
+
+def test_fetch_region_dedupes_stations_listed_by_several_tiles(waqi):
+    payloads, errors = _fetch(waqi)
+    assert errors == []
+    assert waqi.requests.count("/map/bounds/") == 4
+    assert sorted(p["idx"] for p in payloads) == sorted(MAP_UIDS)
+
+
+def test_fetch_region_retries_503(waqi):
+    waqi.fail["/map/bounds/"] = [503]
+    payloads, errors = _fetch(waqi, retries=2)
+    assert errors == []
+    assert waqi.requests.count("/map/bounds/") == 5
+    assert {p["idx"] for p in payloads} == MAP_UIDS
+
+
+def test_fetch_region_reports_tile_that_keeps_failing(waqi):
+    waqi.fail["/map/bounds/"] = [503, 503]
+    payloads, errors = _fetch(waqi, retries=1, max_workers=1)
+    assert len(errors) == 1 and errors[0][0].startswith("tile ")
+    # The other three tiles still come through
+    assert payloads and {p["idx"] for p in payloads} < MAP_UIDS
+
+
+def test_fetch_region_detail_replaces_map_payload(waqi):
+    payloads, errors = _fetch(waqi, needs_detail=lambda p: p["idx"] == 1451)
+    assert errors == []
+    detailed = next(p for p in payloads if p["idx"] == 1451)
+    assert detailed["iaqi"]["pm25"] == {"v": 74}
+    # Name and position stay the map's, so the station maps to the same stations row either way
+    assert detailed["city"]["name"] == "Chaoyang Agricultural Exhibition Hall, Beijing (北京朝阳农展馆)"
+    assert detailed["city"]["geo"] == [39.954592, 116.468117]
+    assert "/feed/@1451/" in waqi.requests
+
+
+def test_fetch_region_falls_back_to_map_payload_when_detail_fails(waqi):
+    waqi.fail["/feed/@3303/"] = [500, 500]
+    payloads, errors = _fetch(waqi, retries=1, needs_detail=lambda p: p["idx"] in (3303, 1397))
+    by_uid = {p["idx"]: p for p in payloads}
+    assert set(by_uid) == MAP_UIDS
+    # 3303 failed over HTTP, 1397 has no feed recorded (WAQI answers "Unknown station")
+    assert sorted(what for what, _ in errors) == ["station @1397", "station @3303"]
+    assert by_uid[3303]["iaqi"] == {} and by_uid[3303]["time"] == {"s": "2025-04-10 08:00:00"}
+    assert by_uid[1397]["aqi"] == "112"
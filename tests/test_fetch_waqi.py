@@ -0,0 +1,142 @@
+import os
+import sys
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data_pipeline.ingestion.fetch_waqi import TokenBucket, WAQIFetchError, fetch_all_cities, fetch_waqi_data
+
+# Stand-in for /feed/<city>/: the cities below answer with a recorded feed, any other city gets WAQI's
+# "Unknown station". server.fail queues HTTP statuses per path and server.delay holds every answer on a path back.
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "waqi")
+FEEDS = {"beijing": "feed_1451.json", "haidian": "feed_3303.json"}
+
+
+class FeedWAQI(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        server = self.server
+        with server.lock:
+            server.requests.append((path, time.monotonic()))
+            queued = server.fail.get(path)
+            status = queued.pop(0) if queued else 200
+            delay = server.delay.get(path, 0)
+        if delay:
+            time.sleep(delay)
+        city = path.strip("/").split("/")[-1]
+        if status != 200:
+            self._send(status, {"status": "error", "data": "Service unavailable"})
+        elif city in FEEDS:
+            with open(os.path.join(FIXTURES, FEEDS[city]), encoding="utf-8") as f:
+                self._send(200, json.load(f))
+        else:
+            self._send(200, {"status": "error", "data": "Unknown station"})
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client timed out and hung up
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def waqi():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FeedWAQI)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = []
+    server.fail = {}
+    server.delay = {}
+    server.base_url = f"http://127.0.0.1:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _paths(waqi):
+    return [path for path, _ in waqi.requests]
+
+
+def test_fetch_all_cities_keeps_order_and_reports_failures(waqi):
+    cities = ["haidian", "nowhere", "beijing"]
+    results = fetch_all_cities(cities, "test-token", max_workers=3, backoff=0, base_url=waqi.base_url)
+    assert [city for city, _, _ in results] == cities
+    (_, haidian, ok1), (_, missing, error), (_, beijing, ok2) = results
+    assert ok1 is None and ok2 is None
+    assert (haidian["idx"], beijing["idx"]) == (3303, 1451)
+    assert missing is None and isinstance(error, WAQIFetchError) and "Unknown station" in str(error)
+
+
+def test_fetch_all_cities_retries_and_gives_up(waqi):
+    waqi.fail["/feed/beijing/"] = [503]
+    waqi.fail["/feed/haidian/"] = [500, 502, 504]
+    results = dict((city, (data, error)) for city, data, error in
+                   fetch_all_cities(["beijing", "haidian"], "test-token", retries=2, backoff=0, base_url=waqi.base_url))
+    assert results["beijing"][0]["idx"] == 1451
+    assert isinstance(results["haidian"][1], requests.HTTPError)
+    assert _paths(waqi).count("/feed/beijing/") == 2
+    assert _paths(waqi).count("/feed/haidian/") == 3
+
+
+def test_fetch_all_cities_with_no_cities(waqi):
+    assert fetch_all_cities([], "test-token", base_url=waqi.base_url) == []
+    assert waqi.requests == []
+
+
+def test_timeout_is_retried_then_raised(waqi):
+    waqi.delay["/feed/beijing/"] = 1.0
+    start = time.monotonic()
+    with pytest.raises(WAQIFetchError, match="beijing") as excinfo:
+        fetch_waqi_data("beijing", "test-token", timeout=0.2, retries=1, backoff=0, base_url=waqi.base_url)
+    assert isinstance(excinfo.value.__cause__, requests.Timeout)
+    assert _paths(waqi).count("/feed/beijing/") == 2
+    # Two attempts of 0.2 s each, neither waits for the server's 1 s answer
+    assert time.monotonic() - start < 0.9
+
+
+def test_timeout_fails_only_the_slow_city(waqi):
+    waqi.delay["/feed/haidian/"] = 1.0
+    results = fetch_all_cities(["beijing", "haidian"], "test-token", timeout=0.2, retries=0, base_url=waqi.base_url)
+    assert results[0][1]["idx"] == 1451 and results[0][2] is None
+    assert results[1][1] is None and isinstance(results[1][2].__cause__, requests.Timeout)
+
+
+def test_token_bucket_spends_the_burst_then_holds_the_rate():
+    bucket = TokenBucket(rate=20.0, capacity=5)
+    start = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    assert time.monotonic() - start < 0.05
+    for _ in range(10):
+        bucket.acquire()
+    # 10 requests past the burst at 20/s
+    assert 0.45 <= time.monotonic() - start < 0.8
+
+
+def test_fetch_all_cities_respects_the_rate(waqi):
+    rate = 20.0
+    results = fetch_all_cities(["beijing"] * 12, "test-token", max_workers=6, rate=rate, burst=2,
+                               base_url=waqi.base_url)
+    assert all(error is None for _, _, error in results)
+    times = sorted(at for _, at in waqi.requests)
+    # 2 go out at once, the other 10 are spaced 1/rate apart no matter how many workers wait
+    assert times[-1] - times[0] >= (len(times) - 2) / rate * 0.9
+    window = [at for at in times if at - times[0] <= 0.25]
+    assert len(window) <= 2 + 0.25 * rate + 1
@@ -0,0 +1,125 @@
+import os
+import sys
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data_pipeline.cleaning.fill_gaps import interpolate_gaps
+
+COLUMNS = ["pm25", "o3"]
+
+
+def _reference(df, max_gap, method):
+    # Station by station with pandas: interpolate inside known values only, then empty the cells whose known
+    # neighbours are more than max_gap apart
+    expected = df.copy()
+    for _, group in df.groupby("station_id"):
+        for col in COLUMNS:
+            series = group.set_index("datetime")[col] if method == "time" else group[col].reset_index(drop=True)
+            filled = series.interpolate(method=method if method == "time" else "linear", limit_area="inside")
+            if max_gap is not None:
+                known = group["datetime"].where(group[col].notna())
+                span = known.bfill() - known.ffill()
+                filled[(span > max_gap).to_numpy()] = np.nan
+            expected.loc[group.index, col] = filled.to_numpy()
+    return expected
+
+
+def _frame(stations=3, rows=60, missing=0.4, seed=0):
+    # Irregular hourly timestamps (steps of 1-4 h) and runs of missing values, sorted by station_id, datetime
+    rng = np.random.default_rng(seed)
+    frames = []
+    for station_id in range(1, stations + 1):
+        steps = rng.integers(1, 5, size=rows)
+        times = pd.Timestamp("2025-04-01") + pd.to_timedelta(np.cumsum(steps), unit="h")
+        values = rng.uniform(0, 200, size=(rows, len(COLUMNS)))
+        values[rng.random((rows, len(COLUMNS))) < missing] = np.nan
+        frame = pd.DataFrame(values, columns=COLUMNS)
+        frame.insert(0, "datetime", times)
+        frame.insert(0, "station_id", station_id)
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _assert_matches_reference(df, max_gap, method):
+    filled, fillable = interpolate_gaps(df, columns=COLUMNS, max_gap=max_gap, method=method)
+    expected = _reference(df, max_gap, method)
+    np.testing.assert_allclose(filled[COLUMNS].to_numpy(), expected[COLUMNS].to_numpy(), rtol=1e-9, equal_nan=True)
+    assert (fillable == (df[COLUMNS].isna() & expected[COLUMNS].notna()).to_numpy()).all()
+    return filled, fillable
+
+
+@pytest.mark.parametrize("method", ["time", "index"])
+@pytest.mark.parametrize("max_gap", [None, timedelta(hours=6), timedelta(hours=3)])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_matches_pandas_interpolate(method, max_gap, seed):
+    _assert_matches_reference(_frame(seed=seed), max_gap, method)
+
+
+def test_time_and_index_weights_differ_on_uneven_steps():
+    df = pd.DataFrame({
+        "station_id": 1,
+        "datetime": pd.to_datetime(["2025-04-01 00:00", "2025-04-01 01:00", "2025-04-01 04:00"]),
+        "pm25": [0.0, np.nan, 40.0],
+        "o3": [np.nan, 5.0, np.nan],
+    })
+    by_time, _ = _assert_matches_reference(df, None, "time")
+    by_index, _ = _assert_matches_reference(df, None, "index")
+    assert by_time["pm25"][1] == pytest.approx(10.0)
+    assert by_index["pm25"][1] == pytest.approx(20.0)
+
+
+def test_max_gap_is_inclusive():
+    df = pd.DataFrame({
+        "station_id": 1,
+        "datetime": pd.to_datetime(["2025-04-01 00:00", "2025-04-01 03:00", "2025-04-01 06:00",
+                                    "2025-04-01 09:00", "2025-04-01 16:00"]),
+        "pm25": [0.0, np.nan, 60.0, np.nan, 130.0],
+        "o3": np.nan,
+    })
+    filled, _ = _assert_matches_reference(df, timedelta(hours=6), "time")
+    # 00:00-06:00 is exactly 6 h apart and filled, 06:00-16:00 is 10 h apart and left empty
+    assert filled["pm25"][1] == pytest.approx(30.0)
+    assert np.isnan(filled["pm25"][3])
+
+
+def test_leading_and_trailing_gaps_stay_missing_per_station():
+    # Station 1 ends and station 2 starts with missing values: nothing is carried across the station boundary
+    df = pd.DataFrame({
+        "station_id": [1, 1, 1, 1, 2, 2, 2, 2],
+        "datetime": pd.to_datetime(["2025-04-01 00:00", "2025-04-01 01:00", "2025-04-01 02:00", "2025-04-01 03:00"] * 2),
+        "pm25": [np.nan, 10.0, 20.0, np.nan, np.nan, np.nan, 50.0, 70.0],
+        "o3": [1.0, np.nan, np.nan, 4.0, np.nan, 2.0, np.nan, np.nan],
+    })
+    filled, fillable = _assert_matches_reference(df, None, "time")
+    assert filled["pm25"].isna().tolist() == [True, False, False, True, True, True, False, False]
+    assert filled["o3"].tolist()[:4] == pytest.approx([1.0, 2.0, 3.0, 4.0])
+    assert fillable.sum() == 2
+
+
+def test_single_point_runs():
+    # A station with one row, a column with one known value, and single missing cells between known ones
+    df = pd.DataFrame({
+        "station_id": [1, 2, 2, 2, 2, 2],
+        "datetime": pd.to_datetime(["2025-04-01 00:00", "2025-04-01 00:00", "2025-04-01 01:00", "2025-04-01 02:00",
+                                    "2025-04-01 03:00", "2025-04-01 04:00"]),
+        "pm25": [np.nan, 1.0, np.nan, 3.0, np.nan, 5.0],
+        "o3": [7.0, np.nan, np.nan, 9.0, np.nan, np.nan],
+    })
+    filled, fillable = _assert_matches_reference(df, timedelta(hours=2), "time")
+    assert filled["pm25"].tolist()[1:] == pytest.approx([1.0, 2.0, 3.0, 4.0, 5.0])
+    assert np.isnan(filled["pm25"][0]) and filled["o3"][0] == 7.0
+    assert filled["o3"].isna().sum() == 4
+    assert fillable.sum() == 2
+
+
+def test_no_missing_values_is_a_no_op():
+    df = _frame(missing=0.0)
+    filled, fillable = interpolate_gaps(df, columns=COLUMNS)
+    assert not fillable.any()
+    pd.testing.assert_frame_equal(filled, df)
@@ -0,0 +1,59 @@
+import os
+import sys
+
+import pytest
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data_pipeline.ingestion.import_manifest import (check_file, record_file, read_file, UNCHANGED, APPENDED,
+                                                     CHANGED, NEW)
+
+ROWS = b"date,pm25\n2025-04-01,74\n2025-04-02,80\n"
+
+
+@pytest.fixture
+def csv_file(tmp_path):
+    path = tmp_path / "beijing.csv"
+    path.write_bytes(ROWS)
+    return str(path), str(tmp_path / "manifest.json")
+
+
+@pytest.mark.parametrize("content", [ROWS, b"date,pm25\n2025-04-01,74", b""])
+def test_read_file_fingerprint_matches_the_stat_one(tmp_path, content):
+    path = tmp_path / "city.csv"
+    path.write_bytes(content)
+    data, fingerprint = read_file(str(path))
+    assert data == content
+    assert fingerprint == record_file("s", "city.csv", str(path), manifest_path=str(tmp_path / "m.json"))
+
+
+def test_read_file_from_offset_fingerprints_the_whole_file(csv_file):
+    path, _ = csv_file
+    tail, fingerprint = read_file(path, len(b"date,pm25\n"))
+    assert tail == b"2025-04-01,74\n2025-04-02,80\n"
+    assert fingerprint == read_file(path)[1]
+
+
+def test_rows_appended_after_the_read_are_left_for_the_next_run(csv_file):
+    path, manifest = csv_file
+    assert check_file("s", "beijing.csv", path, manifest_path=manifest)[0] == NEW
+    data, fingerprint = read_file(path)
+    with open(path, "ab") as f:
+        f.write(b"2025-04-03,91\n")
+    record_file("s", "beijing.csv", path, manifest_path=manifest, fingerprint=fingerprint)
+
+    status, entry = check_file("s", "beijing.csv", path, manifest_path=manifest)
+    assert status == APPENDED
+    tail, fingerprint = read_file(path, entry["size"])
+    assert tail == b"2025-04-03,91\n"
+    record_file("s", "beijing.csv", path, manifest_path=manifest, fingerprint=fingerprint)
+    assert check_file("s", "beijing.csv", path, manifest_path=manifest)[0] == UNCHANGED
+
+
+def test_rewritten_file_is_changed(csv_file):
+    path, manifest = csv_file
+    record_file("s", "beijing.csv", path, manifest_path=manifest, fingerprint=read_file(path)[1])
+    with open(path, "wb") as f:
+        f.write(ROWS.replace(b"74", b"75") + b"2025-04-03,91\n")
+    assert check_file("s", "beijing.csv", path, manifest_path=manifest)[0] == CHANGED
@@ -0,0 +1,142 @@
+import os
+import sys
+import json
+import copy
+
+import psycopg2
+import pytest
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data_pipeline import spool, insert_to_db
+
+FEED = os.path.join(os.path.dirname(__file__), "fixtures", "waqi", "feed_1451.json")
+
+
+def _payload(hour=8):
+    with open(FEED, encoding="utf-8") as f:
+        data = json.load(f)["data"]
+    data["time"]["s"] = f"2025-04-10 {hour:02d}:00:00"
+    return data
+
+
+class FakeDatabase:
+    # Stands in for insert_data_batch: rejects payloads whose pm25 is not a number like Postgres' ::float cast,
+    # or fails every call with `down` set
+    def __init__(self):
+        self.stored = []
+        self.down = None
+
+    def insert(self, conn, payloads, labels=None, quiet_errors=()):
+        if self.down is not None:
+            raise self.down
+        for data in payloads:
+            if isinstance(data["iaqi"].get("pm25", {}).get("v"), str):
+                raise psycopg2.errors.InvalidTextRepresentation("invalid input syntax for type double precision")
+        self.stored += payloads
+        return len(payloads)
+
+
+@pytest.fixture
+def database(monkeypatch):
+    db = FakeDatabase()
+    monkeypatch.setattr(spool, "insert_data_batch", db.insert)
+    return db
+
+
+def _dead_letters(spool_dir):
+    with open(os.path.join(spool_dir, spool.DEAD_LETTER_FILE), encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_payload_problem_accepts_a_feed_payload():
+    assert spool.payload_problem(_payload()) is None
+
+
+@pytest.mark.parametrize("break_it, problem", [
+    (lambda d: d["city"].pop("geo"), "missing city.geo"),
+    (lambda d: d["city"].update(geo=["north", 1]), "non-numeric city.geo"),
+    (lambda d: d["city"].pop("name"), "missing city.name"),
+    (lambda d: d.pop("city"), "missing city.name"),
+    (lambda d: d["time"].pop("s"), "missing time.s"),
+    (lambda d: d["time"].update(s="10/04/2025 08:00"), "unparseable time.s '10/04/2025 08:00'"),
+    (lambda d: d.update(iaqi={"pm25": 74}), "malformed iaqi"),
+])
+def test_payload_problem_names_what_is_missing(break_it, problem):
+    data = _payload()
+    break_it(data)
+    assert spool.payload_problem(data) == problem
+
+
+def test_flush_dead_letters_invalid_and_rejected_payloads(tmp_path, database):
+    spool_dir = str(tmp_path)
+    no_time = _payload(9)
+    del no_time["time"]["s"]
+    rejected = _payload(10)
+    rejected["iaqi"]["pm25"] = {"v": "n/a"}
+    good = [_payload(hour) for hour in (11, 12, 13, 14, 15)]
+    spool.append_to_spool(good[:2] + [no_time, rejected] + good[2:], spool_dir=spool_dir)
+    with open(os.path.join(spool_dir, spool._segments(spool_dir, spool.OPEN_SUFFIX)[0]), "a") as f:
+        f.write("not json\n")
+
+    flushed, inserted = spool.flush_spool(None, batch_size=3, spool_dir=spool_dir)
+
+    assert (flushed, inserted) == (5, 5)
+    assert [d["time"]["s"] for d in database.stored] == [d["time"]["s"] for d in good]
+    assert [r["reason"] for r in _dead_letters(spool_dir)] == [
+        "missing time.s",
+        "rejected: InvalidTextRepresentation: invalid input syntax for type double precision",
+        "unreadable spool line",
+    ]
+    assert spool.dead_letter_count(spool_dir) == 3
+    assert spool.spool_backlog(spool_dir) == (0, 0)
+
+
+def test_flush_keeps_the_batch_when_the_database_is_unreachable(tmp_path, database):
+    spool_dir = str(tmp_path)
+    spool.append_to_spool([_payload(hour) for hour in (8, 9, 10)], spool_dir=spool_dir)
+    database.down = psycopg2.OperationalError("server closed the connection unexpectedly")
+
+    with pytest.raises(psycopg2.OperationalError):
+        spool.flush_spool(None, spool_dir=spool_dir)
+    assert spool.spool_backlog(spool_dir)[0] == 1
+    assert spool.dead_letter_count(spool_dir) == 0
+
+    database.down = None
+    assert spool.flush_spool(None, spool_dir=spool_dir) == (3, 3)
+    assert spool.spool_backlog(spool_dir) == (0, 0)
+
+
+def test_insert_or_quarantine_isolates_each_rejected_payload(tmp_path, database):
+    payloads = [_payload(hour) for hour in range(8, 16)]
+    for index in (1, 6):
+        payloads[index] = copy.deepcopy(payloads[index])
+        payloads[index]["iaqi"]["pm25"] = {"v": "-"}
+    labels = [f"p{index}" for index in range(len(payloads))]
+
+    inserted, dead = spool._insert_or_quarantine(None, payloads, labels, str(tmp_path))
+
+    assert (inserted, dead) == (6, 2)
+    assert [r["label"] for r in _dead_letters(str(tmp_path))] == ["p1", "p6"]
+
+
+class BrokenConnection:
+    def cursor(self):
+        return None
+
+    def rollback(self):
+        pass
+
+
+@pytest.mark.parametrize("quiet_errors, printed", [((), True), (spool.DATA_ERRORS, False)])
+def test_insert_error_is_printed_unless_quiet(monkeypatch, capsys, quiet_errors, printed):
+    def reject(cur, payloads):
+        raise psycopg2.errors.InvalidTextRepresentation("invalid input syntax for type double precision")
+
+    monkeypatch.setattr(insert_to_db, "is_warmed", lambda: True)
+    monkeypatch.setattr(insert_to_db, "split_unchanged", lambda payloads, labels: (payloads, labels, []))
+    monkeypatch.setattr(insert_to_db, "_resolve_station_ids", reject)
+    with pytest.raises(psycopg2.DataError):
+        insert_to_db.insert_data_batch(BrokenConnection(), [_payload()], quiet_errors=quiet_errors)
+    assert ("[WAQI Error]" in capsys.readouterr().out) == printed